@@ -0,0 +1,208 @@
+"""
+Асинхронные (ASGI) версии эндпоинтов чтения.
+
+DRF 3.14 не умеет async-представления, поэтому GET обслуживается нативными
+async-функциями Django на async ORM, а остальные методы передаются в обычные
+DRF-представления через sync_to_async. Ответы совпадают с синхронными
+вариантами: используются те же сериализаторы (карточки — app/cards.py), пагинация, кэши и ETag.
+Подключаются в app/urls.py при ASYNC_READ_VIEWS = True (по умолчанию под ASGI).
+"""
+import asyncio
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.db import close_old_connections, connection
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+from rest_framework.exceptions import APIException, NotFound
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+
+from . import cards, category_tree, facets, feed, images, routers, views
+from .conditional import (
+    patch_product_cache_control, patch_reference_cache_control, product_etag, product_validators, reference_etag,
+    reference_last_modified,
+)
+from .models import Category, CategoryImage, City, Product, ProductFavorite
+from .pagination import KeysetPagination
+from .serializers import CategorySerializer, CitySerializer, ProductSerializer
+
+
+def render(data, status=200):
+    return HttpResponse(JSONRenderer().render(data), status=status, content_type='application/json')
+
+
+async def authenticate(request, view_class):
+    """DRF Request с пользователем из JWT; сам поиск пользователя в базе — в потоке."""
+    drf_request = Request(request, authenticators=[auth() for auth in view_class.authentication_classes])
+    await sync_to_async(lambda: drf_request.user)()
+    return drf_request
+
+
+async def run_in_threads(*calls):
+    """
+    Выполняет синхронные вызовы (func, *args) параллельно, каждый в своём потоке со
+    своим соединением с базой, а не по очереди в общем потоке async ORM. Внутри
+    открытой транзакции (ATOMIC_REQUESTS, тесты) другие соединения не видят её
+    данных, поэтому тогда вызовы идут в общем потоке.
+    """
+    parallel = not await sync_to_async(lambda: connection.in_atomic_block)()
+
+    def wrap(func, *args):
+        def call():
+            try:
+                return func(*args)
+            finally:
+                if parallel:
+                    close_old_connections()
+        return sync_to_async(call, thread_sensitive=not parallel)()
+    return await asyncio.gather(*(wrap(*call) for call in calls))
+
+
+def read_path(sync_view):
+    """GET/HEAD — асинхронно, остальные методы — исходным DRF-представлением."""
+    sync_view = sync_to_async(sync_view)
+
+    def decorator(async_get):
+        @wraps(async_get)
+        async def view(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return await sync_view(request, *args, **kwargs)
+            try:
+                return await async_get(request, *args, **kwargs)
+            except APIException as exc:
+                return render({'detail': exc.detail}, status=exc.status_code)
+        view.csrf_exempt = True
+        return view
+    return decorator
+
+
+async def paginated_products(request, queryset):
+    paginator = KeysetPagination()
+    page_queryset = paginator.get_page_queryset(cards.card_queryset(queryset), request)
+    page = paginator.set_page([row async for row in page_queryset])
+    data = await cards.aserialize_cards(page, {'request': request})
+    return paginator.get_paginated_response(data).data
+
+
+async def reference_response(request, models, build, status=200, keys=()):
+    etag = quote_etag(await sync_to_async(reference_etag)(request, models, keys))
+    last_modified = await sync_to_async(reference_last_modified)(models, keys)
+    response = get_conditional_response(request, etag=etag, last_modified=int(last_modified.timestamp()))
+    if response is None:
+        response = render(await build(), status=status)
+    response.headers.setdefault('ETag', etag)
+    response.headers.setdefault('Last-Modified', http_date(last_modified.timestamp()))
+    return patch_reference_cache_control(response)
+
+
+@read_path(views.get_city_list)
+async def city_list(request):
+    async def build():
+        return CitySerializer([city async for city in City.objects.all()], many=True).data
+    return await reference_response(request, (City,), build)
+
+
+@read_path(views.get_category_list)
+async def category_list(request):
+    async def build():
+        categories = [category async for category in Category.objects.filter(parent_id=None)]
+        return CategorySerializer(categories, many=True).data
+    return await reference_response(request, (Category, CategoryImage), build, keys=(images.DERIVATIVES_VERSION_KEY,))
+
+
+@read_path(views.get_category_tree)
+async def category_tree_view(request):
+    category_id = request.GET.get('category')
+    status = 200
+    if category_id:
+        data = await sync_to_async(category_tree.get_subtree)(int(category_id)) if category_id.isdigit() else None
+        if data is None:
+            # как и в синхронном варианте, ETag и условный GET действуют и для 404
+            data, status = {'error': 'Category not found'}, 404
+    else:
+        data = await sync_to_async(category_tree.get_roots)()
+
+    async def build():
+        return data
+    return await reference_response(request, (Category, CategoryImage), build, status)
+
+
+@read_path(views.ProductList.as_view())
+async def product_list(request):
+    request = await authenticate(request, views.ProductList)
+    await sync_to_async(routers.use_replica)(request)
+    params = request.query_params
+    user = request.user
+    own = params.get('own', False)
+    status = params.get('status', 'ACTIVE')
+    queryset = Product.objects.all()
+
+    if user.is_authenticated and own:
+        queryset = queryset.filter(author=user, status=status).with_favorite(user)
+        return render(await paginated_products(request, queryset))
+
+    city_id = None
+    if 'city' in params:
+        city_id = int(params['city'])
+        queryset = queryset.filter(city_id=city_id)
+    else:
+        queryset = queryset.filter(status='AC')
+
+    queryset = queryset.filter(status=status).with_favorite(None)
+    data = await feed.aget_page(request, city_id, status, lambda: paginated_products(request, queryset))
+    return render(await feed.aoverlay_favorites(data, user))
+
+
+@read_path(views.ProductSearchView.as_view())
+async def product_search(request):
+    request = await authenticate(request, views.ProductSearchView)
+    await sync_to_async(routers.use_replica)(request)
+    view = views.ProductSearchView(request=request, args=(), kwargs={}, format_kwarg=None)
+    queryset = view.get_filtered_queryset()
+
+    # фасеты считаются параллельно с выборкой страницы, а сериализуется страница после обоих
+    paginator = KeysetPagination()
+    page_queryset = paginator.get_page_queryset(
+        cards.card_queryset(queryset.with_favorite(request.user)), request, view,
+    )
+    facets_data, rows = await run_in_threads(
+        (facets.get_facets, queryset, view.get_filters()),
+        (list, page_queryset),
+    )
+    view.set_facets(facets_data)
+    page = paginator.set_page(rows)
+    data = paginator.get_paginated_response(
+        await cards.aserialize_cards(page, view.get_serializer_context()),
+    ).data
+    data['facets'] = facets_data
+    return render(data)
+
+
+@read_path(views.ProductDetail.as_view())
+async def product_detail(request, pk):
+    request = await authenticate(request, views.ProductDetail)
+    user = request.user
+
+    row = await Product.objects.filter(pk=pk).values_list('updated_at', 'city_id').afirst()
+    if row is None:
+        raise NotFound
+    version, modified_at = await sync_to_async(product_validators)(*row)
+    is_favorite = user.is_authenticated and await ProductFavorite.objects.filter(
+        product_id=pk, user_id=user.id,
+    ).aexists()
+    etag = quote_etag(product_etag(version, user, is_favorite))
+    last_modified = None if user.is_authenticated else int(modified_at.timestamp())
+
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        product = await Product.objects.with_related().with_favorite(user).aget(pk=pk)
+        if request.auth and product.author_id != user.id:
+            response = render("Вы не являетесь автором этого продукта", status=403)
+        else:
+            response = render(ProductSerializer(product, context={'request': request}).data)
+    response.headers.setdefault('ETag', etag)
+    if last_modified is not None:
+        response.headers.setdefault('Last-Modified', http_date(last_modified))
+    return patch_product_cache_control(response, user)
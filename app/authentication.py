@@ -0,0 +1,103 @@
+"""
+JWT-аутентификация с кэшем пользователей.
+
+JWTAuthentication загружает User из базы на каждый запрос. CachedJWTAuthentication
+держит пользователей в LRU-кэше процесса (AUTH_USER_CACHE_SIZE записей, не дольше
+AUTH_USER_CACHE_TIMEOUT секунд) вместе с версией токенов пользователя из
+app/versions.py. Любое сохранение или удаление пользователя (смена пароля,
+деактивация, правка профиля) увеличивает версию. Версия хранится в кэше
+MODEL_VERSION_CACHE; если он общий для воркеров (``shared`` в backend/settings.py),
+запись перестаёт подходить во всех процессах сразу, иначе — не позже чем через
+AUTH_USER_CACHE_TIMEOUT секунд. Изменения через QuerySet.update() версию не
+трогают и тоже видны лишь по истечении AUTH_USER_CACHE_TIMEOUT.
+"""
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+
+from . import versions
+
+VERSION_KEY = 'user_token_version:{}'
+
+
+def get_token_version(user_id):
+    return versions.get_named_tokens(VERSION_KEY.format(user_id))[0]
+
+
+def bump_token_version(user_id):
+    versions.bump_named(VERSION_KEY.format(user_id))
+
+
+class UserCache:
+    """Потокобезопасный LRU: user_id -> (пользователь, версия, срок годности)."""
+
+    def __init__(self, size, timeout):
+        self.size = size
+        self.timeout = timeout
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id, version):
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return None
+            user, entry_version, expires_at = entry
+            if entry_version != version or expires_at < time.monotonic():
+                del self._entries[user_id]
+                return None
+            self._entries.move_to_end(user_id)
+            return user
+
+    def set(self, user_id, version, user):
+        with self._lock:
+            self._entries[user_id] = (user, version, time.monotonic() + self.timeout)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+_user_cache = None
+_user_cache_lock = threading.Lock()
+
+
+def get_user_cache():
+    global _user_cache
+    with _user_cache_lock:
+        if _user_cache is None:
+            _user_cache = UserCache(
+                size=getattr(settings, 'AUTH_USER_CACHE_SIZE', 10000),
+                timeout=getattr(settings, 'AUTH_USER_CACHE_TIMEOUT', 30),
+            )
+    return _user_cache
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_('Token contained no recognizable user identification'))
+
+        # версия читается до загрузки: если её увеличат во время загрузки,
+        # запись со старой версией просто не будет использована
+        version = get_token_version(user_id)
+        cache = get_user_cache()
+        user = cache.get(user_id, version)
+        if user is None:
+            user = super().get_user(validated_token)
+            cache.set(user_id, version, user)
+        # экземпляр из кэша общий для всех запросов и потоков, отдаём копию
+        return copy.copy(user)
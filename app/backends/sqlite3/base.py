@@ -0,0 +1,46 @@
+"""
+SQLite с настройками для конкурентной нагрузки.
+
+Подключается как ENGINE = 'app.backends.sqlite3'. Дополнительные ключи OPTIONS:
+
+* ``pragmas`` — PRAGMA, выполняемые на каждом новом соединении (WAL,
+  synchronous=NORMAL, mmap_size, cache_size, busy_timeout, temp_store);
+  значения по умолчанию — DEFAULT_PRAGMAS;
+* ``transaction_mode`` — режим BEGIN для atomic(): DEFERRED (как в Django),
+  IMMEDIATE или EXCLUSIVE. IMMEDIATE берёт блокировку записи в начале
+  транзакции и ждёт её с busy_timeout, а не получает «database is locked»
+  при попытке повысить блокировку чтения посреди транзакции.
+"""
+from django.core.exceptions import ImproperlyConfigured
+from django.db.backends.sqlite3 import base
+
+DEFAULT_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'mmap_size': 256 * 1024 * 1024,
+    'cache_size': -64000,  # в КиБ
+    'busy_timeout': 5000,  # мс
+    'temp_store': 'MEMORY',
+}
+TRANSACTION_MODES = ('DEFERRED', 'IMMEDIATE', 'EXCLUSIVE')
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+
+    def get_connection_params(self):
+        kwargs = super().get_connection_params()
+        self.pragmas = {**DEFAULT_PRAGMAS, **kwargs.pop('pragmas', {})}
+        self.transaction_mode = kwargs.pop('transaction_mode', 'DEFERRED').upper()
+        if self.transaction_mode not in TRANSACTION_MODES:
+            raise ImproperlyConfigured(f'transaction_mode must be one of {", ".join(TRANSACTION_MODES)}')
+        return kwargs
+
+    def get_new_connection(self, conn_params):
+        conn = super().get_new_connection(conn_params)
+        for pragma, value in self.pragmas.items():
+            if value is not None:
+                conn.execute(f'PRAGMA {pragma} = {value}')
+        return conn
+
+    def _start_transaction_under_autocommit(self):
+        self.cursor().execute(f'BEGIN {self.transaction_mode}')
@@ -0,0 +1,100 @@
+"""
+Быстрый сериализатор карточек товаров для списков.
+
+Выдаёт ровно тот же JSON, что ProductSerializer, но без моделей и полей DRF:
+товары читаются через values(), фото и характеристики — двумя запросами
+values_list() на страницу, а словари собираются в обычном Python.
+Товары должны быть аннотированы is_favorite (Product.objects.with_favorite()).
+"""
+from collections import defaultdict
+
+from django.core.files.storage import default_storage
+
+from . import images
+from .models import Product, ProductFeature, ProductImage
+
+PRODUCT_VALUES = (
+    'id', 'name', 'description', 'price', 'price_suffix', 'is_lower_bound', 'category_id', 'city_id', 'city__name',
+    'author_id', 'author__username', 'author__email', 'author__phone', 'is_favorite',
+)
+PRICE_SUFFIX_DISPLAY = dict(Product.PriceSuffix.choices)
+
+
+def card_queryset(queryset):
+    """values()-выборка для карточек; аннотации для сортировки (search_rank и т. п.) сохраняются."""
+    extra = [name for name in queryset.query.annotations if name not in PRODUCT_VALUES]
+    return queryset.values(*PRODUCT_VALUES, 'created_at', *extra)
+
+
+def images_query(product_ids):
+    return ProductImage.objects.filter(product_id__in=product_ids).order_by('id').values_list('product_id', 'id', 'image')
+
+
+def features_query(product_ids):
+    return ProductFeature.objects.filter(product_id__in=product_ids).order_by('id').values_list(
+        'product_id', 'name', 'value',
+    )
+
+
+def fetch_related(rows):
+    product_ids = [row['id'] for row in rows]
+    if not product_ids:
+        return [], []
+    return list(images_query(product_ids)), list(features_query(product_ids))
+
+
+def build_cards(rows, image_rows, feature_rows, context=None):
+    context = context or {}
+    min_price_filtered = context.get('min_price')
+    max_price_filtered = context.get('max_price')
+
+    images_by_product = defaultdict(list)
+    for product_id, image_id, name in image_rows:
+        images_by_product[product_id].append({
+            'id': image_id,
+            'img': default_storage.url(name) if name else None,
+            'srcset': images.get_srcset_by_name(name) if name else None,
+        })
+    features_by_product = defaultdict(list)
+    for product_id, name, value in feature_rows:
+        features_by_product[product_id].append({'name': name, 'value': value})
+
+    cards = []
+    for row in rows:
+        price = row['price']
+        cards.append({
+            'id': row['id'],
+            'images': images_by_product.get(row['id'], []),
+            'name': row['name'],
+            'description': row['description'],
+            'price': price,
+            'price_suffix': str(PRICE_SUFFIX_DISPLAY.get(row['price_suffix'], row['price_suffix'])),
+            'is_lower_bound': row['is_lower_bound'],
+            'category': row['category_id'],
+            'city_id': row['city_id'],
+            'city_name': row['city__name'],
+            'min_price': price if min_price_filtered is None else min(price, min_price_filtered),
+            'max_price': price if max_price_filtered is None else max(price, max_price_filtered),
+            'features': features_by_product.get(row['id'], []),
+            'is_favorite': bool(row.get('is_favorite', False)),
+            'author': {
+                'id': row['author_id'],
+                'username': row['author__username'],
+                'email': row['author__email'],
+                'phone': row['author__phone'],
+            },
+        })
+    return cards
+
+
+def serialize_cards(rows, context=None):
+    return build_cards(rows, *fetch_related(rows), context=context)
+
+
+async def aserialize_cards(rows, context=None):
+    product_ids = [row['id'] for row in rows]
+    if not product_ids:
+        return []
+    image_rows = [row async for row in images_query(product_ids)]
+    feature_rows = [row async for row in features_query(product_ids)]
+    return build_cards(rows, image_rows, feature_rows, context=context)
@@ -0,0 +1,104 @@
+"""
+Кэш дерева категорий.
+
+Дерево строится за один проход по ``Category.objects.all()`` и хранится в памяти
+процесса. Актуальность проверяется по версии Category и CategoryImage (app.versions),
+поэтому дерево всегда читается из основной базы (routers.primary_reads);
+копия дерева для других процессов лежит в кэше ``CATEGORY_TREE_CACHE``.
+"""
+import threading
+
+from django.conf import settings
+from django.core.cache import caches
+
+from . import routers, versions
+from .models import Category, CategoryImage
+
+TREE_KEY = 'category_tree:tree:{}'
+TREE_TIMEOUT = 60 * 60 * 24
+
+_lock = threading.Lock()
+_local = {'version': None, 'tree': None}
+
+
+def _get_cache():
+    return caches[getattr(settings, 'CATEGORY_TREE_CACHE', 'default')]
+
+
+def get_version():
+    return versions.get_version(Category, CategoryImage)
+
+
+def build_tree():
+    nodes = {}
+    parents = {}
+    with routers.primary_reads():
+        categories = list(Category.objects.order_by('id'))
+    for category in categories:
+        nodes[category.id] = {
+            'value': category.id,
+            'title': category.name,
+            'children': [],
+            'image': category.image.url if category.image else None,
+        }
+        parents[category.id] = category.parent_id
+
+    roots = []
+    for category_id, node in nodes.items():
+        parent_id = parents[category_id]
+        if parent_id is None:
+            roots.append(node)
+        else:
+            nodes[parent_id]['children'].append(node)
+    return {'roots': roots, 'nodes': nodes, 'parents': parents}
+
+
+def get_tree():
+    version = get_version()
+    if _local['version'] == version:
+        return _local['tree']
+
+    with _lock:
+        if _local['version'] == version:
+            return _local['tree']
+        cache = _get_cache()
+        tree = cache.get(TREE_KEY.format(version))
+        if tree is None:
+            tree = build_tree()
+            cache.set(TREE_KEY.format(version), tree, timeout=TREE_TIMEOUT)
+        _local['version'] = version
+        _local['tree'] = tree
+    return tree
+
+
+def get_roots():
+    return get_tree()['roots']
+
+
+def get_ancestor_ids(category_id):
+    """Сама категория и все её предки до корня."""
+    parents = get_tree()['parents']
+    ancestor_ids = []
+    while category_id is not None and category_id in parents:
+        ancestor_ids.append(category_id)
+        category_id = parents[category_id]
+    return ancestor_ids
+
+
+def get_subtree(category_id):
+    """
+    Потомки категории в порядке обхода в ширину, а в конце — сама категория.
+    Возвращает None, если категории нет.
+    """
+    node = get_tree()['nodes'].get(category_id)
+    if node is None:
+        return None
+    descendants = []
+    queue = list(node['children'])
+    while queue:
+        child = queue.pop(0)
+        descendants.append(child)
+        queue.extend(child['children'])
+    descendants.append(node)
+    return descendants
+
@@ -0,0 +1,23 @@
+from django.conf import settings
+from django.core.checks import Tags, Warning, register
+
+LOCAL_CACHE_BACKENDS = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.filebased.FileBasedCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+@register(Tags.caches, deploy=True)
+def check_shared_cache(app_configs, **kwargs):
+    """Счётчики изменений и метки чтения после записи должны жить в общем для всех машин кэше."""
+    alias = getattr(settings, 'MODEL_VERSION_CACHE', 'default')
+    backend = settings.CACHES.get(alias, {}).get('BACKEND')
+    if backend not in LOCAL_CACHE_BACKENDS:
+        return []
+    return [Warning(
+        f'Кэш "{alias}" (MODEL_VERSION_CACHE) использует {backend}: он не общий для воркеров разных машин, '
+        f'а файловый к тому же просматривает весь каталог при каждой записи.',
+        hint='Укажите SHARED_CACHE_URL=redis://... (нужен пакет redis).',
+        id='app.W001',
+    )]
@@ -0,0 +1,128 @@
+"""
+Условные GET-запросы (ETag / Last-Modified) поверх django.views.decorators.http.condition.
+
+Версия ответа считается без сериализации: по счётчикам изменений моделей
+(app.versions) для справочников и по Product.updated_at для карточки товара.
+Карточка содержит ещё контакты автора и название города, а ссылки на фото
+меняются, когда готовы превью, — всё это не трогает updated_at, поэтому в её
+версию входят поколение ленты города (его увеличивают изменения автора и
+города, см. app.signals) и счётчик готовых превью images.DERIVATIVES_VERSION_KEY.
+Счётчики лежат в общем для воркеров кэше MODEL_VERSION_CACHE, поэтому ETag и
+Last-Modified одинаковы, каким бы воркером ни был обслужен запрос.
+Если клиент прислал совпадающий If-None-Match или If-Modified-Since, отдаётся 304.
+"""
+import hashlib
+from functools import wraps
+
+from django.conf import settings
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.views.decorators.http import condition
+
+from . import feed, images, versions
+from .models import Product, ProductFavorite
+
+
+def _etag(*parts):
+    return hashlib.md5('|'.join(str(part) for part in parts).encode('utf-8')).hexdigest()
+
+
+def _reference_keys(models, keys):
+    return [*versions.model_keys(*models), *keys]
+
+
+def reference_etag(request, models, keys=()):
+    return _etag(versions.get_named_version(*_reference_keys(models, keys)), request.get_full_path())
+
+
+def reference_last_modified(models, keys=()):
+    return versions.get_named_last_modified(*_reference_keys(models, keys))
+
+
+def patch_reference_cache_control(response):
+    if response.status_code in (200, 304):
+        patch_cache_control(response, public=True, max_age=getattr(settings, 'REFERENCE_DATA_MAX_AGE', 300))
+    return response
+
+
+def reference_data(*models, keys=()):
+    """
+    Декоратор для эндпоинтов справочников, зависящих только от моделей models,
+    именованных счётчиков keys и строки запроса. Ответ можно кэшировать в CDN на
+    REFERENCE_DATA_MAX_AGE секунд.
+    """
+    def etag_func(request, *args, **kwargs):
+        return reference_etag(request, models, keys)
+
+    def last_modified_func(request, *args, **kwargs):
+        return reference_last_modified(models, keys)
+
+    def decorator(view):
+        conditional_view = condition(etag_func=etag_func, last_modified_func=last_modified_func)(view)
+
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            return patch_reference_cache_control(conditional_view(request, *args, **kwargs))
+        return wrapper
+    return decorator
+
+
+def product_validators(updated_at, city_id):
+    """Версия карточки товара и её Last-Modified."""
+    tokens = versions.get_named_tokens(feed.generation_key(city_id), images.DERIVATIVES_VERSION_KEY)
+    version = '-'.join([updated_at.isoformat(), *(str(token) for token in tokens)])
+    return version, max(updated_at, versions.to_datetime(max(tokens)))
+
+
+def product_etag(version, user, is_favorite):
+    if not user.is_authenticated:
+        return _etag(version)
+    return _etag(version, user.id, is_favorite)
+
+
+def patch_product_cache_control(response, user):
+    if response.status_code in (200, 304):
+        if user.is_authenticated:
+            patch_cache_control(response, private=True, no_cache=True)
+        else:
+            patch_cache_control(response, public=True, max_age=getattr(settings, 'PRODUCT_DETAIL_MAX_AGE', 60))
+        patch_vary_headers(response, ('Authorization',))
+    return response
+
+
+class ConditionalRetrieveMixin:
+    """
+    Условный GET для карточки товара (версия — product_validators). Для
+    авторизованных пользователей ETag учитывает пользователя и его избранное, а
+    кэш — приватный.
+    """
+    product_url_kwarg = 'pk'
+
+    def get_validators(self, request):
+        if not hasattr(request, '_product_validators'):
+            row = Product.objects.filter(
+                pk=self.kwargs[self.product_url_kwarg],
+            ).values_list('updated_at', 'city_id').first()
+            request._product_validators = product_validators(*row) if row is not None else None
+        return request._product_validators
+
+    def product_etag(self, request, *args, **kwargs):
+        validators = self.get_validators(request)
+        if validators is None:
+            return None
+        is_favorite = request.user.is_authenticated and ProductFavorite.objects.filter(
+            product_id=self.kwargs[self.product_url_kwarg], user_id=request.user.id,
+        ).exists()
+        return product_etag(validators[0], request.user, is_favorite)
+
+    def product_last_modified(self, request, *args, **kwargs):
+        # избранное не меняет версию товара, поэтому для авторизованных — только ETag
+        validators = self.get_validators(request)
+        if request.user.is_authenticated or validators is None:
+            return None
+        return validators[1]
+
+    def get(self, request, *args, **kwargs):
+        response = condition(
+            etag_func=self.product_etag, last_modified_func=self.product_last_modified,
+        )(super().get)(request, *args, **kwargs)
+        return patch_product_cache_control(response, request.user)
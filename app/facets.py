@@ -0,0 +1,84 @@
+"""
+Фасеты для результатов поиска: диапазон цен, количество товаров по категориям
+(с учётом вложенных категорий), по городам и гистограмма цен.
+
+Считаются двумя запросами независимо от фильтров: агрегат min/max/count и одна
+группировка по (категория, город, корзина цены), которая сворачивается в Python.
+
+Результат кэшируется по набору фильтров, общему поколению ленты (app.feed — оно
+меняется при любом изменении товаров) и версии категорий, так что после записи
+фасеты пересчитываются сразу. Поиск читает с реплик, и фасеты, посчитанные по
+отстающей реплике, могут отставать не дольше SEARCH_FACETS_CACHE_TIMEOUT секунд.
+"""
+import hashlib
+import json
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, ExpressionWrapper, F, IntegerField, Max, Min
+
+from . import category_tree, feed
+
+HISTOGRAM_BUCKETS = 10
+CACHE_KEY = 'search_facets:{generation}:{categories}:{filters}'
+
+
+def get_cache_key(filters):
+    normalized = {key: str(value).strip().lower() for key, value in filters.items() if value not in (None, '')}
+    digest = hashlib.sha1(json.dumps(normalized, sort_keys=True).encode('utf-8')).hexdigest()
+    return CACHE_KEY.format(generation=feed.get_generation(), categories=category_tree.get_version(), filters=digest)
+
+
+def compute_facets(queryset, buckets=HISTOGRAM_BUCKETS):
+    queryset = queryset.order_by()
+    summary = queryset.aggregate(min_price=Min('price'), max_price=Max('price'), total=Count('id'))
+    min_price, max_price = summary['min_price'], summary['max_price']
+    facets = {
+        'total': summary['total'],
+        'price': {'min': min_price, 'max': max_price},
+        'categories': [],
+        'cities': [],
+        'histogram': [],
+    }
+    if not summary['total']:
+        return facets
+
+    width = (max_price - min_price) // buckets + 1
+    cells = queryset.values('category_id', 'city_id').annotate(
+        bucket=ExpressionWrapper((F('price') - min_price) / width, output_field=IntegerField()),
+    ).values('category_id', 'city_id', 'bucket').annotate(count=Count('id'))
+
+    categories, cities, histogram = Counter(), Counter(), Counter()
+    for cell in cells:
+        for category_id in category_tree.get_ancestor_ids(cell['category_id']):
+            categories[category_id] += cell['count']
+        cities[cell['city_id']] += cell['count']
+        histogram[cell['bucket']] += cell['count']
+
+    facets['categories'] = [{'id': key, 'count': count} for key, count in sorted(categories.items())]
+    facets['cities'] = [
+        {'id': key, 'count': count} for key, count in sorted(cities.items(), key=lambda item: item[0] or 0)
+    ]
+    facets['histogram'] = [
+        {
+            'from': min_price + bucket * width,
+            'to': min(min_price + (bucket + 1) * width - 1, max_price),
+            'count': histogram[bucket],
+        }
+        for bucket in range((max_price - min_price) // width + 1)
+    ]
+    return facets
+
+
+def get_facets(queryset, filters):
+    """
+    Фасеты для отфильтрованного queryset, закэшированные по нормализованному
+    набору фильтров и поколению данных на SEARCH_FACETS_CACHE_TIMEOUT секунд.
+    """
+    key = get_cache_key(filters)
+    facets = cache.get(key)
+    if facets is None:
+        facets = compute_facets(queryset)
+        cache.set(key, facets, timeout=getattr(settings, 'SEARCH_FACETS_CACHE_TIMEOUT', 60))
+    return facets
@@ -0,0 +1,104 @@
+"""
+Кэш публичной ленты товаров (ProductList без own).
+
+Страница ленты одинакова для всех пользователей, поэтому сериализованный ответ
+кэшируется по городу, статусу и курсору. В ключ входит поколение ленты города —
+счётчик из app.versions в общем для воркеров кэше. Он увеличивается сигналами
+при изменении товара, его фото и характеристик, а также автора и города, чьи
+данные попадают в карточку. Изменения в обход сигналов (QuerySet.update,
+сырой SQL) ленту не сбрасывают: такая страница живёт до FEED_CACHE_TIMEOUT.
+Страница строится по основной базе (routers.primary_reads): по отстающей
+реплике под новым поколением закэшировались бы старые данные.
+Персональное поле is_favorite накладывается поверх общей записи отдельным запросом.
+"""
+import hashlib
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+
+from . import routers, versions
+from .models import Product, ProductFavorite
+
+ALL_CITIES = 'all'
+GENERATION_KEY = 'feed_generation:{}'
+PAGE_KEY = 'feed:{city}:{status}:{generation}:{request}'
+
+
+def generation_key(city_id):
+    return GENERATION_KEY.format(city_id if city_id is not None else ALL_CITIES)
+
+
+def bump(*city_ids):
+    """Сбрасывает ленты городов и общую ленту без фильтра по городу."""
+    keys = {generation_key(None)}
+    keys.update(generation_key(city_id) for city_id in city_ids if city_id is not None)
+    versions.bump_named(*keys)
+
+
+def bump_product(product_id):
+    bump(Product.objects.filter(pk=product_id).values_list('city_id', flat=True).first())
+
+
+def bump_author(user_id):
+    """Сбрасывает ленты городов, где есть товары пользователя: карточка содержит его контакты."""
+    city_ids = Product.objects.filter(author_id=user_id).values_list('city_id', flat=True).distinct()
+    if city_ids:
+        bump(*city_ids)
+
+
+def get_generation(city_id=None):
+    """Поколение ленты города; без города — общее, оно меняется при любом изменении товаров."""
+    return versions.get_named_tokens(generation_key(city_id))[0]
+
+
+def get_cache_key(request, city_id, status):
+    generation = get_generation(city_id)
+    digest = hashlib.md5(request.build_absolute_uri().encode('utf-8')).hexdigest()
+    return PAGE_KEY.format(city=city_id or ALL_CITIES, status=status, generation=generation, request=digest)
+
+
+def get_page(request, city_id, status, build):
+    key = get_cache_key(request, city_id, status)
+    data = cache.get(key)
+    if data is None:
+        with routers.primary_reads():
+            data = build()
+        cache.set(key, data, timeout=getattr(settings, 'FEED_CACHE_TIMEOUT', 300))
+    return data
+
+
+async def aget_page(request, city_id, status, build):
+    """Асинхронный вариант get_page: build — корутина, строящая страницу."""
+    key = await sync_to_async(get_cache_key)(request, city_id, status)
+    data = await cache.aget(key)
+    if data is None:
+        with routers.primary_reads():
+            data = await build()
+        await cache.aset(key, data, timeout=getattr(settings, 'FEED_CACHE_TIMEOUT', 300))
+    return data
+
+
+def _favorites_query(data, user):
+    ids = [item['id'] for item in data['results']]
+    return ProductFavorite.objects.filter(user_id=user.id, product_id__in=ids).values_list('product_id', flat=True)
+
+
+def _apply_favorites(data, favorite_ids):
+    return {
+        **data,
+        'results': [{**item, 'is_favorite': item['id'] in favorite_ids} for item in data['results']],
+    }
+
+
+def overlay_favorites(data, user):
+    """Копия страницы с is_favorite текущего пользователя — один запрос на страницу."""
+    if not user.is_authenticated or not data['results']:
+        return data
+    return _apply_favorites(data, set(_favorites_query(data, user)))
+
+
+async def aoverlay_favorites(data, user):
+    if not user.is_authenticated or not data['results']:
+        return data
+    return _apply_favorites(data, {product_id async for product_id in _favorites_query(data, user)})
@@ -0,0 +1,235 @@
+"""
+Производные изображения (превью) для товаров и категорий.
+
+Для каждого оригинала создаются уменьшенные копии IMAGE_DERIVATIVE_SIZES в WebP и
+JPEG. Имена детерминированы: derivatives/<путь оригинала без расширения>_<размер>.<формат>,
+поэтому повторная генерация ничего не делает. Генерация идёт в пуле потоков после
+коммита транзакции либо лениво при первой отдаче ссылок на изображение.
+
+Готовность превью проверяется по хранилищу один раз: имена готовых оригиналов
+запоминаются в памяти процесса (не больше IMAGE_READY_CACHE_SIZE), так что
+отдача ссылок на страницу карточек не обращается к хранилищу. После генерации
+увеличивается счётчик DERIVATIVES_VERSION_KEY (app.versions): он входит в ETag
+ответов со ссылками на превью, ведь ссылки меняются без изменения самих записей.
+"""
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import wraps
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadhandler import TemporaryFileUploadHandler
+from PIL import Image, ImageOps
+
+from . import versions
+
+logger = logging.getLogger(__name__)
+
+DERIVATIVES_DIR = 'derivatives'
+DERIVATIVES_VERSION_KEY = 'image_derivatives'
+DEFAULT_SIZES = {'thumb': 160, 'card': 480, 'full': 1280}
+FORMATS = {'webp': ('WEBP', {'quality': 80, 'method': 4}), 'jpeg': ('JPEG', {'quality': 82, 'optimize': True})}
+
+_executor = None
+_upload_executor = None
+_executor_lock = threading.Lock()
+_pending = set()
+_ready = set()
+
+
+class InvalidImage(Exception):
+    """Загруженный файл не удалось декодировать (обрезан, повреждён или слишком велик)."""
+
+
+def get_sizes():
+    return getattr(settings, 'IMAGE_DERIVATIVE_SIZES', DEFAULT_SIZES)
+
+
+def derivative_name(name, size, fmt):
+    root, _ = os.path.splitext(name)
+    return f'{DERIVATIVES_DIR}/{root}_{size}.{fmt}'
+
+
+def _marker_name(name):
+    # файл, который пишется последним: если он есть, готовы все размеры
+    sizes = list(get_sizes())
+    return derivative_name(name, sizes[-1], list(FORMATS)[-1])
+
+
+def _mark_ready(name):
+    if len(_ready) >= getattr(settings, 'IMAGE_READY_CACHE_SIZE', 100000):
+        _ready.clear()
+    _ready.add(name)
+
+
+def is_ready(name):
+    if name in _ready:
+        return True
+    if default_storage.exists(_marker_name(name)):
+        _mark_ready(name)
+        return True
+    return False
+
+
+def generate_derivatives(name):
+    if not name or is_ready(name):
+        return
+    with default_storage.open(name, 'rb') as original:
+        image = Image.open(original)
+        image = ImageOps.exif_transpose(image)
+        image = image.convert('RGB')
+
+    for size, max_side in get_sizes().items():
+        resized = image.copy()
+        resized.thumbnail((max_side, max_side), Image.LANCZOS)
+        for fmt, (pil_format, options) in FORMATS.items():
+            target = derivative_name(name, size, fmt)
+            buffer = BytesIO()
+            resized.save(buffer, pil_format, **options)
+            if default_storage.exists(target):
+                default_storage.delete(target)
+            default_storage.save(target, ContentFile(buffer.getvalue()))
+    _mark_ready(name)
+    versions.bump_named(DERIVATIVES_VERSION_KEY)
+
+
+def delete_derivatives(name):
+    _ready.discard(name)
+    for size in get_sizes():
+        for fmt in FORMATS:
+            target = derivative_name(name, size, fmt)
+            if default_storage.exists(target):
+                default_storage.delete(target)
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, 'IMAGE_DERIVATIVE_WORKERS', 2),
+                thread_name_prefix='image-derivatives',
+            )
+    return _executor
+
+
+def _get_upload_executor():
+    global _upload_executor
+    with _executor_lock:
+        if _upload_executor is None:
+            _upload_executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, 'IMAGE_UPLOAD_WORKERS', 4),
+                thread_name_prefix='image-upload',
+            )
+    return _upload_executor
+
+
+def temporary_file_uploads(view):
+    """
+    Загрузки представления пишутся во временные файлы, а не в память; ставится
+    снаружи @api_view, до разбора тела запроса.
+    """
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        request.upload_handlers = [TemporaryFileUploadHandler(request)]
+        return view(request, *args, **kwargs)
+    return wrapper
+
+
+def store_upload(uploaded, field):
+    """
+    Декодирует загруженный файл, поворачивает по EXIF, уменьшает до
+    IMAGE_UPLOAD_MAX_SIDE и перекодирует без метаданных. Возвращает имя в хранилище.
+
+    Валидация ImageField читает только заголовок, поэтому обрезанный или
+    повреждённый файл обнаруживается здесь и даёт InvalidImage.
+    """
+    uploaded.seek(0)
+    max_side = getattr(settings, 'IMAGE_UPLOAD_MAX_SIDE', 2560)
+    buffer = BytesIO()
+    try:
+        image = Image.open(uploaded)
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((max_side, max_side), Image.LANCZOS)
+
+        has_alpha = image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info)
+        if has_alpha:
+            image.convert('RGBA').save(buffer, 'PNG', optimize=True)
+            extension = '.png'
+        else:
+            image.convert('RGB').save(buffer, 'JPEG', quality=88, optimize=True)
+            extension = '.jpg'
+    except (OSError, Image.DecompressionBombError) as exc:
+        raise InvalidImage(uploaded.name) from exc
+
+    root, _ = os.path.splitext(os.path.basename(uploaded.name))
+    name = field.generate_filename(None, f'{root}{extension}')
+    return default_storage.save(name, ContentFile(buffer.getvalue()))
+
+
+def store_uploads(files, field):
+    """
+    Обрабатывает и сохраняет загрузки параллельно; при ошибке в любом файле
+    удаляет уже сохранённые и поднимает первую ошибку.
+    """
+    futures = [_get_upload_executor().submit(store_upload, uploaded, field) for uploaded in files]
+    names, error = [], None
+    for future in futures:
+        try:
+            names.append(future.result())
+        except Exception as exc:
+            error = error or exc
+    if error is not None:
+        discard(names)
+        raise error
+    return names
+
+
+def discard(names):
+    for name in names:
+        default_storage.delete(name)
+
+
+def _run(name):
+    try:
+        generate_derivatives(name)
+    except Exception:
+        logger.exception('Не удалось создать превью для %s', name)
+    finally:
+        _pending.discard(name)
+
+
+def schedule(name):
+    """Ставит генерацию превью в пул потоков (не чаще одного раза на имя одновременно)."""
+    if not name or name in _pending:
+        return
+    if not getattr(settings, 'IMAGE_DERIVATIVES_ASYNC', True):
+        _run(name)
+        return
+    _pending.add(name)
+    _get_executor().submit(_run, name)
+
+
+def get_srcset(image):
+    """
+    Ссылки на превью: {'thumb': {'webp': url, 'jpeg': url}, ...}. Пока превью не
+    готовы, все размеры указывают на оригинал, а генерация ставится в очередь.
+    """
+    if not image:
+        return None
+    return get_srcset_by_name(image.name)
+
+
+def get_srcset_by_name(name):
+    if not is_ready(name):
+        schedule(name)
+        url = default_storage.url(name)
+        return {size: {fmt: url for fmt in FORMATS} for size in get_sizes()}
+    return {
+        size: {fmt: default_storage.url(derivative_name(name, size, fmt)) for fmt in FORMATS}
+        for size in get_sizes()
+    }
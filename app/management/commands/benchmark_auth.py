@@ -0,0 +1,58 @@
+import statistics
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+from rest_framework.request import Request
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from app.authentication import CachedJWTAuthentication, get_user_cache
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        'Замеряет накладные расходы аутентификации на запрос: JWTAuthentication против '
+        'CachedJWTAuthentication (мкс и SQL-запросы на запрос). Тестовый пользователь '
+        'создаётся во временной транзакции.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                user = get_user_model().objects.create(username='benchmark-auth', phone='benchmark-auth')
+                token = str(RefreshToken.for_user(user).access_token)
+                request = RequestFactory().get('/api/user/', HTTP_AUTHORIZATION=f'Bearer {token}')
+                get_user_cache().clear()
+                for label, authenticator in (
+                    ('JWTAuthentication', JWTAuthentication()),
+                    ('CachedJWTAuthentication', CachedJWTAuthentication()),
+                ):
+                    self.measure(label, authenticator, request, options['requests'])
+                raise Rollback
+        except Rollback:
+            pass
+
+    def measure(self, label, authenticator, request, count):
+        timings = []
+        with CaptureQueriesContext(connection) as queries:
+            for _ in range(count):
+                started = time.perf_counter()
+                authenticator.authenticate(Request(request))
+                timings.append(time.perf_counter() - started)
+        timings.sort()
+        self.stdout.write(
+            f'{label:24} p50={statistics.median(timings) * 1e6:7.1f}мкс '
+            f'p99={timings[int(len(timings) * 0.99) - 1] * 1e6:7.1f}мкс '
+            f'запросов на запрос={len(queries.captured_queries) / count:.2f}'
+        )
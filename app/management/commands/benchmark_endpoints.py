@@ -0,0 +1,284 @@
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import tempfile
+import time
+import tracemalloc
+from collections import namedtuple
+from io import BytesIO
+
+import django
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext, override_settings, setup_test_environment, \
+    teardown_test_environment
+from django.utils import timezone
+from PIL import Image
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from app import urls
+from app.models import Category, Product, ProductImage, User
+from app.seeding import CatalogSeeder
+
+BENCHMARK_PASSWORD = 'benchmark-password'
+
+Endpoint = namedtuple('Endpoint', 'name method route path data format auth write', defaults=(None, 'json', False, False))
+
+
+class Command(BaseCommand):
+    help = (
+        'Прогоняет все маршруты app/urls.py через тестовый клиент Django на синтетическом каталоге '
+        '(10k/100k/1M товаров: --products) и сообщает p50/p95/p99, число SQL-запросов и пиковую память '
+        'на эндпоинт. Каталог создаётся в отдельной базе benchmark-<товаров>.sqlite3 и переиспользуется '
+        'между запусками; пишущие запросы выполняются в откатываемых транзакциях. Результат сохраняется '
+        'в JSON (--output), предыдущий результат можно передать в --compare.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=10_000)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--database', help='файл базы, по умолчанию benchmark-<товаров>.sqlite3')
+        parser.add_argument('--reseed', action='store_true', help='пересоздать каталог в базе')
+        parser.add_argument('--repeat', type=int, default=50, help='замеров на эндпоинт')
+        parser.add_argument('--warmup', type=int, default=3)
+        parser.add_argument('--cold-cache', action='store_true', help='очищать кэш перед каждым запросом')
+        parser.add_argument('--only', nargs='+', default=[], help='имена эндпоинтов')
+        parser.add_argument('--output', default='benchmark-endpoints.json')
+        parser.add_argument('--compare', help='JSON предыдущего запуска')
+
+    def handle(self, *args, **options):
+        database = options['database'] or str(settings.BASE_DIR / f'benchmark-{options["products"]}.sqlite3')
+        connection.settings_dict['TEST'] = {**connection.settings_dict.get('TEST', {}), 'NAME': database}
+        # загруженные файлы и превью не должны попадать в MEDIA_ROOT проекта
+        media_root = tempfile.mkdtemp(prefix='benchmark-media-')
+        shutil.copy(os.path.join(settings.MEDIA_ROOT, 'default_image.png'), media_root)
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False, keepdb=True)
+        try:
+            with override_settings(DATABASE_REPLICAS=[], MEDIA_ROOT=media_root):
+                self.prepare(options)
+                results = self.run(options)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0, keepdb=True)
+            teardown_test_environment()
+            shutil.rmtree(media_root, ignore_errors=True)
+        self.save(results, options)
+        if options['compare']:
+            self.compare(results, options['compare'])
+
+    def prepare(self, options):
+        if options['reseed']:
+            call_command('flush', interactive=False, verbosity=0)
+        existing = Product.objects.count()
+        if not existing:
+            started = time.perf_counter()
+            CatalogSeeder(options['products'], seed=options['seed']).run(log=self.stdout.write)
+            self.stdout.write(f'каталог создан за {time.perf_counter() - started:.1f} с')
+        elif existing != options['products']:
+            self.stderr.write(f'в базе уже {existing} товаров, используется она (--reseed, чтобы пересоздать)')
+
+    def get_endpoints(self):
+        # пользователь — продавец с объявлениями и избранным, от его имени идут запросы с токеном
+        product = Product.objects.filter(status=Product.Status.ACTIVE).order_by('-id').first()
+        user = User.objects.get(pk=product.author_id)
+        user.set_password(BENCHMARK_PASSWORD)
+        user.save()
+        self.user = user
+        self.refresh = RefreshToken.for_user(user)
+
+        root = Category.objects.filter(parent=None).order_by('id').first()
+        city_id = product.city_id
+        other = Product.objects.exclude(author_id=user.pk).order_by('id').values_list('id', flat=True).first()
+        image = ProductImage.objects.filter(product_id=product.pk).order_by('id').first()
+        item = {
+            'name': 'Ударная дрель makita', 'description': 'Описание', 'price': 1500, 'price_suffix': 'N',
+            'is_lower_bound': False, 'category': product.category_id, 'city': city_id,
+            'features': [{'name': 'Мощность', 'value': '900 Вт'}],
+        }
+
+        return [
+            Endpoint('category_tree', 'get', 'category/tree', '/category/tree'),
+            Endpoint('category_subtree', 'get', 'category/tree', f'/category/tree?category={root.pk}'),
+            Endpoint('category_list', 'get', 'category', '/category'),
+            Endpoint('city_list', 'get', 'city', '/city'),
+            Endpoint('feed', 'get', 'product', '/product?status=AC'),
+            Endpoint('feed_city', 'get', 'product', f'/product?city={city_id}&status=AC'),
+            Endpoint('feed_city_auth', 'get', 'product', f'/product?city={city_id}&status=AC', auth=True),
+            Endpoint('feed_own', 'get', 'product', '/product?own=1&status=AC', auth=True),
+            Endpoint('search_name', 'get', 'search/', '/search/?name=дрель'),
+            Endpoint('search_category_price', 'get', 'search/', f'/search/?category={root.pk}&ordering=price'),
+            Endpoint(
+                'search_all_filters', 'get', 'search/',
+                f'/search/?name=makita&city={city_id}&category={root.pk}&minRange=100&maxRange=100000',
+                auth=True,
+            ),
+            Endpoint('product_detail', 'get', 'product/<int:pk>/', f'/product/{product.pk}/'),
+            Endpoint('product_detail_auth', 'get', 'product/<int:pk>/', f'/product/{product.pk}/', auth=True),
+            Endpoint('user', 'get', 'api/user/', '/api/user/', auth=True),
+            Endpoint('user_favorites', 'get', 'api/user/favorites/', '/api/user/favorites/', auth=True),
+            Endpoint('product_create', 'post', 'product', '/product', item, auth=True, write=True),
+            Endpoint('product_bulk', 'post', 'product/bulk', '/product/bulk', [item] * 20, auth=True, write=True),
+            Endpoint(
+                'product_update', 'patch', 'product/<int:pk>/', f'/product/{product.pk}/',
+                {'price': 2000, 'features': [{'name': 'Мощность', 'value': '1200 Вт'}]}, auth=True, write=True,
+            ),
+            Endpoint('product_delete', 'delete', 'product/<int:pk>/', f'/product/{product.pk}/', auth=True, write=True),
+            Endpoint(
+                'image_upload', 'post', 'product/<int:product_id>/image', f'/product/{product.pk}/image',
+                lambda: {'images': [self.make_upload()]}, format='multipart', auth=True, write=True,
+            ),
+            Endpoint(
+                'image_delete', 'delete', 'products/<int:product_id>/images/<int:image_id>/',
+                f'/products/{product.pk}/images/{image.pk}/', auth=True, write=True,
+            ),
+            Endpoint(
+                'token_obtain', 'post', 'api/token/', '/api/token/',
+                {'username': user.username, 'password': BENCHMARK_PASSWORD}, write=True,
+            ),
+            Endpoint(
+                'token_refresh', 'post', 'api/token/refresh/', '/api/token/refresh/',
+                {'refresh': str(self.refresh)}, write=True,
+            ),
+            Endpoint(
+                'register', 'post', 'api/auth/register/', '/api/auth/register/',
+                {
+                    'username': 'benchmark-new', 'email': 'benchmark-new@example.com', 'password': 'secret-password',
+                    'first_name': 'Иван', 'last_name': 'Иванов', 'phone': 'benchmark-new',
+                },
+                write=True,
+            ),
+            Endpoint(
+                'favorite_toggle', 'post', 'product/<int:product_id>/favorite/', f'/product/{other}/favorite/',
+                auth=True, write=True,
+            ),
+            Endpoint(
+                'favorites_sync', 'post', 'api/user/favorites/sync', '/api/user/favorites/sync',
+                {'add': [other, product.pk], 'remove': [other + 1]}, auth=True, write=True,
+            ),
+        ]
+
+    @staticmethod
+    def make_upload():
+        buffer = BytesIO()
+        Image.effect_noise((1600, 1200), 64).convert('RGB').save(buffer, 'JPEG', quality=90)
+        return SimpleUploadedFile('benchmark.jpg', buffer.getvalue(), 'image/jpeg')
+
+    def run(self, options):
+        endpoints = self.get_endpoints()
+        uncovered = {str(pattern.pattern) for pattern in urls.urlpatterns} - {endpoint.route for endpoint in endpoints}
+        if uncovered:
+            self.stderr.write(f'маршруты без замеров: {", ".join(sorted(uncovered))}')
+        if options['only']:
+            endpoints = [endpoint for endpoint in endpoints if endpoint.name in options['only']]
+
+        anonymous = APIClient()
+        authenticated = APIClient()
+        authenticated.credentials(HTTP_AUTHORIZATION=f'Bearer {self.refresh.access_token}')
+
+        results = {}
+        # чтения раньше записей: откаченные записи всё равно сбрасывают версии кэшей
+        for endpoint in sorted(endpoints, key=lambda endpoint: endpoint.write):
+            client = authenticated if endpoint.auth else anonymous
+            result = self.measure(client, endpoint, options)
+            results[endpoint.name] = result
+            self.stdout.write(
+                f'{endpoint.name:22} {endpoint.method.upper():6} {result["status"]} '
+                f'p50={result["p50_ms"]:8.2f}мс p95={result["p95_ms"]:8.2f}мс p99={result["p99_ms"]:8.2f}мс '
+                f'запросов={result["queries"]:<3} память={result["peak_memory_kib"]:8.1f}КиБ'
+            )
+        return results
+
+    def request(self, client, endpoint, cold_cache):
+        if cold_cache:
+            cache.clear()
+        data = endpoint.data() if callable(endpoint.data) else endpoint.data
+        call = getattr(client, endpoint.method)
+        if not endpoint.write:
+            return call(endpoint.path)
+        with transaction.atomic():
+            response = call(endpoint.path, data, format=endpoint.format)
+            transaction.set_rollback(True)
+        return response
+
+    def measure(self, client, endpoint, options):
+        for _ in range(options['warmup']):
+            self.request(client, endpoint, options['cold_cache'])
+
+        # память меряется отдельным запросом: tracemalloc заметно замедляет выполнение
+        tracemalloc.start()
+        try:
+            self.request(client, endpoint, options['cold_cache'])
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+        timings, query_counts, statuses = [], [], set()
+        for _ in range(options['repeat']):
+            with CaptureQueriesContext(connection) as queries:
+                started = time.perf_counter()
+                response = self.request(client, endpoint, options['cold_cache'])
+                timings.append(time.perf_counter() - started)
+            query_counts.append(len(queries.captured_queries))
+            statuses.add(response.status_code)
+
+        quantiles = statistics.quantiles(timings, n=100) if len(timings) > 1 else timings * 99
+        return {
+            'method': endpoint.method.upper(),
+            'path': endpoint.path,
+            'status': ','.join(str(status) for status in sorted(statuses)),
+            'requests': len(timings),
+            'p50_ms': round(quantiles[49] * 1000, 3),
+            'p95_ms': round(quantiles[94] * 1000, 3),
+            'p99_ms': round(quantiles[98] * 1000, 3),
+            'mean_ms': round(statistics.fmean(timings) * 1000, 3),
+            'queries': round(statistics.median(query_counts)),
+            'max_queries': max(query_counts),
+            'peak_memory_kib': round(peak / 1024, 1),
+        }
+
+    def save(self, results, options):
+        try:
+            commit = subprocess.run(
+                ['git', 'rev-parse', 'HEAD'], cwd=settings.BASE_DIR, capture_output=True, text=True, check=True,
+            ).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            commit = None
+        report = {
+            'meta': {
+                'commit': commit,
+                'created_at': timezone.now().isoformat(),
+                'products': options['products'],
+                'seed': options['seed'],
+                'repeat': options['repeat'],
+                'cold_cache': options['cold_cache'],
+                'async_read_views': settings.ASYNC_READ_VIEWS,
+                'python': platform.python_version(),
+                'django': django.get_version(),
+            },
+            'endpoints': results,
+        }
+        with open(options['output'], 'w', encoding='utf-8') as output:
+            json.dump(report, output, ensure_ascii=False, indent=2)
+        self.stdout.write(f'результаты: {options["output"]}')
+
+    def compare(self, results, path):
+        with open(path, encoding='utf-8') as previous_file:
+            previous = json.load(previous_file)
+        self.stdout.write(f'сравнение с {path} (коммит {previous["meta"].get("commit")}):')
+        for name, result in results.items():
+            before = previous['endpoints'].get(name)
+            if before is None:
+                continue
+            change = (result['p50_ms'] / before['p50_ms'] - 1) * 100 if before['p50_ms'] else 0
+            self.stdout.write(
+                f'{name:22} p50 {before["p50_ms"]:8.2f} -> {result["p50_ms"]:8.2f}мс ({change:+6.1f}%) '
+                f'запросов {before["queries"]} -> {result["queries"]}'
+            )
@@ -0,0 +1,43 @@
+import time
+from io import BytesIO
+
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management.base import BaseCommand
+from PIL import Image
+
+from app import images
+from app.models import ProductImage
+
+
+class Command(BaseCommand):
+    help = 'Замеряет обработку загрузки фотографий (по умолчанию 10 шт. по 12 Мп): последовательно и в пуле потоков'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=10)
+        parser.add_argument('--width', type=int, default=4000)
+        parser.add_argument('--height', type=int, default=3000)
+
+    def make_uploads(self, count, width, height):
+        image = Image.effect_noise((width, height), 64).convert('RGB')
+        buffer = BytesIO()
+        image.save(buffer, 'JPEG', quality=92)
+        content = buffer.getvalue()
+        self.stdout.write(f'Файл: {width}x{height}, {len(content) / 1024 / 1024:.1f} МБ')
+        return [SimpleUploadedFile(f'bench_{i}.jpg', content, 'image/jpeg') for i in range(count)]
+
+    def handle(self, *args, **options):
+        field = ProductImage._meta.get_field('image')
+        uploads = self.make_uploads(options['count'], options['width'], options['height'])
+
+        started = time.perf_counter()
+        names = [images.store_upload(uploaded, field) for uploaded in uploads]
+        serial = time.perf_counter() - started
+        images.discard(names)
+
+        started = time.perf_counter()
+        names = images.store_uploads(uploads, field)
+        pooled = time.perf_counter() - started
+        images.discard(names)
+
+        self.stdout.write(f'последовательно: {serial:.2f} с')
+        self.stdout.write(f'пул потоков:     {pooled:.2f} с (x{serial / pooled:.1f})')
@@ -0,0 +1,42 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+
+from app import search
+from app.models import Product
+
+DEFAULT_QUERIES = ['дрель', 'ударная дрель', 'перфоратор', 'болгарк', 'аккумуляторный шуруповерт', 'makita']
+
+
+class Command(BaseCommand):
+    help = 'Замеряет задержку поиска товаров: полнотекстовый бэкенд против name__icontains'
+
+    def add_arguments(self, parser):
+        parser.add_argument('queries', nargs='*', default=DEFAULT_QUERIES)
+        parser.add_argument('--repeat', type=int, default=20)
+        parser.add_argument('--limit', type=int, default=20, help='размер страницы результатов')
+
+    def handle(self, *args, **options):
+        base = Product.objects.filter(status=Product.Status.ACTIVE)
+        # прогрев: создаёт бэкенд (search.backend ленивый) и открывает соединение
+        search.backend.filter(base, 'x').exists()
+        self.stdout.write(f'Товаров: {Product.objects.count()}, бэкенд: {search.backend.__class__.__name__}')
+
+        for query in options['queries']:
+            for label, build in (
+                ('fts', lambda: search.backend.filter(base, query)),
+                ('icontains', lambda: base.filter(name__icontains=query).order_by('-created_at')),
+            ):
+                timings = []
+                found = 0
+                for _ in range(options['repeat']):
+                    started = time.perf_counter()
+                    found = len(list(build().values_list('id', flat=True)[:options['limit']]))
+                    timings.append((time.perf_counter() - started) * 1000)
+                quantiles = statistics.quantiles(timings, n=100) if len(timings) > 1 else timings * 99
+                self.stdout.write(
+                    f'{query!r:32} {label:10} найдено={found:<4} '
+                    f'p50={quantiles[49]:8.2f}мс '
+                    f'p95={quantiles[94]:8.2f}мс'
+                )
@@ -0,0 +1,93 @@
+import statistics
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from rest_framework.renderers import JSONRenderer
+
+from app import cards
+from app.models import Category, City, Product, ProductFeature, ProductImage
+from app.serializers import ProductSerializer
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        'Сравнивает ProductSerializer и карточки на values() (app/cards.py): мкс на товар для страниц '
+        'разного размера, выборка+сериализация и только сериализация. Недостающие товары создаются '
+        'во временной транзакции, которая затем откатывается.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[20, 200, 2000])
+        parser.add_argument('--repeat', type=int, default=10)
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                self.populate(max(options['sizes']))
+                for size in options['sizes']:
+                    self.measure(size, options['repeat'])
+                raise Rollback
+        except Rollback:
+            pass
+
+    def populate(self, size):
+        missing = size - Product.objects.count()
+        if missing <= 0:
+            return
+        author, _ = get_user_model().objects.get_or_create(username='benchmark', defaults={'phone': '0'})
+        category = Category.objects.first() or Category.objects.create(name='benchmark')
+        city = City.objects.first() or City.objects.create(name='benchmark')
+        products = Product.objects.bulk_create(
+            Product(
+                name=f'Товар {i}', description='Описание товара ' * 10, price=100 + i,
+                status=Product.Status.ACTIVE, author=author, category=category, city=city,
+            )
+            for i in range(missing)
+        )
+        ProductImage.objects.bulk_create(ProductImage(product=product) for product in products for _ in range(3))
+        ProductFeature.objects.bulk_create(
+            ProductFeature(product=product, name=f'Характеристика {j}', value=str(j))
+            for product in products for j in range(4)
+        )
+
+    def measure(self, size, repeat):
+        queryset = Product.objects.with_favorite(None).order_by('-created_at', '-id')[:size]
+        renderer = JSONRenderer()
+
+        def full_serializer():
+            return renderer.render(ProductSerializer(list(queryset.with_related()), many=True).data)
+
+        def full_cards():
+            return renderer.render(cards.serialize_cards(list(cards.card_queryset(queryset))))
+
+        products = list(queryset.with_related())
+        rows = list(cards.card_queryset(queryset))
+        related = cards.fetch_related(rows)
+
+        def only_serializer():
+            return renderer.render(ProductSerializer(products, many=True).data)
+
+        def only_cards():
+            return renderer.render(cards.build_cards(rows, *related))
+
+        count = len(rows)
+        self.stdout.write(f'товаров на странице: {count}')
+        for label, call in (
+            ('serializer, выборка+JSON', full_serializer),
+            ('cards, выборка+JSON', full_cards),
+            ('serializer, только JSON', only_serializer),
+            ('cards, только JSON', only_cards),
+        ):
+            timings = []
+            for _ in range(repeat):
+                started = time.perf_counter()
+                call()
+                timings.append(time.perf_counter() - started)
+            per_item = statistics.median(timings) / max(count, 1) * 1_000_000
+            self.stdout.write(f'  {label:26} {per_item:8.1f} мкс/товар')
@@ -0,0 +1,123 @@
+import os
+import random
+import sqlite3
+import statistics
+import tempfile
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+
+from app.backends.sqlite3.base import DEFAULT_PRAGMAS
+
+CONFIGS = {
+    'по умолчанию': {'pragmas': {}, 'begin': 'BEGIN'},
+    'настроенный': {'pragmas': DEFAULT_PRAGMAS, 'begin': 'BEGIN IMMEDIATE'},
+}
+
+
+class Command(BaseCommand):
+    help = (
+        'Конкурентная нагрузка читателей и писателей на временную базу SQLite: стандартные '
+        'настройки (журнал DELETE, BEGIN DEFERRED) против app.backends.sqlite3 (WAL, '
+        'synchronous=NORMAL, mmap, busy_timeout, BEGIN IMMEDIATE)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--readers', type=int, default=8)
+        parser.add_argument('--writers', type=int, default=4)
+        parser.add_argument('--duration', type=float, default=5.0, help='секунд на конфигурацию')
+        parser.add_argument('--rows', type=int, default=20000)
+
+    def handle(self, *args, **options):
+        for label, config in CONFIGS.items():
+            with tempfile.TemporaryDirectory() as directory:
+                path = os.path.join(directory, 'benchmark.sqlite3')
+                self.populate(path, options['rows'])
+                result = self.run(path, config, options)
+            self.report(label, result, options['duration'])
+
+    @staticmethod
+    def connect(path, config):
+        # таймаут блокировки как у Django по умолчанию (5 с), если busy_timeout не задан в PRAGMA
+        conn = sqlite3.connect(path, timeout=5, isolation_level=None, check_same_thread=False)
+        for pragma, value in config['pragmas'].items():
+            conn.execute(f'PRAGMA {pragma} = {value}')
+        return conn
+
+    @staticmethod
+    def populate(path, rows):
+        conn = sqlite3.connect(path, isolation_level=None)
+        conn.execute('CREATE TABLE items (id INTEGER PRIMARY KEY, value INTEGER, created REAL)')
+        conn.execute('CREATE INDEX items_created ON items (created)')
+        conn.execute('BEGIN')
+        conn.executemany('INSERT INTO items (value, created) VALUES (?, ?)', ((i, i) for i in range(rows)))
+        conn.execute('COMMIT')
+        conn.close()
+
+    def run(self, path, config, options):
+        deadline = time.monotonic() + options['duration']
+        result = {'read': [], 'write': [], 'errors': 0}
+        lock = threading.Lock()
+
+        def reader():
+            conn = self.connect(path, config)
+            timings = []
+            while time.monotonic() < deadline:
+                started = time.monotonic()
+                try:
+                    conn.execute('SELECT id, value FROM items ORDER BY created DESC LIMIT 20').fetchall()
+                except sqlite3.OperationalError:
+                    with lock:
+                        result['errors'] += 1
+                    continue
+                timings.append(time.monotonic() - started)
+            with lock:
+                result['read'] += timings
+
+        def writer():
+            conn = self.connect(path, config)
+            rows = options['rows']
+            timings = []
+            while time.monotonic() < deadline:
+                started = time.monotonic()
+                item_id = random.randint(1, rows)
+                try:
+                    # чтение, затем запись в одной транзакции — как toggle избранного или правка товара
+                    conn.execute(config['begin'])
+                    value = conn.execute('SELECT value FROM items WHERE id = ?', (item_id,)).fetchone()[0]
+                    conn.execute(
+                        'UPDATE items SET value = ?, created = ? WHERE id = ?', (value + 1, time.time(), item_id),
+                    )
+                    conn.execute('INSERT INTO items (value, created) VALUES (?, ?)', (value, time.time()))
+                    conn.execute('COMMIT')
+                except sqlite3.OperationalError:
+                    if conn.in_transaction:
+                        conn.execute('ROLLBACK')
+                    with lock:
+                        result['errors'] += 1
+                    continue
+                timings.append(time.monotonic() - started)
+            with lock:
+                result['write'] += timings
+
+        threads = [threading.Thread(target=reader) for _ in range(options['readers'])]
+        threads += [threading.Thread(target=writer) for _ in range(options['writers'])]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return result
+
+    def report(self, label, result, duration):
+        self.stdout.write(f'{label}: ошибок «database is locked»: {result["errors"]}')
+        for kind in ('read', 'write'):
+            timings = sorted(result[kind])
+            if not timings:
+                self.stdout.write(f'  {kind:5} нет успешных операций')
+                continue
+            p99 = timings[max(int(len(timings) * 0.99) - 1, 0)]
+            self.stdout.write(
+                f'  {kind:5} {len(timings) / duration:9.1f} оп/с  '
+                f'p50={statistics.median(timings) * 1000:7.2f}мс p99={p99 * 1000:7.2f}мс'
+            )
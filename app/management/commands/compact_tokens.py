@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from app import tokens
+
+
+class Command(BaseCommand):
+    help = 'Удаляет просроченные токены из таблиц чёрного списка JWT пачками и сообщает, сколько строк удалено'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=None)
+        parser.add_argument('--max-batches', type=int, default=None, help='остановиться после N пачек')
+
+    def handle(self, *args, **options):
+        reclaimed = tokens.compact(batch_size=options['batch_size'], max_batches=options['max_batches'])
+        self.stdout.write(
+            f'Удалено outstanding: {reclaimed["outstanding"]}, blacklisted: {reclaimed["blacklisted"]} '
+            f'(пачек: {reclaimed["batches"]})'
+        )
@@ -0,0 +1,81 @@
+import re
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+
+from app import search
+from app.models import CategoryClosure, Product, ProductFavorite, User
+
+# «SCAN t» без индекса — полный проход по таблице; «SCAN t USING INDEX» — упорядоченный обход индекса
+FULL_SCAN_RE = re.compile(r'\bSCAN \w+$')
+TEMP_SORT_RE = re.compile(r'USE TEMP B-TREE FOR (ORDER BY|GROUP BY|DISTINCT)')
+
+
+def hot_queries():
+    """
+    Запросы из ProductList, ProductSearchView, избранного и обновления JWT в том виде,
+    в каком их строят вьюхи и simplejwt. План не зависит от размера таблиц, поэтому
+    проверка на маленькой базе верна и для таблиц токенов на миллионы строк.
+    """
+    active = Product.objects.filter(status=Product.Status.ACTIVE)
+    newest = ('-created_at', '-id')
+    now = timezone.now()
+    user = User(id=1)
+    return [
+        ('ProductList: активные', active.order_by(*newest)[:21]),
+        ('ProductList: город', active.filter(city_id=1).order_by(*newest)[:21]),
+        ('ProductList: город, следующая страница',
+         active.filter(city_id=1, created_at__lt=now).order_by(*newest)[:21]),
+        ('ProductList: свои', Product.objects.filter(author_id=1, status='MD').order_by(*newest)[:21]),
+        ('ProductSearchView: категория', active.filter(category__ancestor_links__ancestor_id=1).order_by(*newest)[:21]),
+        ('ProductSearchView: по цене', active.order_by('price', 'id')[:21]),
+        ('ProductSearchView: город по цене', active.filter(city_id=1).order_by('price', 'id')[:21]),
+        ('ProductSearchView: текст', search.backend.filter(active, 'дрель')[:21]),
+        ('ProductSerializer.is_favorite', active.with_favorite(user).order_by(*newest)[:21]),
+        ('Избранное: проверка', ProductFavorite.objects.filter(user_id=1, product_id=1)),
+        ('Избранное пользователя', ProductFavorite.objects.filter(user_id=1)),
+        ('Потомки категории', CategoryClosure.objects.filter(ancestor_id=1)),
+        ('Предки категории', CategoryClosure.objects.filter(descendant_id=1)),
+        ('Обновление JWT: проверка чёрного списка', BlacklistedToken.objects.filter(token__jti='jti')),
+        ('Обновление JWT: OutstandingToken по jti', OutstandingToken.objects.filter(jti='jti')),
+        ('Обновление JWT: BlacklistedToken по токену', BlacklistedToken.objects.filter(token_id=1)),
+        ('Сжатие токенов: просроченные',
+         OutstandingToken.objects.filter(expires_at__lte=now).order_by('expires_at').values_list('id')[:1000]),
+        ('Сжатие токенов: удаление из чёрного списка', BlacklistedToken.objects.filter(token_id__in=[1, 2])),
+    ]
+
+
+class Command(BaseCommand):
+    help = 'Выполняет EXPLAIN QUERY PLAN для горячих запросов и помечает полные сканирования таблиц'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fail-on-scan', action='store_true', help='завершиться с ошибкой, если найден full scan')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError('EXPLAIN QUERY PLAN поддерживается только для SQLite')
+
+        scans = 0
+        for label, queryset in hot_queries():
+            sql, params = queryset.query.sql_with_params()
+            with connection.cursor() as cursor:
+                cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+                plan = [row[-1] for row in cursor.fetchall()]
+
+            full_scans = [line for line in plan if FULL_SCAN_RE.search(line)]
+            temp_sorts = [line for line in plan if TEMP_SORT_RE.search(line)]
+            scans += len(full_scans)
+            if full_scans:
+                status = self.style.ERROR('FULL SCAN')
+            elif temp_sorts:
+                status = self.style.WARNING('TEMP SORT')
+            else:
+                status = self.style.SUCCESS('OK')
+            self.stdout.write(f'{status} {label}')
+            for line in plan:
+                self.stdout.write(f'    {line}')
+
+        if scans and options['fail_on_scan']:
+            raise CommandError(f'Полных сканирований: {scans}')
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from app import images
+from app.models import Category, CategoryImage, ProductImage
+
+
+class Command(BaseCommand):
+    help = 'Создаёт недостающие превью для всех изображений товаров и категорий'
+
+    def handle(self, *args, **options):
+        names = set()
+        for model in (ProductImage, CategoryImage, Category):
+            names.update(model.objects.exclude(image='').values_list('image', flat=True).distinct())
+
+        failed = 0
+        for name in sorted(names):
+            try:
+                images.generate_derivatives(name)
+            except Exception as error:
+                failed += 1
+                self.stderr.write(f'{name}: {error}')
+        self.stdout.write(self.style.SUCCESS(f'Обработано изображений: {len(names) - failed}, ошибок: {failed}'))
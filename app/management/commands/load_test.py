@@ -0,0 +1,113 @@
+import asyncio
+import statistics
+import time
+from urllib.parse import urlsplit
+
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = (
+        'Нагрузочный тест эндпоинта: N одновременных keep-alive соединений в течение заданного времени. '
+        'Для сравнения WSGI и ASGI запустите один и тот же тест против, например, '
+        '"gunicorn backend.wsgi -w 4 --threads 8" и "uvicorn backend.asgi:application --workers 4".'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('url')
+        parser.add_argument('--concurrency', type=int, default=1000)
+        parser.add_argument('--duration', type=float, default=30.0, help='секунд')
+        parser.add_argument('--timeout', type=float, default=30.0, help='таймаут одного запроса, секунд')
+        parser.add_argument('--header', action='append', default=[], help='дополнительный заголовок "Имя: значение"')
+
+    def handle(self, *args, **options):
+        url = urlsplit(options['url'])
+        if url.scheme != 'http':
+            raise CommandError('Поддерживается только http://')
+        result = asyncio.run(self.run(url, options))
+        self.report(result, options)
+
+    async def run(self, url, options):
+        path = url.path or '/'
+        if url.query:
+            path = f'{path}?{url.query}'
+        headers = ''.join(f'{header}\r\n' for header in options['header'])
+        request = (
+            f'GET {path} HTTP/1.1\r\nHost: {url.netloc}\r\nConnection: keep-alive\r\n{headers}\r\n'
+        ).encode('latin-1')
+
+        latencies, errors, statuses = [], [], {}
+        deadline = time.monotonic() + options['duration']
+
+        async def worker():
+            reader = writer = None
+            while time.monotonic() < deadline:
+                started = time.monotonic()
+                try:
+                    if writer is None:
+                        reader, writer = await asyncio.open_connection(url.hostname, url.port or 80)
+                    writer.write(request)
+                    status, keep_alive = await asyncio.wait_for(self.read_response(reader), options['timeout'])
+                except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, ValueError) as error:
+                    errors.append(type(error).__name__)
+                    if writer is not None:
+                        writer.close()
+                    reader = writer = None
+                    continue
+                latencies.append(time.monotonic() - started)
+                statuses[status] = statuses.get(status, 0) + 1
+                if not keep_alive:
+                    writer.close()
+                    reader = writer = None
+            if writer is not None:
+                writer.close()
+
+        started = time.monotonic()
+        await asyncio.gather(*(worker() for _ in range(options['concurrency'])))
+        return {'elapsed': time.monotonic() - started, 'latencies': latencies, 'errors': errors, 'statuses': statuses}
+
+    @staticmethod
+    async def read_response(reader):
+        status_line = await reader.readline()
+        if not status_line:
+            raise asyncio.IncompleteReadError(b'', None)
+        status = int(status_line.split()[1])
+        length, chunked, keep_alive = None, False, True
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            name, value = name.strip().lower(), value.strip().lower()
+            if name == 'content-length':
+                length = int(value)
+            elif name == 'transfer-encoding' and 'chunked' in value:
+                chunked = True
+            elif name == 'connection' and value == 'close':
+                keep_alive = False
+
+        if chunked:
+            while True:
+                size = int((await reader.readline()).split(b';')[0], 16)
+                await reader.readexactly(size + 2)
+                if size == 0:
+                    break
+        elif length is not None:
+            await reader.readexactly(length)
+        else:
+            await reader.read()
+            keep_alive = False
+        return status, keep_alive
+
+    def report(self, result, options):
+        latencies = sorted(result['latencies'])
+        self.stdout.write(f'соединений: {options["concurrency"]}, длительность: {result["elapsed"]:.1f} с')
+        self.stdout.write(f'ответов: {len(latencies)}, ошибок: {len(result["errors"])}, статусы: {result["statuses"]}')
+        if not latencies:
+            return
+        self.stdout.write(f'пропускная способность: {len(latencies) / result["elapsed"]:.1f} запр/с')
+        quantiles = statistics.quantiles(latencies, n=100) if len(latencies) > 1 else latencies * 99
+        self.stdout.write(
+            f'задержка: p50={quantiles[49] * 1000:.1f}мс p95={quantiles[94] * 1000:.1f}мс '
+            f'p99={quantiles[98] * 1000:.1f}мс max={latencies[-1] * 1000:.1f}мс'
+        )
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from app import search
+from app.models import Product
+
+
+class Command(BaseCommand):
+    help = 'Перестраивает полнотекстовый индекс товаров (нужно после bulk_create/импорта мимо сигналов)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        search.backend.rebuild(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Проиндексировано товаров: {Product.objects.count()}'))
@@ -0,0 +1,62 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from app.models import City
+from app.seeding import SEED_PREFIX, CatalogSeeder
+
+
+class Command(BaseCommand):
+    help = (
+        'Заполняет базу синтетическим каталогом (app/seeding.py): города, дерево категорий, пользователи, '
+        'товары с изображениями и характеристиками, избранное. Популярность городов, категорий, продавцов '
+        'и товаров в избранном распределена по Ципфу; один и тот же --seed даёт один и тот же каталог.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=100_000)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--prefix', default=SEED_PREFIX, help='префикс имён: позволяет повторные запуски')
+        parser.add_argument('--cities', type=int, default=20)
+        parser.add_argument(
+            '--category-fanout', type=int, nargs='+', default=[8, 4, 3],
+            help='число дочерних категорий на каждом уровне дерева',
+        )
+        parser.add_argument('--users', type=int, help='по умолчанию товаров / 20')
+        parser.add_argument('--sellers-share', type=float, default=0.1, help='доля пользователей с объявлениями')
+        parser.add_argument('--images', type=int, default=3, help='изображений на товар')
+        parser.add_argument('--features', type=int, default=4, help='характеристик на товар')
+        parser.add_argument('--favorites', type=float, default=20, help='среднее число избранного на пользователя')
+        parser.add_argument('--active-share', type=float, default=0.9, help='доля активных товаров')
+        parser.add_argument(
+            '--popularity-skew', type=float, default=1.0,
+            help='показатель Ципфа для городов, категорий и продавцов (0 — равномерно)',
+        )
+        parser.add_argument(
+            '--favorites-skew', type=float, default=1.2, help='показатель Ципфа для товаров в избранном',
+        )
+        parser.add_argument('--batch-size', type=int, default=10_000, help='товаров в одной транзакции')
+
+    def handle(self, *args, **options):
+        if City.objects.filter(name__startswith=f'{options["prefix"]} ').exists():
+            raise CommandError(f'Каталог с префиксом "{options["prefix"]}" уже есть, укажите другой --prefix')
+        seeder = CatalogSeeder(
+            options['products'],
+            seed=options['seed'],
+            prefix=options['prefix'],
+            cities=options['cities'],
+            category_fanout=options['category_fanout'],
+            users=options['users'],
+            sellers_share=options['sellers_share'],
+            images_per_product=options['images'],
+            features_per_product=options['features'],
+            favorites_per_user=options['favorites'],
+            active_share=options['active_share'],
+            popularity_skew=options['popularity_skew'],
+            favorites_skew=options['favorites_skew'],
+            batch_size=options['batch_size'],
+        )
+        started = time.perf_counter()
+        seeder.run(log=lambda message: self.stdout.write(f'{time.perf_counter() - started:7.1f} с  {message}'))
+        elapsed = time.perf_counter() - started
+        self.stdout.write(f'готово за {elapsed:.1f} с, {options["products"] / elapsed * 60:,.0f} товаров/мин')
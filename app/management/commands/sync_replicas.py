@@ -0,0 +1,46 @@
+import os
+import sqlite3
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+
+class Command(BaseCommand):
+    help = (
+        'Обновляет SQLite-реплики из DATABASE_REPLICAS копией основной базы: согласованный снимок через '
+        'backup API во временный файл и атомарная подмена. Открытые соединения дочитывают старый файл, '
+        'новые (не позже CONN_MAX_AGE) открывают новый.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, default=0, help='повторять каждые N секунд')
+
+    def handle(self, *args, **options):
+        if connections['default'].vendor != 'sqlite':
+            raise CommandError('Копирование файлом поддерживается только для SQLite')
+        if not settings.DATABASE_REPLICAS:
+            raise CommandError('Реплики не настроены: задайте DATABASE_REPLICAS')
+        while True:
+            self.sync()
+            if not options['interval']:
+                break
+            time.sleep(options['interval'])
+
+    def sync(self):
+        source_name = str(connections['default'].settings_dict['NAME'])
+        for alias in settings.DATABASE_REPLICAS:
+            target = str(connections[alias].settings_dict['NAME'])
+            temporary = f'{target}.tmp'
+            started = time.monotonic()
+            source, copy = sqlite3.connect(source_name), sqlite3.connect(temporary)
+            try:
+                source.backup(copy)
+                # у реплики нет -wal файла, который пришлось бы подменять вместе с ней
+                copy.execute('PRAGMA journal_mode = DELETE')
+            finally:
+                copy.close()
+                source.close()
+            os.replace(temporary, target)
+            self.stdout.write(f'{alias}: {target} ({(time.monotonic() - started) * 1000:.0f} мс)')
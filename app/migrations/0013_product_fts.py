@@ -0,0 +1,75 @@
+import re
+
+from django.db import migrations
+
+# Схема и стемминг зафиксированы на момент миграции и не зависят от app.search
+FTS_TABLE = 'app_product_fts'
+RANK = 'bm25(10.0, 1.0, 3.0)'
+
+WORD_RE = re.compile(r'\w+', re.UNICODE)
+RUSSIAN_ENDINGS = sorted({
+    'ее', 'ие', 'ые', 'ое', 'ими', 'ыми', 'ей', 'ий', 'ый', 'ой', 'ем', 'им', 'ым', 'ом',
+    'его', 'ого', 'ему', 'ому', 'их', 'ых', 'ую', 'юю', 'ая', 'яя', 'ою', 'ею',
+    'ть', 'ешь', 'ете', 'йте', 'ит', 'ишь', 'ют', 'ят', 'ся', 'сь',
+    'а', 'ев', 'ов', 'е', 'и', 'ии', 'й', 'о', 'у', 'ам', 'ям', 'ами', 'ями', 'ях', 'ах',
+    'ия', 'ья', 'я', 'ию', 'ью', 'ю', 'ь', 'ы', 'иям', 'ием', 'иях', 'иями',
+}, key=len, reverse=True)
+MIN_STEM_LENGTH = 3
+
+
+def stem(word):
+    word = word.lower().replace('ё', 'е')
+    if not re.search('[а-я]', word):
+        return word
+    for ending in RUSSIAN_ENDINGS:
+        if word.endswith(ending) and len(word) - len(ending) >= MIN_STEM_LENGTH:
+            return word[:-len(ending)]
+    return word
+
+
+def stem_text(text):
+    return ' '.join(stem(word) for word in WORD_RE.findall(text or ''))
+
+
+def create_product_fts(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    db = schema_editor.connection.alias
+    Product = apps.get_model('app', 'Product')
+    ProductFeature = apps.get_model('app', 'ProductFeature')
+
+    features = {}
+    for product_id, value in ProductFeature.objects.using(db).values_list('product_id', 'value').order_by('id'):
+        features.setdefault(product_id, []).append(value)
+
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} "
+            f"USING fts5(name, description, features, tokenize='unicode61 remove_diacritics 2')"
+        )
+        cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rank) VALUES ('rank', %s)", [RANK])
+        cursor.executemany(
+            f'INSERT INTO {FTS_TABLE}(rowid, name, description, features) VALUES (%s, %s, %s, %s)',
+            [
+                (product_id, stem_text(name), stem_text(description), stem_text(' '.join(features.get(product_id, ()))))
+                for product_id, name, description in Product.objects.using(db).values_list('id', 'name', 'description')
+            ],
+        )
+
+
+def drop_product_fts(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(f'DROP TABLE IF EXISTS {FTS_TABLE}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0012_categoryclosure'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_product_fts, drop_product_fts),
+    ]
@@ -0,0 +1,56 @@
+# Generated by Django 4.2 on 2026-10-18 04:52
+
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+
+def remove_duplicate_favorites(apps, schema_editor):
+    ProductFavorite = apps.get_model('app', 'ProductFavorite')
+    duplicates = (
+        ProductFavorite.objects.values('user_id', 'product_id')
+        .annotate(first_id=Min('id'), total=Count('id'))
+        .filter(total__gt=1)
+    )
+    for duplicate in duplicates:
+        ProductFavorite.objects.filter(
+            user_id=duplicate['user_id'], product_id=duplicate['product_id'],
+        ).exclude(id=duplicate['first_id']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0013_product_fts'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_favorites, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['city', 'status', '-created_at', '-id'], name='product_city_status_created'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['author', 'status', '-created_at', '-id'], name='product_author_status_created'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['category', 'status', '-created_at', '-id'], name='product_cat_status_created'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(condition=models.Q(('status', 'AC')), fields=['-created_at', '-id'], name='product_active_created'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(condition=models.Q(('status', 'AC')), fields=['price', 'id'], name='product_active_price'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(condition=models.Q(('status', 'AC')), fields=['city', 'price', 'id'], name='product_active_city_price'),
+        ),
+        migrations.AddConstraint(
+            model_name='productfavorite',
+            constraint=models.UniqueConstraint(fields=('user', 'product'), name='unique_product_favorite'),
+        ),
+    ]
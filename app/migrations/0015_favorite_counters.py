@@ -0,0 +1,39 @@
+# Generated by Django 4.2 on 2026-10-18 05:06
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def count_favorites(apps, schema_editor):
+    User = apps.get_model('app', 'User')
+    Product = apps.get_model('app', 'Product')
+    ProductFavorite = apps.get_model('app', 'ProductFavorite')
+
+    def counter(field):
+        counts = ProductFavorite.objects.filter(**{field: OuterRef('pk')}).values(field).annotate(total=Count('id'))
+        return Coalesce(Subquery(counts.values('total')), 0)
+
+    User.objects.update(favorites_count=counter('user'))
+    Product.objects.update(subscribers_count=counter('product'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0014_product_indexes_unique_favorite'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='subscribers_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='favorites_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(count_favorites, migrations.RunPython.noop),
+    ]
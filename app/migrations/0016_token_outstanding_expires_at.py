@@ -0,0 +1,18 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    """Индекс по expires_at для сжатия таблиц токенов (app/tokens.py); модель принадлежит simplejwt."""
+
+    dependencies = [
+        ('app', '0015_favorite_counters'),
+        ('token_blacklist', '0012_alter_outstandingtoken_user'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            'CREATE INDEX IF NOT EXISTS token_outstanding_expires_at '
+            'ON token_blacklist_outstandingtoken (expires_at)',
+            'DROP INDEX IF EXISTS token_outstanding_expires_at',
+        ),
+    ]
@@ -1,4 +1,6 @@
-from django.db import models
+from django.core.exceptions import ValidationError
+from django.db import connections, models, router, transaction
+from django.db.models import Count, F, OuterRef, Subquery
 from django.contrib.auth.models import AbstractUser
 
 
@@ -8,6 +10,8 @@ class City(models.Model):
 
 class User(AbstractUser):
     phone = models.CharField(max_length=30, unique=True)
+    # денормализованный счётчик, ведётся ProductFavorite.objects и сигналами
+    favorites_count = models.PositiveIntegerField(default=0)
 
 
 class Category(models.Model):
@@ -23,20 +27,160 @@ class Category(models.Model):
     def __str__(self):
         return f'{self.name}'
 
+    CYCLE_ERROR = 'Категория не может быть перемещена внутрь собственного поддерева'
+
+    def is_in_own_subtree(self, category_id):
+        return category_id is not None and not self._state.adding and \
+            CategoryClosure.objects.filter(ancestor_id=self.pk, descendant_id=category_id).exists()
+
+    def clean(self):
+        if self.is_in_own_subtree(self.parent_id):
+            raise ValidationError({'parent': self.CYCLE_ERROR})
+
+    def save(self, *args, **kwargs):
+        is_new = self._state.adding
+        # старый родитель и проверка цикла — в той же транзакции, что и запись:
+        # транзакции на запись (BEGIN IMMEDIATE) не дадут их изменить параллельно
+        with transaction.atomic():
+            moved = False
+            if not is_new:
+                old_parent_id = Category.objects.filter(pk=self.pk).values_list('parent_id', flat=True).first()
+                moved = old_parent_id != self.parent_id
+            if moved and self.is_in_own_subtree(self.parent_id):
+                raise ValueError(self.CYCLE_ERROR)
+            super().save(*args, **kwargs)
+            if is_new:
+                CategoryClosure.attach(self)
+            elif moved:
+                CategoryClosure.move(self)
+
     def get_descendants(self):
+        """Все потомки одним запросом, в порядке обхода в глубину (дети — по id)."""
+        children = {}
+        for category in Category.objects.filter(
+                ancestor_links__ancestor_id=self.id, ancestor_links__depth__gt=0).order_by('id'):
+            children.setdefault(category.parent_id, []).append(category)
         descendants = []
-        children = self.children.all()
-        for child in children:
-            descendants.append(child)
-            descendants += child.get_descendants()
+        stack = list(reversed(children.get(self.id, [])))
+        while stack:
+            category = stack.pop()
+            descendants.append(category)
+            stack.extend(reversed(children.get(category.id, [])))
         return descendants
 
+    @staticmethod
+    def get_descendant_ids(category_id, include_self=True):
+        links = CategoryClosure.objects.filter(ancestor_id=category_id)
+        if not include_self:
+            links = links.filter(depth__gt=0)
+        return list(links.values_list('descendant_id', flat=True))
+
+
+class CategoryClosure(models.Model):
+    """
+    Таблица замыкания дерева категорий: для каждой пары предок-потомок хранится
+    расстояние между ними (включая пару категории с самой собой, depth=0).
+    """
+
+    class Meta:
+        unique_together = ('ancestor', 'descendant')
+        indexes = [
+            models.Index(fields=['descendant', 'depth']),
+        ]
+
+    ancestor = models.ForeignKey(Category, related_name='descendant_links', on_delete=models.CASCADE)
+    descendant = models.ForeignKey(Category, related_name='ancestor_links', on_delete=models.CASCADE)
+    depth = models.PositiveIntegerField()
+
+    @classmethod
+    def attach(cls, category):
+        links = [cls(ancestor_id=category.id, descendant_id=category.id, depth=0)]
+        if category.parent_id is not None:
+            links += [
+                cls(ancestor_id=ancestor_id, descendant_id=category.id, depth=depth + 1)
+                for ancestor_id, depth in cls.objects
+                .filter(descendant_id=category.parent_id)
+                .values_list('ancestor_id', 'depth')
+            ]
+        cls.objects.bulk_create(links)
+
+    @classmethod
+    def move(cls, category):
+        subtree = list(cls.objects.filter(ancestor_id=category.id).values_list('descendant_id', 'depth'))
+        subtree_ids = [descendant_id for descendant_id, _ in subtree]
+
+        # отрываем поддерево от старых предков
+        cls.objects.filter(descendant_id__in=subtree_ids).exclude(ancestor_id__in=subtree_ids).delete()
+
+        if category.parent_id is None:
+            return
+        ancestors = cls.objects.filter(descendant_id=category.parent_id).values_list('ancestor_id', 'depth')
+        cls.objects.bulk_create([
+            cls(ancestor_id=ancestor_id, descendant_id=descendant_id, depth=ancestor_depth + depth + 1)
+            for ancestor_id, ancestor_depth in ancestors
+            for descendant_id, depth in subtree
+        ])
+
+    @classmethod
+    def rebuild(cls):
+        parents = dict(Category.objects.values_list('id', 'parent_id'))
+        links = []
+        for category_id in parents:
+            ancestor_id, depth = category_id, 0
+            while ancestor_id is not None:
+                links.append(cls(ancestor_id=ancestor_id, descendant_id=category_id, depth=depth))
+                ancestor_id, depth = parents.get(ancestor_id), depth + 1
+        # одна транзакция: параллельные запросы не видят пустую таблицу
+        with transaction.atomic(using=router.db_for_write(cls)):
+            cls.objects.all().delete()
+            cls.objects.bulk_create(links, batch_size=500)
+
+
+class ProductQuerySet(models.QuerySet):
+
+    def with_related(self):
+        """
+        Подгружает всё, что читает ProductSerializer, фиксированным числом запросов
+        независимо от количества товаров.
+        """
+        return self.select_related('author', 'city').prefetch_related(
+            models.Prefetch('images', queryset=ProductImage.objects.order_by('id')),
+            models.Prefetch('features', queryset=ProductFeature.objects.order_by('id')),
+        )
+
+    def with_favorite(self, user):
+        """
+        Аннотирует is_favorite подзапросом EXISTS — без загрузки подписчиков товара.
+        """
+        if user is None or not user.is_authenticated:
+            return self.annotate(is_favorite=models.Value(False))
+        return self.annotate(is_favorite=models.Exists(
+            ProductFavorite.objects.filter(product_id=models.OuterRef('pk'), user_id=user.id)
+        ))
+
 
 class Product(models.Model):
 
     class Meta:
         verbose_name = 'Товар'
         verbose_name_plural = 'Товары'
+        indexes = [
+            # лента города и «мои объявления»: фильтр по статусу, сортировка по дате
+            models.Index(fields=['city', 'status', '-created_at', '-id'], name='product_city_status_created'),
+            models.Index(fields=['author', 'status', '-created_at', '-id'], name='product_author_status_created'),
+            # поиск по категории
+            models.Index(fields=['category', 'status', '-created_at', '-id'], name='product_cat_status_created'),
+            # частичные индексы только по активным товарам
+            models.Index(
+                fields=['-created_at', '-id'], name='product_active_created',
+                condition=models.Q(status='AC'),
+            ),
+            models.Index(fields=['price', 'id'], name='product_active_price', condition=models.Q(status='AC')),
+            models.Index(
+                fields=['city', 'price', 'id'], name='product_active_city_price',
+                condition=models.Q(status='AC'),
+            ),
+        ]
 
     class Status(models.TextChoices):
         ACTIVE = 'AC', 'Активен'
@@ -65,6 +209,9 @@ class Product(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     city = models.ForeignKey(City, related_name='products', on_delete=models.CASCADE, null=True)
+    subscribers_count = models.PositiveIntegerField(default=0)
+
+    objects = ProductQuerySet.as_manager()
 
 
 class ProductFeature(models.Model):
@@ -85,6 +232,110 @@ class CategoryImage(models.Model):
     description = models.TextField(blank=True, default='')
 
 
+class ProductFavoriteQuerySet(models.QuerySet):
+    """
+    Добавление и удаление избранного без чтения перед записью: по одному
+    оператору INSERT ... ON CONFLICT DO NOTHING / DELETE с RETURNING, которые
+    возвращают id товаров, реально затронутых запросом.
+    """
+
+    @property
+    def write_db(self):
+        # self.db для обычного QuerySet — база для чтения, а здесь только запись
+        return self._db or router.db_for_write(self.model)
+
+    def _execute(self, sql, params):
+        with connections[self.write_db].cursor() as cursor:
+            cursor.execute(sql, params)
+            return [row[0] for row in cursor.fetchall()]
+
+    def _update_counters(self, user_id, product_ids, delta):
+        if not product_ids:
+            return
+        User.objects.using(self.write_db).filter(pk=user_id).update(
+            favorites_count=F('favorites_count') + delta * len(product_ids),
+        )
+        Product.objects.using(self.write_db).filter(pk__in=product_ids).update(
+            subscribers_count=F('subscribers_count') + delta,
+        )
+
+    def add(self, user_id, product_ids):
+        product_ids = list(product_ids)
+        if not product_ids:
+            return []
+        placeholders = ', '.join(['%s'] * len(product_ids))
+        with transaction.atomic(using=self.write_db, savepoint=False):
+            # SELECT из таблицы товаров отбрасывает несуществующие id; WHERE обязателен,
+            # чтобы SQLite не принял ON CONFLICT за часть SELECT
+            added = self._execute(
+                f'INSERT INTO {self.model._meta.db_table} (user_id, product_id) '
+                f'SELECT %s, id FROM {Product._meta.db_table} WHERE id IN ({placeholders}) '
+                f'ON CONFLICT (user_id, product_id) DO NOTHING RETURNING product_id',
+                [user_id, *product_ids],
+            )
+            self._update_counters(user_id, added, 1)
+        return added
+
+    def remove(self, user_id, product_ids):
+        product_ids = list(product_ids)
+        if not product_ids:
+            return []
+        placeholders = ', '.join(['%s'] * len(product_ids))
+        with transaction.atomic(using=self.write_db, savepoint=False):
+            removed = self._execute(
+                f'DELETE FROM {self.model._meta.db_table} WHERE user_id = %s AND product_id IN ({placeholders}) '
+                f'RETURNING product_id',
+                [user_id, *product_ids],
+            )
+            self._update_counters(user_id, removed, -1)
+        return removed
+
+    def delete(self):
+        """
+        Удаление через ORM (в том числе из админки): счётчики уменьшаются двумя
+        UPDATE с подсчётом удаляемых строк в подзапросе. Каскадное удаление при
+        удалении товара или пользователя сюда не попадает — см. app.signals.
+        """
+        def removed(field):
+            return Subquery(
+                self.filter(**{field: OuterRef('pk')}).order_by().values(field)
+                .annotate(count=Count('id')).values('count'),
+            )
+
+        with transaction.atomic(using=self.write_db, savepoint=False):
+            User.objects.using(self.write_db).filter(pk__in=self.values('user_id')).update(
+                favorites_count=F('favorites_count') - removed('user_id'),
+            )
+            Product.objects.using(self.write_db).filter(pk__in=self.values('product_id')).update(
+                subscribers_count=F('subscribers_count') - removed('product_id'),
+            )
+            return super().delete()
+
+    delete.alters_data = True
+    delete.queryset_only = True
+
+    def toggle(self, user_id, product_id):
+        """True — товар добавлен, False — удалён, None — товара не существует."""
+        with transaction.atomic(using=self.write_db):
+            if self.remove(user_id, [product_id]):
+                return False
+            if self.add(user_id, [product_id]):
+                return True
+        return None
+
+
 class ProductFavorite(models.Model):
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'product'], name='unique_product_favorite'),
+        ]
+
     user = models.ForeignKey(User, related_name='favorites', on_delete=models.CASCADE)
     product = models.ForeignKey(Product, related_name='subscribers', on_delete=models.CASCADE)
+
+    objects = ProductFavoriteQuerySet.as_manager()
+
+    def delete(self, using=None, keep_parents=False):
+        # счётчики уменьшает ProductFavoriteQuerySet.delete
+        return type(self).objects.using(using).filter(pk=self.pk).delete()
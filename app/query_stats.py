@@ -0,0 +1,177 @@
+"""
+SQL-статистика запросов.
+
+query_stats_middleware для каждого HTTP-запроса считает число запросов к базе,
+их суммарное время и повторы одного и того же SQL (признак N+1). Итог
+отдаётся в заголовке Server-Timing и строкой лога ``app.sql`` (INFO). Запросы
+к базе дольше SQL_SLOW_QUERY_MS и HTTP-запросы дольше SQL_SLOW_REQUEST_MS, с
+числом запросов от SQL_SLOW_REQUEST_QUERIES или с SQL, повторённым
+SQL_DUPLICATE_QUERIES раз, пишутся в медленный лог ``app.sql.slow`` (WARNING)
+вместе с нормализованным SQL и именем представления.
+
+На каждый запрос к базе приходятся два вызова perf_counter и обновление
+словаря; нормализация SQL выполняется только при записи в медленный лог.
+
+Обёртка dispatch добавляется в execute_wrappers (механизм
+connection.execute_wrapper) каждого соединения при его открытии (сигнал
+connection_created). Соединения у Django свои в каждом потоке, а SQL
+асинхронных представлений выполняется в потоке sync_to_async, поэтому
+статистика текущего запроса передаётся через ContextVar, который
+sync_to_async копирует в свой поток. Один запрос может выполнять SQL в
+нескольких потоках сразу (async_views.run_in_threads), поэтому счётчики
+обновляются под блокировкой.
+"""
+import logging
+import re
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.utils.decorators import sync_and_async_middleware
+
+logger = logging.getLogger('app.sql')
+slow_logger = logging.getLogger('app.sql.slow')
+
+STRING_RE = re.compile(r"'(?:[^']|'')*'")
+NUMBER_RE = re.compile(r'\b\d+(?:\.\d+)?\b')
+PLACEHOLDER_RE = re.compile(r'%s|\?')
+IN_LIST_RE = re.compile(r'\(\s*\?(?:\s*,\s*\?)+\s*\)')
+SPACE_RE = re.compile(r'\s+')
+
+_current = ContextVar('query_stats', default=None)
+
+
+def normalize_sql(sql):
+    """Заменяет литералы и параметры на ?, списки IN (?, ?, ...) — на (...)."""
+    sql = STRING_RE.sub('?', sql)
+    sql = NUMBER_RE.sub('?', sql)
+    sql = PLACEHOLDER_RE.sub('?', sql)
+    sql = IN_LIST_RE.sub('(...)', sql)
+    return SPACE_RE.sub(' ', sql).strip()
+
+
+class QueryStats:
+    """Обёртка выполнения SQL (как для connection.execute_wrapper), копящая статистику одного HTTP-запроса."""
+
+    def __init__(self, slow_query_seconds):
+        self.slow_query_seconds = slow_query_seconds
+        self.count = 0
+        self.duration = 0.0
+        self.statements = {}
+        self.slow = []
+        self._lock = threading.Lock()
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - started
+            with self._lock:
+                self.count += 1
+                self.duration += duration
+                # параметры передаются отдельно, так что N+1 даёт один и тот же текст SQL
+                self.statements[sql] = self.statements.get(sql, 0) + 1
+                if duration >= self.slow_query_seconds:
+                    self.slow.append((context['connection'].alias, sql, duration))
+
+    @property
+    def duplicates(self):
+        return self.count - len(self.statements)
+
+    def most_repeated(self):
+        if not self.statements:
+            return None, 0
+        return max(self.statements.items(), key=lambda item: item[1])
+
+    @contextmanager
+    def collect(self):
+        token = _current.set(self)
+        try:
+            yield self
+        finally:
+            _current.reset(token)
+
+
+def dispatch(execute, sql, params, many, context):
+    stats = _current.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    return stats(execute, sql, params, many, context)
+
+
+def install(sender, connection, **kwargs):
+    """Обработчик connection_created; постоянные соединения открываются повторно, отсюда проверка."""
+    if dispatch not in connection.execute_wrappers:
+        connection.execute_wrappers.append(dispatch)
+
+
+def get_view_name(request):
+    match = getattr(request, 'resolver_match', None)
+    return match.view_name if match is not None else None
+
+
+def report(request, response, stats, elapsed):
+    timing = (
+        f'db;dur={stats.duration * 1000:.1f};desc="{stats.count} queries, {stats.duplicates} duplicates", '
+        f'total;dur={elapsed * 1000:.1f}'
+    )
+    if response.has_header('Server-Timing'):
+        timing = f'{response["Server-Timing"]}, {timing}'
+    response['Server-Timing'] = timing
+
+    view = get_view_name(request)
+    record = {
+        'method': request.method,
+        'path': request.path,
+        'view': view,
+        'status': response.status_code,
+        'queries': stats.count,
+        'duplicates': stats.duplicates,
+        'db_ms': round(stats.duration * 1000, 1),
+        'total_ms': round(elapsed * 1000, 1),
+    }
+    if logger.isEnabledFor(logging.INFO):
+        logger.info(' '.join(f'{key}={value}' for key, value in record.items()), extra={'sql_stats': record})
+
+    for alias, sql, duration in stats.slow:
+        slow_logger.warning(
+            'slow query view=%s db=%s ms=%.1f sql=%s', view, alias, duration * 1000, normalize_sql(sql),
+            extra={'sql_stats': {**record, 'db': alias, 'query_ms': round(duration * 1000, 1)}},
+        )
+
+    sql, repeats = stats.most_repeated()
+    if elapsed * 1000 >= getattr(settings, 'SQL_SLOW_REQUEST_MS', 1000) \
+            or stats.count >= getattr(settings, 'SQL_SLOW_REQUEST_QUERIES', 50) \
+            or repeats >= getattr(settings, 'SQL_DUPLICATE_QUERIES', 10):
+        slow_logger.warning(
+            'slow request %s repeated=%d sql=%s',
+            ' '.join(f'{key}={value}' for key, value in record.items()), repeats, normalize_sql(sql or ''),
+            extra={'sql_stats': {**record, 'repeated': repeats}},
+        )
+
+
+@sync_and_async_middleware
+def query_stats_middleware(get_response):
+    """Считает SQL каждого запроса; ставится первым, чтобы учесть запросы остальных middleware."""
+    def start():
+        return QueryStats(getattr(settings, 'SQL_SLOW_QUERY_MS', 100) / 1000), time.perf_counter()
+
+    if iscoroutinefunction(get_response):
+        async def middleware(request):
+            stats, started = start()
+            with stats.collect():
+                response = await get_response(request)
+            report(request, response, stats, time.perf_counter() - started)
+            return response
+    else:
+        def middleware(request):
+            stats, started = start()
+            with stats.collect():
+                response = get_response(request)
+            report(request, response, stats, time.perf_counter() - started)
+            return response
+    return middleware
@@ -0,0 +1,133 @@
+"""
+Чтение с реплик для ленты и поиска.
+
+Реплики перечисляются в DATABASE_REPLICAS (псевдонимы из DATABASES; в
+backend/settings.py они собираются из переменной окружения DATABASE_REPLICAS).
+По умолчанию все запросы идут в основную базу; на реплику переключаются только
+GET-запросы представлений, вызвавших use_replica() (ReplicaReadMixin,
+асинхронные представления).
+
+Всё, что кэшируется под версией или поколением из app.versions (страницы ленты,
+дерево категорий), строится внутри primary_reads(): счётчик увеличивается сразу
+после записи, и страница, собранная по отстающей реплике, хранилась бы под новым
+ключом до следующего изменения. По той же причине справочники, чьи ETag считаются
+по версиям, читаются только из основной базы. Чтобы пользователь видел
+собственные изменения:
+
+* после первой записи в запросе все следующие чтения этого запроса идут в основную базу;
+* после запроса с записью пользователь REPLICA_STICKY_SECONDS секунд читает только
+  из основной базы (метка ставится replica_routing_middleware в общий кэш
+  MODEL_VERSION_CACHE, чтобы её видели все воркеры).
+
+Реплики на SQLite — копии файла основной базы (команда sync_replicas).
+"""
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+from django.utils.decorators import sync_and_async_middleware
+
+from . import versions
+
+STICKY_KEY = 'db_sticky:{}'
+
+_state = ContextVar('db_routing_state', default=None)
+
+
+def get_replicas():
+    return getattr(settings, 'DATABASE_REPLICAS', [])
+
+
+def is_sticky(user):
+    return bool(user and user.is_authenticated and versions.get_cache().get(STICKY_KEY.format(user.pk)))
+
+
+def use_replica(request):
+    """Разрешает текущему запросу читать с реплики, если она есть и пользователь не «прилип» к основной базе."""
+    state = _state.get()
+    replicas = get_replicas()
+    if state is None or not replicas or request.method not in ('GET', 'HEAD'):
+        return
+    if state['wrote'] or is_sticky(getattr(request, 'user', None)):
+        return
+    state['replica'] = random.choice(replicas)
+
+
+@contextmanager
+def primary_reads():
+    """Чтения внутри блока идут в основную базу, даже если запросу разрешена реплика."""
+    state = _state.get()
+    if state is None or state['replica'] is None:
+        yield
+        return
+    replica, state['replica'] = state['replica'], None
+    try:
+        yield
+    finally:
+        state['replica'] = replica
+
+
+class ReplicaReadMixin:
+    """Для DRF-представлений: GET/HEAD читают с реплики."""
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        use_replica(request)
+
+
+class ReplicaRouter:
+
+    def db_for_read(self, model, **hints):
+        state = _state.get()
+        if state is None or state['wrote']:
+            return None
+        return state['replica']
+
+    def db_for_write(self, model, **hints):
+        state = _state.get()
+        if state is not None:
+            state['wrote'] = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # реплики — копии основной базы, мигрируется только она
+        return db not in get_replicas()
+
+
+def _remember_write(request, state):
+    user = getattr(request, 'user', None)
+    if state['wrote'] and user is not None and user.is_authenticated:
+        versions.get_cache().set(STICKY_KEY.format(user.pk), 1, timeout=getattr(settings, 'REPLICA_STICKY_SECONDS', 5))
+
+
+@sync_and_async_middleware
+def replica_routing_middleware(get_response):
+    """Заводит состояние маршрутизации на запрос и ставит метку «читать из основной базы» после записи."""
+    if iscoroutinefunction(get_response):
+        async def middleware(request):
+            state = {'replica': None, 'wrote': False}
+            token = _state.set(state)
+            try:
+                response = await get_response(request)
+            finally:
+                _state.reset(token)
+            if state['wrote']:
+                await sync_to_async(_remember_write)(request, state)
+            return response
+    else:
+        def middleware(request):
+            state = {'replica': None, 'wrote': False}
+            token = _state.set(state)
+            try:
+                response = get_response(request)
+            finally:
+                _state.reset(token)
+            _remember_write(request, state)
+            return response
+    return middleware
@@ -0,0 +1,194 @@
+"""
+Полнотекстовый поиск товаров.
+
+Бэкенд выбирается настройкой PRODUCT_SEARCH_BACKEND. SqliteFTS5Backend хранит
+индекс в виртуальной таблице FTS5 по названию, описанию и значениям характеристик;
+IContainsBackend — запасной вариант для баз без FTS (и образец интерфейса для
+будущего бэкенда на tsvector в Postgres). Индекс пишется в базу, куда пишутся
+товары (router.db_for_write), и по её же данным.
+"""
+import re
+from functools import lru_cache
+
+from django.conf import settings
+from django.db import connections, router, transaction
+from django.db.models import FloatField
+from django.db.models.expressions import RawSQL
+from django.utils.functional import SimpleLazyObject
+from django.utils.module_loading import import_string
+
+from .models import Product, ProductFeature
+
+FTS_TABLE = 'app_product_fts'
+
+WORD_RE = re.compile(r'\w+', re.UNICODE)
+
+# Окончания, отсекаемые при стемминге (самые длинные проверяются первыми)
+RUSSIAN_ENDINGS = sorted({
+    # прилагательные и причастия
+    'ее', 'ие', 'ые', 'ое', 'ими', 'ыми', 'ей', 'ий', 'ый', 'ой', 'ем', 'им', 'ым', 'ом',
+    'его', 'ого', 'ему', 'ому', 'их', 'ых', 'ую', 'юю', 'ая', 'яя', 'ою', 'ею',
+    # глаголы
+    'ть', 'ешь', 'ете', 'йте', 'ит', 'ишь', 'ют', 'ят', 'ся', 'сь',
+    # существительные
+    'а', 'ев', 'ов', 'е', 'и', 'ии', 'й', 'о', 'у', 'ам', 'ям', 'ами', 'ями', 'ях', 'ах',
+    'ия', 'ья', 'я', 'ию', 'ью', 'ю', 'ь', 'ы', 'иям', 'ием', 'иях', 'иями',
+}, key=len, reverse=True)
+MIN_STEM_LENGTH = 3
+
+
+# словарь каталога невелик, а переиндексация прогоняет через stem миллионы слов
+@lru_cache(maxsize=100_000)
+def stem(word):
+    word = word.lower().replace('ё', 'е')
+    if not re.search('[а-я]', word):
+        return word
+    for ending in RUSSIAN_ENDINGS:
+        if word.endswith(ending) and len(word) - len(ending) >= MIN_STEM_LENGTH:
+            return word[:-len(ending)]
+    return word
+
+
+def stem_text(text):
+    return ' '.join(stem(word) for word in WORD_RE.findall(text or ''))
+
+
+def build_match_query(query):
+    """
+    Строка запроса пользователя -> выражение MATCH: все слова обязательны,
+    каждое ищется как префикс основы ("дрели уд" -> "дрел"* "уд"*).
+    """
+    terms = [stem(word) for word in WORD_RE.findall(query)]
+    return ' '.join(f'"{term}"*' for term in terms if term)
+
+
+class SearchBackend:
+
+    def filter(self, queryset, query):
+        """
+        Оставляет в queryset товары, подходящие под запрос, и упорядочивает их
+        по релевантности.
+        """
+        raise NotImplementedError
+
+    def index_product(self, product_id):
+        pass
+
+    def index_products(self, product_ids):
+        for product_id in product_ids:
+            self.index_product(product_id)
+
+    def remove_product(self, product_id):
+        pass
+
+    def rebuild(self):
+        pass
+
+
+class IContainsBackend(SearchBackend):
+
+    def filter(self, queryset, query):
+        return queryset.filter(name__icontains=query)
+
+
+class SqliteFTS5Backend(SearchBackend):
+    """
+    Таблица FTS_TABLE создаётся миграцией 0013_product_fts; там же заданы веса
+    bm25 для колонок name, description, features (10, 1, 3).
+    """
+
+    @staticmethod
+    def document(name, description, feature_values):
+        return stem_text(name), stem_text(description), stem_text(' '.join(feature_values))
+
+    def filter(self, queryset, query):
+        match = build_match_query(query)
+        if not match:
+            return queryset.none()
+        # search_rank — аннотация, а не extra(select=...), чтобы по ней работали
+        # фильтры keyset-пагинации
+        return queryset.extra(
+            tables=[FTS_TABLE],
+            where=[f'{FTS_TABLE}.rowid = {Product._meta.db_table}.id', f'{FTS_TABLE} MATCH %s'],
+            params=[match],
+        ).annotate(search_rank=RawSQL(f'{FTS_TABLE}.rank', (), output_field=FloatField())).order_by('search_rank')
+
+    @staticmethod
+    def get_db():
+        return router.db_for_write(Product)
+
+    def index_product(self, product_id):
+        using = self.get_db()
+        product = Product.objects.using(using).filter(id=product_id).values('name', 'description').first()
+        with connections[using].cursor() as cursor:
+            cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [product_id])
+            if product is None:
+                return
+            feature_values = ProductFeature.objects.using(using).filter(
+                product_id=product_id,
+            ).values_list('value', flat=True)
+            cursor.execute(
+                f'INSERT INTO {FTS_TABLE}(rowid, name, description, features) VALUES (%s, %s, %s, %s)',
+                [product_id, *self.document(product['name'], product['description'], feature_values)],
+            )
+
+    def index_products(self, product_ids):
+        """Индексирует пачку товаров (bulk_create не вызывает сигналы) фиксированным числом запросов."""
+        product_ids = list(product_ids)
+        if not product_ids:
+            return
+        using = self.get_db()
+        features = {}
+        for product_id, value in ProductFeature.objects.using(using).filter(product_id__in=product_ids).values_list(
+            'product_id', 'value',
+        ).order_by('id'):
+            features.setdefault(product_id, []).append(value)
+        rows = [
+            (product_id, *self.document(name, description, features.get(product_id, ())))
+            for product_id, name, description in Product.objects.using(using).filter(id__in=product_ids).values_list(
+                'id', 'name', 'description',
+            )
+        ]
+        with connections[using].cursor() as cursor:
+            placeholders = ', '.join(['%s'] * len(product_ids))
+            cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid IN ({placeholders})', product_ids)
+            if rows:
+                self._insert(cursor, rows)
+
+    def remove_product(self, product_id):
+        with connections[self.get_db()].cursor() as cursor:
+            cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [product_id])
+
+    def rebuild(self, batch_size=2000):
+        using = self.get_db()
+        features = {}
+        for product_id, value in ProductFeature.objects.using(using).values_list('product_id', 'value').iterator():
+            features.setdefault(product_id, []).append(value)
+
+        # одна транзакция: без неё каждая строка фиксируется отдельно, а поиск
+        # на время перестроения видел бы пустой индекс
+        with transaction.atomic(using=using), connections[using].cursor() as cursor:
+            cursor.execute(f'DELETE FROM {FTS_TABLE}')
+            rows = []
+            products = Product.objects.using(using).values_list('id', 'name', 'description').order_by('id')
+            for product_id, name, description in products.iterator(chunk_size=batch_size):
+                rows.append((product_id, *self.document(name, description, features.get(product_id, ()))))
+                if len(rows) >= batch_size:
+                    self._insert(cursor, rows)
+                    rows = []
+            if rows:
+                self._insert(cursor, rows)
+            cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('optimize')")
+
+    @staticmethod
+    def _insert(cursor, rows):
+        cursor.executemany(
+            f'INSERT INTO {FTS_TABLE}(rowid, name, description, features) VALUES (%s, %s, %s, %s)', rows
+        )
+
+
+def get_backend():
+    return import_string(getattr(settings, 'PRODUCT_SEARCH_BACKEND', 'app.search.IContainsBackend'))()
+
+
+backend = SimpleLazyObject(get_backend)
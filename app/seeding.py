@@ -0,0 +1,286 @@
+"""
+Синтетический каталог для бенчмарков и нагрузочных тестов: города, дерево
+категорий, пользователи, товары с изображениями (default_image.png) и
+характеристиками, избранное.
+
+Города, категории и пользователи создаются bulk_create, товары — многострочными
+INSERT ... RETURNING id (id назначает база, так что заполнять можно и базу, в
+которую параллельно пишет приложение), изображения, характеристики и
+избранное — одним executemany на пачку. Всё это минуя модели: на миллионах
+строк конструирование экземпляров и сборка SQL в ORM обходятся дороже самой
+вставки. Каждая пачка — отдельная транзакция. Сигналы при этом не
+срабатывают, поэтому таблица замыкания строится вместе с категориями, товары
+индексируются для поиска в транзакции своей пачки, а счётчики избранного
+пересчитываются в конце пачками только для созданных записей, после чего
+увеличиваются версии кэшей. Так блокировка записи не держится дольше одной
+пачки и заполнять можно работающую базу.
+
+Генерация детерминирована: один и тот же seed даёт один и тот же каталог.
+Популярность городов, категорий и продавцов и распределение избранного по
+товарам подчиняются закону Ципфа (вес элемента с рангом r — 1 / r ** s).
+"""
+import itertools
+import random
+from datetime import timedelta
+
+from django.db import connection, transaction
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from . import feed, search, versions
+from .models import (
+    Category, CategoryClosure, City, Product, ProductFavorite, ProductFeature, ProductImage, User,
+)
+
+SEED_PREFIX = 'seed'
+
+WORDS = [
+    'дрель', 'перфоратор', 'шуруповерт', 'болгарка', 'лобзик', 'генератор', 'компрессор',
+    'бетономешалка', 'леса', 'опалубка', 'экскаватор', 'погрузчик', 'кран', 'самосвал',
+    'плитка', 'ламинат', 'кирпич', 'цемент', 'доска', 'брус', 'утеплитель', 'кровля',
+]
+ADJECTIVES = [
+    'ударная', 'аккумуляторная', 'профессиональная', 'компактная', 'мощная', 'новая',
+    'б/у', 'строительная', 'садовая', 'легкая', 'тяжелая', 'универсальная',
+]
+BRANDS = ['makita', 'bosch', 'dewalt', 'metabo', 'hitachi', 'интерскол', 'зубр', 'ryobi']
+FEATURES = {
+    'Мощность': ['500 Вт', '750 Вт', '1200 Вт', '2000 Вт'],
+    'Вес': ['1 кг', '2.5 кг', '5 кг', '12 кг'],
+    'Цвет': ['красный', 'синий', 'зеленый', 'черный'],
+    'Гарантия': ['6 месяцев', '1 год', '2 года'],
+    'Материал': ['сталь', 'алюминий', 'пластик', 'дерево'],
+    'Состояние': ['новое', 'как новое', 'рабочее'],
+}
+INACTIVE_STATUSES = [Product.Status.ARCHIVED.value, Product.Status.ON_MODERATE.value, Product.Status.CANCELED.value]
+PRODUCT_FIELDS = (
+    'name', 'description', 'price', 'price_suffix', 'is_lower_bound', 'status',
+    'author', 'category', 'created_at', 'updated_at', 'city', 'subscribers_count',
+)
+
+
+def zipf_cum_weights(count, exponent):
+    """Накопленные веса для random.choices: exponent=0 — равномерное распределение."""
+    return list(itertools.accumulate(1 / rank ** exponent for rank in range(1, count + 1)))
+
+
+def chunked(ids):
+    """Части списка id, помещающиеся в один запрос с IN (лимит параметров базы)."""
+    size = connection.features.max_query_params
+    for start in range(0, len(ids), size):
+        yield ids[start:start + size]
+
+
+def _columns(model, fields):
+    return ', '.join(model._meta.get_field(name).column for name in fields)
+
+
+def insert_rows(model, fields, rows):
+    """INSERT пачки кортежей в таблицу модели без создания её экземпляров."""
+    placeholders = ', '.join(['%s'] * len(fields))
+    sql = f'INSERT INTO {model._meta.db_table} ({_columns(model, fields)}) VALUES ({placeholders})'
+    with connection.cursor() as cursor:
+        cursor.executemany(sql, rows)
+
+
+def insert_rows_returning_ids(model, fields, rows):
+    """
+    Как insert_rows, но многострочными INSERT ... RETURNING id (сколько строк
+    позволяет лимит параметров базы); id возвращаются в порядке строк, как и в
+    QuerySet.bulk_create.
+    """
+    rows = list(rows)
+    per_statement = max(1, connection.features.max_query_params // len(fields))
+    row_placeholders = '({})'.format(', '.join(['%s'] * len(fields)))
+    ids = []
+    with connection.cursor() as cursor:
+        for start in range(0, len(rows), per_statement):
+            chunk = rows[start:start + per_statement]
+            cursor.execute(
+                f'INSERT INTO {model._meta.db_table} ({_columns(model, fields)}) '
+                f'VALUES {", ".join([row_placeholders] * len(chunk))} RETURNING id',
+                [value for row in chunk for value in row],
+            )
+            ids += [row[0] for row in cursor.fetchall()]
+    return ids
+
+
+class CatalogSeeder:
+
+    def __init__(self, products, seed=0, prefix=SEED_PREFIX, cities=20, category_fanout=(8, 4, 3), users=None,
+                 sellers_share=0.1, images_per_product=3, features_per_product=4, favorites_per_user=20,
+                 active_share=0.9, popularity_skew=1.0, favorites_skew=1.2, batch_size=10000, days=365):
+        self.products = products
+        self.random = random.Random(seed)
+        self.prefix = prefix
+        self.cities = cities
+        self.category_fanout = category_fanout
+        self.users = users if users is not None else max(100, products // 20)
+        self.sellers_share = sellers_share
+        self.images_per_product = images_per_product
+        self.features_per_product = min(features_per_product, len(FEATURES))
+        self.favorites_per_user = favorites_per_user
+        self.active_share = active_share
+        self.popularity_skew = popularity_skew
+        self.favorites_skew = favorites_skew
+        self.batch_size = batch_size
+        self.days = days
+
+    def run(self, log=None):
+        log = log or (lambda message: None)
+        city_ids = self.create_cities()
+        category_ids = self.create_categories()
+        log(f'городов: {len(city_ids)}, категорий-листьев: {len(category_ids)}')
+        user_ids = self.create_users()
+        log(f'пользователей: {len(user_ids)}')
+        product_ids = self.create_products(user_ids, city_ids, category_ids, log)
+        favorites = self.create_favorites(user_ids, product_ids)
+        log(f'избранного: {favorites}')
+        self.finish(city_ids, user_ids, product_ids)
+        log('индексы и счётчики пересчитаны')
+        return product_ids
+
+    def shuffled(self, ids):
+        # ранг популярности не должен совпадать с порядком создания
+        ids = list(ids)
+        self.random.shuffle(ids)
+        return ids
+
+    def create_cities(self):
+        cities = City.objects.bulk_create(City(name=f'{self.prefix} город {i}') for i in range(self.cities))
+        return [city.id for city in cities]
+
+    def create_categories(self):
+        """Дерево глубины len(category_fanout) с таблицей замыкания; товары привязываются к листьям."""
+        level = [None]
+        ancestors = {None: []}
+        links = []
+        with transaction.atomic():
+            for fanout in self.category_fanout:
+                children = []
+                for parent in level:
+                    prefix = f'{parent.name}.' if parent else f'{self.prefix} категория '
+                    children += [Category(name=f'{prefix}{i}', parent=parent) for i in range(fanout)]
+                level = Category.objects.bulk_create(children)
+                for category in level:
+                    ancestors[category.id] = [(category.id, 0)] + [
+                        (ancestor_id, depth + 1) for ancestor_id, depth in ancestors[category.parent_id]
+                    ]
+                    links += [
+                        CategoryClosure(ancestor_id=ancestor_id, descendant_id=category.id, depth=depth)
+                        for ancestor_id, depth in ancestors[category.id]
+                    ]
+            CategoryClosure.objects.bulk_create(links, batch_size=500)
+        return [category.id for category in level]
+
+    def create_users(self):
+        user_ids = []
+        for start in range(0, self.users, self.batch_size):
+            with transaction.atomic():
+                users = User.objects.bulk_create(
+                    User(username=f'{self.prefix}-{i}', phone=f'{self.prefix}-{i}', email=f'{self.prefix}-{i}@example.com')
+                    for i in range(start, min(start + self.batch_size, self.users))
+                )
+            user_ids += [user.id for user in users]
+        return user_ids
+
+    def create_products(self, user_ids, city_ids, category_ids, log):
+        sellers = self.shuffled(user_ids[:max(1, int(len(user_ids) * self.sellers_share))])
+        city_ids, category_ids = self.shuffled(city_ids), self.shuffled(category_ids)
+        weights = {
+            'author_id': (sellers, zipf_cum_weights(len(sellers), self.popularity_skew)),
+            'city_id': (city_ids, zipf_cum_weights(len(city_ids), self.popularity_skew)),
+            'category_id': (category_ids, zipf_cum_weights(len(category_ids), self.popularity_skew)),
+        }
+        now = timezone.now()
+        product_ids = []
+        for start in range(0, self.products, self.batch_size):
+            count = min(self.batch_size, self.products - start)
+            choices = {
+                field: self.random.choices(population, cum_weights=cum_weights, k=count)
+                for field, (population, cum_weights) in weights.items()
+            }
+            with transaction.atomic():
+                ids = insert_rows_returning_ids(Product, PRODUCT_FIELDS, (
+                    self.make_product(now, **{field: values[i] for field, values in choices.items()})
+                    for i in range(count)
+                ))
+                insert_rows(ProductImage, ('product', 'image', 'description'), (
+                    (product_id, 'default_image.png', '') for product_id in ids for _ in range(self.images_per_product)
+                ))
+                insert_rows(ProductFeature, ('product', 'name', 'value'), (
+                    (product_id, name, self.random.choice(FEATURES[name]))
+                    for product_id in ids for name in self.random.sample(list(FEATURES), self.features_per_product)
+                ))
+                for chunk in chunked(ids):
+                    search.backend.index_products(chunk)
+            product_ids += ids
+            log(f'товаров: {len(product_ids)}/{self.products}')
+        return product_ids
+
+    def make_product(self, now, author_id, city_id, category_id):
+        """Строка товара в порядке PRODUCT_FIELDS."""
+        choice = self.random.choice
+        word = choice(WORDS)
+        name = f'{choice(ADJECTIVES)} {word} {choice(BRANDS)} {self.random.randint(100, 9999)}'.capitalize()
+        created_at = connection.ops.adapt_datetimefield_value(
+            now - timedelta(seconds=self.random.randint(0, self.days * 86400)),
+        )
+        active = self.random.random() < self.active_share
+        return (
+            name,
+            f'{name}. Продается {word}, {choice(ADJECTIVES)}, самовывоз или доставка. ' * 3,
+            int(self.random.lognormvariate(8, 1.5)),
+            choice(Product.PriceSuffix.values),
+            self.random.random() < 0.2,
+            Product.Status.ACTIVE.value if active else choice(INACTIVE_STATUSES),
+            author_id,
+            category_id,
+            created_at,
+            created_at,
+            city_id,
+            0,
+        )
+
+    def favorites_count(self):
+        """Число избранного у пользователя: экспоненциальное со средним favorites_per_user."""
+        if self.favorites_per_user <= 0:
+            return 0
+        return int(self.random.expovariate(1 / self.favorites_per_user))
+
+    def create_favorites(self, user_ids, product_ids):
+        products = self.shuffled(product_ids)
+        cum_weights = zipf_cum_weights(len(products), self.favorites_skew)
+        limit = len(products) // 2
+        rows, created = [], 0
+        for user_id in user_ids:
+            count = min(self.favorites_count(), limit)
+            # повторы при выборке с возвращением отбрасываются
+            favorites = set(self.random.choices(products, cum_weights=cum_weights, k=count))
+            rows += [(user_id, product_id) for product_id in favorites]
+            if len(rows) >= self.batch_size:
+                created += self.insert_favorites(rows)
+                rows = []
+        return created + self.insert_favorites(rows)
+
+    @staticmethod
+    def insert_favorites(rows):
+        with transaction.atomic():
+            insert_rows(ProductFavorite, ('user', 'product'), rows)
+        return len(rows)
+
+    def finish(self, city_ids, user_ids, product_ids):
+        favorites = ProductFavorite.objects.values('user_id')
+        for chunk in chunked(user_ids):
+            User.objects.filter(pk__in=chunk).update(favorites_count=Coalesce(Subquery(
+                favorites.filter(user_id=OuterRef('pk')).annotate(count=Count('id')).values('count'),
+            ), 0))
+        subscribers = ProductFavorite.objects.values('product_id')
+        for chunk in chunked(product_ids):
+            Product.objects.filter(pk__in=chunk).update(subscribers_count=Coalesce(Subquery(
+                subscribers.filter(product_id=OuterRef('pk')).annotate(count=Count('id')).values('count'),
+            ), 0))
+        for model in (City, Category, Product, ProductImage, ProductFeature, User):
+            versions.bump(sender=model)
+        feed.bump(*city_ids)
@@ -1,6 +1,10 @@
+from django.conf import settings
+from django.db import connections, router, transaction
+from django.utils import timezone
 from rest_framework import serializers
 
-from .models import Category, Product, User, City, ProductFeature, ProductImage
+from . import feed, images, search
+from .models import Category, Product, User, City, ProductFeature, ProductImage, ProductFavorite
 
 
 class CategoryHierarchySerializer(serializers.ModelSerializer):
@@ -17,10 +21,14 @@ class CategoryHierarchySerializer(serializers.ModelSerializer):
 
 
 class CategorySerializer(serializers.ModelSerializer):
+    srcset = serializers.SerializerMethodField()
 
     class Meta:
         model = Category
-        fields = ('id', 'name', 'image')
+        fields = ('id', 'name', 'image', 'srcset')
+
+    def get_srcset(self, obj):
+        return images.get_srcset(obj.image)
 
 
 
@@ -65,7 +73,10 @@ class ProductSerializer(serializers.ModelSerializer):
         fields = ('id', 'images', 'name', 'description', 'price', 'price_suffix', 'is_lower_bound', 'category', 'city_id', 'city_name', 'min_price', 'max_price', 'features', 'is_favorite', 'author')
 
     def get_images(self, obj):
-        return [{'id': image.id, 'img': image.image.url} for image in obj.images.all()]
+        return [
+            {'id': image.id, 'img': image.image.url, 'srcset': images.get_srcset(image.image)}
+            for image in obj.images.all()
+        ]
 
     def get_city_id(self, obj: Product):
         return obj.city.id if obj.city else None
@@ -90,38 +101,82 @@ class ProductSerializer(serializers.ModelSerializer):
             return max(obj.price, max_price_filtered)
 
     def is_favorite_method(self, obj):
+        # значение из аннотации Product.objects.with_favorite()
+        if hasattr(obj, 'is_favorite'):
+            return obj.is_favorite
         user = None
         request = self.context.get("request")
         if request and hasattr(request, "user"):
             user = request.user
-        if user and user.id in [sub.user.id for sub in obj.subscribers.all()]:
-            return True
+        if user and user.is_authenticated:
+            return ProductFavorite.objects.filter(product_id=obj.id, user_id=user.id).exists()
         return False
 
     def update(self, instance, validated_data):
-        features_data = validated_data.pop('features', [])
-        instance.features.all().delete()
-        for feature_data in features_data:
-            name = feature_data.get('name')
-            value = feature_data.get('value')
-            ProductFeature.objects.create(product=instance, name=name, value=value)
-
-        for key, value in validated_data.items():
-            setattr(instance, key, value)
-
-        instance.save()
+        """
+        Запрос без ключа features оставляет характеристики как есть (раньше он их
+        удалял): частичное обновление меняет только переданное, и PUT у
+        ProductDetail тоже частичный. Удалить все характеристики можно, передав
+        features: [].
+        """
+        features_data = validated_data.pop('features', None)
+        with transaction.atomic():
+            # блокируем товар и перечитываем его: instance загружен до блокировки, и save()
+            # записал бы поверх параллельной правки устаревшие значения непереданных полей
+            Product.objects.select_for_update().filter(pk=instance.pk).values_list('pk').first()
+            instance.refresh_from_db()
+            if features_data is not None:
+                self.update_features(instance, features_data)
+
+            for key, value in validated_data.items():
+                setattr(instance, key, value)
+
+            # save() обновляет updated_at, поисковый индекс и ленту и за изменения характеристик
+            instance.save()
         return instance
 
+    @staticmethod
+    def update_features(instance, features_data):
+        """
+        Применяет новый список характеристик как разницу со старым по имени:
+        совпадающие строки не трогаются, изменённые значения — одним bulk_update,
+        новые — одним bulk_create, лишние — одним DELETE.
+        """
+        existing = {}
+        for feature in ProductFeature.objects.filter(product=instance).order_by('id'):
+            existing.setdefault(feature.name, []).append(feature)
+
+        changed, created = [], []
+        for feature_data in features_data:
+            name, value = feature_data.get('name'), feature_data.get('value')
+            same_name = existing.get(name)
+            if not same_name:
+                created.append(ProductFeature(product=instance, name=name, value=value))
+                continue
+            feature = same_name.pop(0)
+            if feature.value != value:
+                feature.value = value
+                changed.append(feature)
+        removed = [feature.id for features in existing.values() for feature in features]
+
+        if changed:
+            ProductFeature.objects.bulk_update(changed, ['value'])
+        if created:
+            ProductFeature.objects.bulk_create(created)
+        if removed:
+            # без сигналов post_delete по каждой строке: их работу делает instance.save()
+            placeholders = ', '.join(['%s'] * len(removed))
+            with connections[router.db_for_write(ProductFeature)].cursor() as cursor:
+                cursor.execute(f'DELETE FROM {ProductFeature._meta.db_table} WHERE id IN ({placeholders})', removed)
+
 
 class UserSerializer(serializers.ModelSerializer):
-    favorites = serializers.SerializerMethodField('get_favorites')
+    # сами избранные товары отдаются постранично: GET /api/user/favorites/
 
     class Meta:
         model = User
-        fields = ('id', 'username', 'email', 'first_name', 'last_name', 'phone', 'favorites')
-
-    def get_favorites(self, obj):
-        return ProductSerializer([fav.product for fav in obj.favorites.all()], many=True, context=self.context).data
+        fields = ('id', 'username', 'email', 'first_name', 'last_name', 'phone', 'favorites_count')
+        read_only_fields = ('favorites_count',)
 
     def update(self, instance, validated_data):
         instance.email = validated_data.get('email', instance.email)
@@ -160,6 +215,72 @@ class ProductCreateSerializer(serializers.ModelSerializer):
         return product
 
 
+class PrefetchedPrimaryKeyField(serializers.PrimaryKeyRelatedField):
+    """
+    PK связанного объекта, который ищется в словаре context[lookup], заранее
+    загруженном через in_bulk(), а не отдельным запросом на каждый элемент пачки.
+    """
+
+    def __init__(self, lookup, **kwargs):
+        self.lookup = lookup
+        super().__init__(**kwargs)
+
+    def to_internal_value(self, data):
+        if isinstance(data, bool):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        try:
+            pk = int(data)
+        except (TypeError, ValueError):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        obj = self.context[self.lookup].get(pk)
+        if obj is None:
+            self.fail('does_not_exist', pk_value=data)
+        return obj
+
+
+class ProductBulkCreateSerializer(ProductCreateSerializer):
+    city = PrefetchedPrimaryKeyField('cities', queryset=City.objects.all())
+    category = PrefetchedPrimaryKeyField('categories', queryset=Category.objects.all())
+
+    class Meta(ProductCreateSerializer.Meta):
+        fields = tuple(field for field in ProductCreateSerializer.Meta.fields if field != 'id')
+
+    @staticmethod
+    def get_context(items, context):
+        """Контекст для проверки пачки: все города и категории загружаются одним запросом на модель."""
+        def pks(key):
+            return {
+                int(item[key]) for item in items
+                if isinstance(item, dict) and str(item.get(key, '')).isdigit()
+            }
+        return {
+            **context,
+            'cities': City.objects.in_bulk(pks('city')),
+            'categories': Category.objects.in_bulk(pks('category')),
+        }
+
+    @staticmethod
+    def bulk_create(validated_items, author):
+        """
+        Создаёт проверенные товары и их характеристики двумя bulk_create в одной
+        транзакции. Сигналы post_save при этом не срабатывают, поэтому поисковый
+        индекс и ленты городов обновляются здесь же.
+        """
+        with transaction.atomic():
+            products = Product.objects.bulk_create([
+                Product(author=author, **{key: value for key, value in data.items() if key != 'features'})
+                for data in validated_items
+            ])
+            ProductFeature.objects.bulk_create([
+                ProductFeature(product=product, **feature)
+                for product, data in zip(products, validated_items)
+                for feature in data.get('features', [])
+            ])
+            search.backend.index_products([product.id for product in products])
+        feed.bump(*{product.city_id for product in products})
+        return products
+
+
 class ProductImageSerializer(serializers.ModelSerializer):
     id = serializers.IntegerField(required=False)
     images = serializers.ListField(
@@ -171,12 +292,39 @@ class ProductImageSerializer(serializers.ModelSerializer):
         model = ProductImage
         fields = ('id', 'images')
 
+    def validate_images(self, value):
+        max_count = getattr(settings, 'PRODUCT_IMAGE_MAX_COUNT', 10)
+        max_size = getattr(settings, 'PRODUCT_IMAGE_MAX_SIZE', 15 * 1024 * 1024)
+        max_total_size = getattr(settings, 'PRODUCT_IMAGE_MAX_TOTAL_SIZE', 50 * 1024 * 1024)
+        if len(value) > max_count:
+            raise serializers.ValidationError(f'Можно загрузить не больше {max_count} изображений за раз')
+        for image in value:
+            if image.size > max_size:
+                raise serializers.ValidationError(f'Файл {image.name} больше {max_size // (1024 * 1024)} МБ')
+        if sum(image.size for image in value) > max_total_size:
+            raise serializers.ValidationError(
+                f'Общий размер файлов больше {max_total_size // (1024 * 1024)} МБ',
+            )
+        return value
+
     def create(self, validated_data):
         uploaded_images = validated_data.pop("images")
-        product_id = self.context['request'].parser_context['kwargs']['product_id']
-        for image in uploaded_images:
-            ProductImage.objects.create(product_id=product_id, image=image)
-        return uploaded_images
+        product = validated_data['product']
+        try:
+            names = images.store_uploads(uploaded_images, ProductImage._meta.get_field('image'))
+        except images.InvalidImage as exc:
+            raise serializers.ValidationError({'images': [f'Файл {exc} повреждён или не является изображением']})
+        try:
+            with transaction.atomic():
+                created = ProductImage.objects.bulk_create([ProductImage(product=product, image=name) for name in names])
+                Product.objects.filter(pk=product.pk).update(updated_at=timezone.now())
+        except Exception:
+            images.discard(names)
+            raise
+        feed.bump(product.city_id)
+        # bulk_create не шлёт post_save, поэтому превью ставим в очередь сами
+        transaction.on_commit(lambda: [images.schedule(name) for name in names])
+        return created
 
 
 class UserUpdateSerializer(serializers.ModelSerializer):
@@ -0,0 +1,137 @@
+from django.db import transaction
+from django.db.backends.signals import connection_created
+from django.db.models import F
+from django.utils import timezone
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+
+from . import authentication, feed, images, query_stats, search, versions
+from .models import Category, CategoryImage, City, Product, ProductFavorite, ProductFeature, ProductImage, User
+
+
+# версии справочников: по ним инвалидируется дерево категорий и считаются ETag
+for model in (City, Category, CategoryImage):
+    post_save.connect(versions.bump, sender=model, dispatch_uid=f'versions_{model.__name__}_save')
+    post_delete.connect(versions.bump, sender=model, dispatch_uid=f'versions_{model.__name__}_delete')
+
+
+def index_product(sender, instance, **kwargs):
+    search.backend.index_product(instance.id)
+
+
+def remove_product(sender, instance, **kwargs):
+    search.backend.remove_product(instance.id)
+
+
+def index_feature_product(sender, instance, **kwargs):
+    search.backend.index_product(instance.product_id)
+
+
+post_save.connect(index_product, sender=Product, dispatch_uid='search_product_save')
+post_delete.connect(remove_product, sender=Product, dispatch_uid='search_product_delete')
+post_save.connect(index_feature_product, sender=ProductFeature, dispatch_uid='search_feature_save')
+post_delete.connect(index_feature_product, sender=ProductFeature, dispatch_uid='search_feature_delete')
+
+
+def schedule_derivatives(sender, instance, **kwargs):
+    name = instance.image.name
+    transaction.on_commit(lambda: images.schedule(name))
+
+
+def delete_derivatives(sender, instance, **kwargs):
+    # картинка по умолчанию общая для многих записей
+    if instance.image.name and instance.image.name != instance._meta.get_field('image').default:
+        images.delete_derivatives(instance.image.name)
+
+
+for model in (ProductImage, CategoryImage, Category):
+    post_save.connect(schedule_derivatives, sender=model, dispatch_uid=f'images_{model.__name__}_save')
+    post_delete.connect(delete_derivatives, sender=model, dispatch_uid=f'images_{model.__name__}_delete')
+
+
+def touch_product(sender, instance, **kwargs):
+    # изменения фото и характеристик должны менять Last-Modified/ETag карточки товара и ленту
+    Product.objects.filter(pk=instance.product_id).update(updated_at=timezone.now())
+    feed.bump_product(instance.product_id)
+
+
+def remember_product_city(sender, instance, **kwargs):
+    instance._previous_city_id = None
+    if instance.pk is not None:
+        instance._previous_city_id = Product.objects.filter(pk=instance.pk).values_list('city_id', flat=True).first()
+
+
+def bump_product_feed(sender, instance, **kwargs):
+    # при переносе товара в другой город сбрасываются ленты обоих городов
+    feed.bump(instance.city_id, getattr(instance, '_previous_city_id', None))
+
+
+pre_save.connect(remember_product_city, sender=Product, dispatch_uid='feed_product_pre_save')
+post_save.connect(bump_product_feed, sender=Product, dispatch_uid='feed_product_save')
+post_delete.connect(bump_product_feed, sender=Product, dispatch_uid='feed_product_delete')
+
+
+def bump_city_feed(sender, instance, **kwargs):
+    # название города входит в карточку товара
+    feed.bump(instance.pk)
+
+
+def bump_author_feed(sender, instance, update_fields=None, **kwargs):
+    if update_fields is not None and not set(update_fields) & {'username', 'email', 'phone'}:
+        return
+    feed.bump_author(instance.pk)
+
+
+post_save.connect(bump_city_feed, sender=City, dispatch_uid='feed_city_save')
+post_delete.connect(bump_city_feed, sender=City, dispatch_uid='feed_city_delete')
+post_save.connect(bump_author_feed, sender=User, dispatch_uid='feed_user_save')
+
+
+for model in (ProductImage, ProductFeature):
+    post_save.connect(touch_product, sender=model, dispatch_uid=f'touch_product_{model.__name__}_save')
+    post_delete.connect(touch_product, sender=model, dispatch_uid=f'touch_product_{model.__name__}_delete')
+
+
+def update_favorite_counters(instance, delta):
+    User.objects.filter(pk=instance.user_id).update(favorites_count=F('favorites_count') + delta)
+    Product.objects.filter(pk=instance.product_id).update(subscribers_count=F('subscribers_count') + delta)
+
+
+# избранное, созданное через ORM; ProductFavorite.objects.add()/remove() сигналов не вызывают
+# и обновляют счётчики сами, а удаление через ORM — ProductFavoriteQuerySet.delete
+def count_added_favorite(sender, instance, created, **kwargs):
+    if created:
+        update_favorite_counters(instance, 1)
+
+
+# Каскадное удаление избранного вместе с товаром или пользователем: счётчики другой
+# стороны уменьшаются одним UPDATE до удаления. Обработчика удаления у ProductFavorite
+# нет, поэтому сами строки избранного удаляются одним DELETE, без загрузки в память.
+def count_removed_product_favorites(sender, instance, using, **kwargs):
+    User.objects.using(using).filter(favorites__product_id=instance.pk).update(
+        favorites_count=F('favorites_count') - 1,
+    )
+
+
+def count_removed_user_favorites(sender, instance, using, **kwargs):
+    Product.objects.using(using).filter(subscribers__user_id=instance.pk).update(
+        subscribers_count=F('subscribers_count') - 1,
+    )
+
+
+post_save.connect(count_added_favorite, sender=ProductFavorite, dispatch_uid='count_favorite_save')
+pre_delete.connect(count_removed_product_favorites, sender=Product, dispatch_uid='count_favorite_product_delete')
+pre_delete.connect(count_removed_user_favorites, sender=User, dispatch_uid='count_favorite_user_delete')
+
+
+def bump_user_token_version(sender, instance, update_fields=None, **kwargs):
+    # вход пользователя (UPDATE_LAST_LOGIN) меняет только last_login и кэш не сбрасывает
+    if update_fields is not None and set(update_fields) <= {'last_login'}:
+        return
+    authentication.bump_token_version(instance.pk)
+
+
+post_save.connect(bump_user_token_version, sender=User, dispatch_uid='auth_user_save')
+post_delete.connect(bump_user_token_version, sender=User, dispatch_uid='auth_user_delete')
+
+
+connection_created.connect(query_stats.install, dispatch_uid='query_stats_install')
@@ -1,3 +1,1196 @@
-from django.test import TestCase
+import fcntl
+import importlib
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+from base64 import urlsafe_b64encode
+from contextlib import closing, contextmanager
+from datetime import timedelta
+from io import BytesIO, StringIO
+from unittest import mock
+from urllib.parse import parse_qs, urlsplit
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import update_last_login
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile, TemporaryUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import connection, connections, router, transaction
+from django.db.models import Count
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import clear_url_caches, resolve
+from django.utils import timezone
+from django.utils.http import parse_http_date
+from PIL import Image
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from . import async_views as async_views_module
+from . import urls as app_urls
+from . import (
+    authentication, cards, category_tree, checks, images, query_stats, routers, search, seeding, tokens, versions, views,
+)
+from .models import Category, CategoryClosure, City, Product, ProductFavorite, ProductFeature, ProductImage, User
+from .serializers import ProductSerializer
+
+
+_media_settings = None
+
+
+def setUpModule():
+    # изображения и превью тестов пишутся во временный MEDIA_ROOT, превью создаются сразу;
+    # общий кэш счётчиков — отдельный LocMem, а не кэш запущенного сервера разработки
+    global _media_settings
+    media_root = tempfile.mkdtemp()
+    shutil.copy(os.path.join(settings.MEDIA_ROOT, 'default_image.png'), media_root)
+    _media_settings = override_settings(
+        MEDIA_ROOT=media_root, IMAGE_DERIVATIVES_ASYNC=False,
+        CACHES={
+            **settings.CACHES,
+            'shared': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'tests-shared'},
+        },
+    )
+    _media_settings.enable()
+    images.generate_derivatives('default_image.png')
+
+
+def tearDownModule():
+    media_root = settings.MEDIA_ROOT
+    _media_settings.disable()
+    images._ready.clear()
+    shutil.rmtree(media_root)
+
+
+class QueryBudgetMixin:
+    """
+    Проверка бюджета SQL-запросов: эндпоинт должен укладываться в фиксированное
+    число запросов независимо от размера страницы.
+    """
+
+    @contextmanager
+    def assertQueryBudget(self, budget):
+        with CaptureQueriesContext(connection) as context:
+            yield context
+        executed = len(context.captured_queries)
+        if executed > budget:
+            queries = '\n'.join(query['sql'] for query in context.captured_queries)
+            self.fail(f'{executed} queries executed, budget is {budget}:\n{queries}')
+
+    def assertEndpointBudget(self, url, budget, sizes, populate, data=None):
+        for size in sizes:
+            populate(size)
+            with self.assertQueryBudget(budget):
+                response = self.client.get(url, data)
+            self.assertEqual(response.status_code, 200)
+
+
+class ProductQueryBudgetTests(QueryBudgetMixin, TestCase):
+    client_class = APIClient
+
+    def setUp(self):
+        self.city = City.objects.create(name='Екатеринбург')
+        self.category = Category.objects.create(name='Инструменты')
+        self.author = User.objects.create(username='seller', phone='1')
+        self.user = User.objects.create(username='buyer', phone='2')
+
+    def populate(self, size):
+        for i in range(size - Product.objects.count()):
+            product = Product.objects.create(
+                name=f'Дрель {i}', description='', price=100 + i, status=Product.Status.ACTIVE,
+                author=self.author, category=self.category, city=self.city,
+            )
+            ProductImage.objects.create(product=product)
+            ProductFeature.objects.create(product=product, name='Мощность', value='500 Вт')
+            ProductFavorite.objects.create(product=product, user=self.user)
+
+    def test_product_list(self):
+        self.assertEndpointBudget('/product', 3, (1, 15), self.populate, {'status': 'AC'})
+
+    def test_product_search(self):
+        # дерево категорий для фасетов строится один раз на версию и в бюджет не входит
+        category_tree.get_tree()
+        self.assertEndpointBudget('/search/', 5, (1, 15), self.populate, {'category': self.category.id})
+
+    def test_product_detail(self):
+        self.populate(1)
+        product = Product.objects.get()
+        # +1 запрос на updated_at для ETag/Last-Modified
+        with self.assertQueryBudget(4):
+            response = self.client.get(f'/product/{product.id}/')
+        self.assertEqual(response.status_code, 200)
+
+    def test_user_favorites(self):
+        self.client.force_authenticate(self.user)
+        self.assertEndpointBudget('/api/user/favorites/', 3, (1, 15), self.populate)
+        with self.assertQueryBudget(1):
+            response = self.client.get('/api/user/')
+        self.assertEqual(response.json()['favorites_count'], 15)
+
+    def test_is_favorite_does_not_depend_on_subscribers(self):
+        self.populate(1)
+        product = Product.objects.get()
+        for i in range(20):
+            subscriber = User.objects.create(username=f'subscriber{i}', phone=f'3{i}')
+            ProductFavorite.objects.create(product=product, user=subscriber)
+        self.client.force_authenticate(self.user)
+        # общая страница ленты + один запрос на избранное пользователя
+        with self.assertQueryBudget(4):
+            response = self.client.get('/product', {'status': 'AC'})
+        self.assertTrue(response.json()['results'][0]['is_favorite'])
+        with self.assertQueryBudget(1):
+            self.client.get('/product', {'status': 'AC'})
+        self.client.force_authenticate(self.author)
+        self.assertFalse(self.client.get('/product', {'status': 'AC'}).json()['results'][0]['is_favorite'])
+
+
+class KeysetPaginationTests(TestCase):
+    client_class = APIClient
+
+    def setUp(self):
+        category = Category.objects.create(name='Инструменты')
+        author = User.objects.create(username='seller', phone='1')
+        for price in (300, 100, 200, 100, 500, 400, 100):
+            Product.objects.create(
+                name='Дрель', description='', price=price, status=Product.Status.ACTIVE,
+                author=author, category=category,
+            )
+
+    def walk(self, url, data):
+        ids = []
+        response = self.client.get(url, data)
+        while True:
+            page = response.json()
+            ids += [item['id'] for item in page['results']]
+            if not page['next']:
+                return ids, page
+            response = self.client.get(page['next'])
+
+    def test_pages_cover_listing_once_in_order(self):
+        ids, _ = self.walk('/product', {'status': 'AC', 'page_size': 3})
+        self.assertEqual(ids, list(Product.objects.order_by('-created_at', '-id').values_list('id', flat=True)))
+
+    def test_price_ordering_and_previous_page(self):
+        ids, last_page = self.walk('/search/', {'ordering': 'price', 'page_size': 2})
+        self.assertEqual(ids, list(Product.objects.order_by('price', 'id').values_list('id', flat=True)))
+        previous = self.client.get(last_page['previous']).json()
+        self.assertEqual([item['id'] for item in previous['results']], ids[-3:-1])
+
+    def test_tampered_cursor_is_not_found(self):
+        ordering = '-created_at,-id'
+        for position in (['abc', 1], [{'a': 1}, 1], [None, 1], ['2024-01-01T00:00:00+00:00', 'x'], [1]):
+            cursor = urlsafe_b64encode(json.dumps({'p': position, 'r': 0, 'o': ordering}).encode()).decode()
+            for url in ('/product', '/search/'):
+                response = self.client.get(url, {'status': 'AC', 'cursor': cursor})
+                self.assertEqual(response.status_code, 404, (url, position))
+                self.assertEqual(response.json(), {'detail': 'Invalid cursor'})
+
+    def test_cursor_bound_to_ordering(self):
+        next_link = self.client.get('/search/', {'ordering': 'new', 'page_size': 2}).json()['next']
+        cursor = parse_qs(urlsplit(next_link).query)['cursor'][0]
+        response = self.client.get('/search/', {'ordering': 'price', 'cursor': cursor})
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(self.client.get('/search/', {'ordering': 'new', 'cursor': cursor}).status_code, 200)
+
+
+class CategoryClosureTests(TestCase):
+
+    def setUp(self):
+        self.root = Category.objects.create(name='Инструменты')
+        self.child = Category.objects.create(name='Дрели', parent=self.root)
+        self.grandchild = Category.objects.create(name='Ударные дрели', parent=self.child)
+        self.other = Category.objects.create(name='Материалы')
+
+    def links(self):
+        return set(CategoryClosure.objects.values_list('ancestor_id', 'descendant_id', 'depth'))
+
+    def assertClosureMatchesParents(self):
+        links = self.links()
+        CategoryClosure.rebuild()
+        self.assertEqual(links, self.links())
+
+    def test_create(self):
+        self.assertIn((self.root.id, self.grandchild.id, 2), self.links())
+        # явный pk у новой категории
+        explicit = Category.objects.create(id=1000, name='Шуруповерты', parent=self.child)
+        self.assertIn((self.root.id, explicit.id, 2), self.links())
+        self.assertClosureMatchesParents()
+
+    def test_move(self):
+        self.child.parent = self.other
+        self.child.save()
+        self.assertEqual(Category.get_descendant_ids(self.root.id), [self.root.id])
+        self.assertEqual(
+            sorted(Category.get_descendant_ids(self.other.id)),
+            sorted([self.other.id, self.child.id, self.grandchild.id]),
+        )
+        self.assertClosureMatchesParents()
+
+    def test_delete(self):
+        self.child.delete()
+        self.assertEqual(self.links(), {(self.root.id, self.root.id, 0), (self.other.id, self.other.id, 0)})
+
+    def test_cycle_rejected(self):
+        self.root.parent = self.grandchild
+        with self.assertRaises(ValidationError):
+            self.root.full_clean()
+        with self.assertRaises(ValueError):
+            self.root.save()
+        self.root.refresh_from_db()
+        self.assertIsNone(self.root.parent_id)
+        self.assertClosureMatchesParents()
+
+    def test_descendants_in_depth_first_order(self):
+        sibling = Category.objects.create(name='Пилы', parent=self.root)
+        self.assertEqual(self.root.get_descendants(), [self.child, self.grandchild, sibling])
+
+
+class ProductSearchTests(TestCase):
+    client_class = APIClient
+
+    def setUp(self):
+        author = User.objects.create(username='seller', phone='1')
+        category = Category.objects.create(name='Инструменты')
+        for name, description in (
+            ('Шуруповерт', 'Подходит вместо дрели'),
+            ('Дрель ударная makita', ''),
+            ('Перфоратор bosch', 'Сверлит бетон'),
+        ):
+            Product.objects.create(
+                name=name, description=description, price=100, status=Product.Status.ACTIVE,
+                author=author, category=category,
+            )
+
+    def search(self, query):
+        response = self.client.get('/search/', {'name': query})
+        self.assertEqual(response.status_code, 200)
+        return [item['name'] for item in response.json()['results']]
+
+    def test_stemming(self):
+        self.assertEqual(self.search('ударную'), ['Дрель ударная makita'])
+        self.assertEqual(self.search('бетона'), ['Перфоратор bosch'])
+
+    def test_prefix_matching(self):
+        self.assertEqual(self.search('перфо'), ['Перфоратор bosch'])
+        self.assertEqual(self.search('mak'), ['Дрель ударная makita'])
+
+    def test_name_matches_rank_above_description(self):
+        self.assertEqual(self.search('дрели'), ['Дрель ударная makita', 'Шуруповерт'])
+
+
+class SearchFacetTests(TestCase):
+    client_class = APIClient
+
+    def setUp(self):
+        self.author = User.objects.create(username='seller', phone='1')
+        self.root = Category.objects.create(name='Инструменты')
+        self.child = Category.objects.create(name='Дрели', parent=self.root)
+        self.other = Category.objects.create(name='Материалы')
+        self.city_a = City.objects.create(name='Екатеринбург')
+        self.city_b = City.objects.create(name='Пермь')
+        for category, city, price in (
+            (self.child, self.city_a, 100), (self.child, self.city_b, 300),
+            (self.other, self.city_a, 1000), (self.root, None, 550),
+        ):
+            self.create_product(category, city, price)
+
+    def create_product(self, category, city, price):
+        Product.objects.create(
+            name='Дрель', description='', price=price, status=Product.Status.ACTIVE,
+            author=self.author, category=category, city=city,
+        )
+
+    def get_facets(self, **params):
+        return self.client.get('/search/', params).json()['facets']
+
+    def test_payload(self):
+        facets = self.get_facets()
+        self.assertEqual(facets['total'], 4)
+        self.assertEqual(facets['price'], {'min': 100, 'max': 1000})
+        # родительская категория включает товары дочерних
+        self.assertEqual(facets['categories'], [
+            {'id': self.root.id, 'count': 3}, {'id': self.child.id, 'count': 2}, {'id': self.other.id, 'count': 1},
+        ])
+        self.assertEqual(facets['cities'], [
+            {'id': None, 'count': 1}, {'id': self.city_a.id, 'count': 2}, {'id': self.city_b.id, 'count': 1},
+        ])
+        histogram = facets['histogram']
+        self.assertEqual([bucket['count'] for bucket in histogram], [1, 0, 1, 0, 1, 0, 0, 0, 0, 1])
+        self.assertEqual(histogram[0], {'from': 100, 'to': 190, 'count': 1})
+        self.assertEqual(histogram[-1], {'from': 919, 'to': 1000, 'count': 1})
+        self.assertEqual(self.get_facets(category=self.child.id)['categories'], [
+            {'id': self.root.id, 'count': 2}, {'id': self.child.id, 'count': 2},
+        ])
+
+    def test_writes_invalidate_cached_facets(self):
+        self.get_facets()
+        self.create_product(self.child, self.city_b, 2000)
+        facets = self.get_facets()
+        self.assertEqual(facets['total'], 5)
+        self.assertEqual(facets['price']['max'], 2000)
+        self.child.parent = None
+        self.child.save()
+        self.assertEqual(self.get_facets()['categories'][0], {'id': self.root.id, 'count': 1})
+
+
+class ModelVersionTests(TestCase):
+
+    def test_tokens_shared_between_workers(self):
+        version = versions.get_version(City)
+        # локальный кэш другого воркера пуст, но версия у него та же
+        cache.clear()
+        self.assertEqual(versions.get_version(City), version)
+        City.objects.create(name='Пермь')
+        self.assertNotEqual(versions.get_version(City), version)
+
+    def test_reference_validators_do_not_depend_on_worker(self):
+        response = self.client.get('/city')
+        cache.clear()
+        repeated = self.client.get('/city', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(repeated.status_code, 304)
+        self.assertEqual(repeated['Last-Modified'], response['Last-Modified'])
+        City.objects.create(name='Пермь')
+        self.assertEqual(self.client.get('/city', HTTP_IF_NONE_MATCH=response['ETag']).status_code, 200)
+
+    def test_deploy_check_requires_shared_cache(self):
+        self.assertEqual([error.id for error in checks.check_shared_cache(None)], ['app.W001'])
+        redis = {**settings.CACHES, 'shared': {'BACKEND': 'django.core.cache.backends.redis.RedisCache'}}
+        with override_settings(CACHES=redis):
+            self.assertEqual(checks.check_shared_cache(None), [])
+
+
+class ProductFeedCacheTests(QueryBudgetMixin, TestCase):
+    client_class = APIClient
+
+    def setUp(self):
+        self.city = City.objects.create(name='Екатеринбург')
+        self.product = Product.objects.create(
+            name='Дрель', description='', price=100, status=Product.Status.ACTIVE,
+            author=User.objects.create(username='seller', phone='1'),
+            category=Category.objects.create(name='Инструменты'), city=self.city,
+        )
+
+    def get_feed(self):
+        return self.client.get('/product', {'city': self.city.id, 'status': 'AC'}).json()['results']
+
+    def test_cached_page_served_without_queries(self):
+        self.get_feed()
+        with self.assertQueryBudget(0):
+            self.get_feed()
+
+    def test_changes_invalidate_city_feed(self):
+        self.get_feed()
+        self.product.name = 'Перфоратор'
+        self.product.save()
+        self.assertEqual(self.get_feed()[0]['name'], 'Перфоратор')
+        ProductFeature.objects.create(product=self.product, name='Мощность', value='800 Вт')
+        self.assertEqual(self.get_feed()[0]['features'], [{'name': 'Мощность', 'value': '800 Вт'}])
+        self.product.city = City.objects.create(name='Пермь')
+        self.product.save()
+        self.assertEqual(self.get_feed(), [])
+
+    def test_author_and_city_changes_invalidate_feed(self):
+        self.get_feed()
+        self.product.author.phone = '2'
+        self.product.author.save()
+        self.assertEqual(self.get_feed()[0]['author']['phone'], '2')
+        self.city.name = 'Пермь'
+        self.city.save()
+        self.assertEqual(self.get_feed()[0]['city_name'], 'Пермь')
+        # вход пользователя карточку не меняет
+        update_last_login(None, self.product.author)
+        with self.assertQueryBudget(0):
+            self.get_feed()
+
+
+class ProductCardTests(TestCase):
+
+    def setUp(self):
+        city = City.objects.create(name='Екатеринбург')
+        category = Category.objects.create(name='Инструменты')
+        author = User.objects.create(username='seller', phone='1', email='seller@example.com')
+        self.user = User.objects.create(username='buyer', phone='2')
+        for i, suffix in enumerate(Product.PriceSuffix.values):
+            product = Product.objects.create(
+                name=f'Дрель {i}', description='Ударная' * i, price=100 * i, price_suffix=suffix,
+                is_lower_bound=bool(i % 2), status=Product.Status.ACTIVE,
+                author=author, category=category, city=city if i % 3 else None,
+            )
+            for _ in range(i % 3):
+                ProductImage.objects.create(product=product)
+                ProductFeature.objects.create(product=product, name='Мощность', value=f'{i}00 Вт')
+            if i % 2:
+                ProductFavorite.objects.create(product=product, user=self.user)
+
+    def test_cards_match_product_serializer(self):
+        queryset = Product.objects.with_favorite(self.user).order_by('id')
+        for context in ({}, {'min_price': 250, 'max_price': 450}):
+            expected = ProductSerializer(queryset.with_related(), many=True, context=context).data
+            rows = list(cards.card_queryset(queryset))
+            self.assertEqual(
+                JSONRenderer().render(cards.serialize_cards(rows, context)), JSONRenderer().render(expected),
+            )
+
+
+class ImageDerivativeTests(TestCase):
+
+    def setUp(self):
+        buffer = BytesIO()
+        Image.new('RGB', (2000, 1000), 'red').save(buffer, 'JPEG')
+        self.name = default_storage.save('images/test/photo.jpg', ContentFile(buffer.getvalue()))
+        self.addCleanup(images.delete_derivatives, self.name)
+
+    def test_srcset_switches_to_derivatives_once_generated(self):
+        original = default_storage.url(self.name)
+        # первая отдача ссылок ставит генерацию (в тестах — сразу) и указывает на оригинал
+        srcset = images.get_srcset_by_name(self.name)
+        self.assertEqual(srcset['thumb'], {'webp': original, 'jpeg': original})
+        srcset = images.get_srcset_by_name(self.name)
+        self.assertEqual(set(srcset), set(settings.IMAGE_DERIVATIVE_SIZES))
+        for size, max_side in settings.IMAGE_DERIVATIVE_SIZES.items():
+            for fmt in images.FORMATS:
+                name = images.derivative_name(self.name, size, fmt)
+                self.assertEqual(srcset[size][fmt], default_storage.url(name))
+                with default_storage.open(name) as derivative:
+                    self.assertEqual(max(Image.open(derivative).size), max_side)
+
+    def test_ready_derivatives_do_not_touch_storage(self):
+        images.generate_derivatives(self.name)
+        with mock.patch.object(default_storage, 'exists', side_effect=AssertionError):
+            images.get_srcset_by_name(self.name)
+
+    def test_delete_derivatives(self):
+        images.generate_derivatives(self.name)
+        images.delete_derivatives(self.name)
+        self.assertFalse(images.is_ready(self.name))
+        self.assertFalse(default_storage.exists(images.derivative_name(self.name, 'thumb', 'webp')))
+
+
+class ConditionalValidatorTests(TestCase):
+    """Данные карточки и справочника, меняющиеся без изменения updated_at и версий моделей."""
+
+    def setUp(self):
+        buffer = BytesIO()
+        Image.new('RGB', (600, 400), 'red').save(buffer, 'JPEG')
+        self.name = default_storage.save('images/test/photo.jpg', ContentFile(buffer.getvalue()))
+        self.addCleanup(images.delete_derivatives, self.name)
+        self.author = User.objects.create(username='seller', phone='1')
+        self.product = Product.objects.create(
+            name='Дрель', description='', price=100, status=Product.Status.ACTIVE, author=self.author,
+            category=Category.objects.create(name='Инструменты'), city=City.objects.create(name='Пермь'),
+        )
+        self.url = f'/product/{self.product.id}/'
+
+    def assertRevalidated(self, url, response):
+        """ETag устаревшего ответа даёт 200, свежего — 304."""
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 200)
+        fresh = self.client.get(url)
+        # Last-Modified с точностью до секунды, поэтому он лишь не уменьшается
+        self.assertGreaterEqual(parse_http_date(fresh['Last-Modified']), parse_http_date(response['Last-Modified']))
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=fresh['ETag']).status_code, 304)
+        return fresh
+
+    def test_author_contacts_change_product_validators(self):
+        response = self.client.get(self.url)
+        self.author.phone = '2'
+        self.author.save()
+        self.assertEqual(self.assertRevalidated(self.url, response).json()['author']['phone'], '2')
+
+    def test_ready_derivatives_change_product_validators(self):
+        ProductImage.objects.bulk_create([ProductImage(product=self.product, image=self.name)])
+        response = self.client.get(self.url)
+        original = default_storage.url(self.name)
+        self.assertEqual(response.json()['images'][0]['srcset']['thumb']['jpeg'], original)
+        # превью в тестах создаются сразу при первой отдаче ссылок
+        fresh = self.assertRevalidated(self.url, response)
+        self.assertNotEqual(fresh.json()['images'][0]['srcset']['thumb']['jpeg'], original)
+
+    def test_ready_derivatives_change_category_list_validators(self):
+        Category.objects.filter(pk=self.product.category_id).update(image=self.name)
+        versions.bump(sender=Category)
+        images.delete_derivatives(self.name)
+        response = self.client.get('/category')
+        fresh = self.assertRevalidated('/category', response)
+        self.assertNotEqual(fresh.json()[0]['srcset'], response.json()[0]['srcset'])
+
+
+class ProductImageUploadTests(QueryBudgetMixin, TestCase):
+    client_class = APIClient
+
+    def setUp(self):
+        self.author = User.objects.create(username='seller', phone='1')
+        self.product = Product.objects.create(
+            name='Дрель', description='', price=100, status=Product.Status.ACTIVE,
+            author=self.author, category=Category.objects.create(name='Инструменты'),
+        )
+        self.client.force_authenticate(self.author)
+        self.url = f'/product/{self.product.id}/image'
+
+    def make_file(self, name='photo.jpg', size=(400, 200), exif=None):
+        buffer = BytesIO()
+        Image.new('RGB', size, 'red').save(buffer, 'JPEG', **({'exif': exif} if exif else {}))
+        return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/jpeg')
+
+    def upload(self, *files):
+        return self.client.post(self.url, {'images': list(files)}, format='multipart')
+
+    @staticmethod
+    def stored_files():
+        return {os.path.join(root, name) for root, _, names in os.walk(settings.MEDIA_ROOT) for name in names}
+
+    @override_settings(PRODUCT_IMAGE_MAX_COUNT=2)
+    def test_count_limit(self):
+        self.assertEqual(self.upload(*(self.make_file(f'{i}.jpg') for i in range(3))).status_code, 400)
+        self.assertFalse(self.product.images.exists())
+
+    def test_size_limits(self):
+        size = len(self.make_file().read())
+        with override_settings(PRODUCT_IMAGE_MAX_SIZE=size - 1):
+            self.assertEqual(self.upload(self.make_file()).status_code, 400)
+        with override_settings(PRODUCT_IMAGE_MAX_TOTAL_SIZE=size * 2 - 1):
+            self.assertEqual(self.upload(self.make_file('1.jpg'), self.make_file('2.jpg')).status_code, 400)
+        self.assertFalse(self.product.images.exists())
+
+    def test_images_inserted_in_bulk_without_exif(self):
+        exif = Image.Exif()
+        exif[0x0112] = 6  # Orientation: поворот на 90°
+        exif[0x010F] = 'Camera'
+        with mock.patch.object(images, 'store_uploads', wraps=images.store_uploads) as store_uploads:
+            with self.assertQueryBudget(8) as context:
+                response = self.upload(self.make_file('1.jpg', exif=exif), self.make_file('2.jpg'), self.make_file('3.jpg'))
+        self.assertEqual(response.status_code, 201)
+        inserts = [query for query in context.captured_queries if query['sql'].startswith('INSERT INTO "app_productimage"')]
+        self.assertEqual(len(inserts), 1)
+        # файлы приняты во временные файлы, а не в память
+        self.assertTrue(all(isinstance(uploaded, TemporaryUploadedFile) for uploaded in store_uploads.call_args[0][0]))
+
+        names = list(self.product.images.order_by('id').values_list('image', flat=True))
+        self.assertEqual(len(names), 3)
+        with default_storage.open(names[0]) as stored:
+            image = Image.open(stored)
+            self.assertEqual(image.size, (200, 400))
+            self.assertFalse(image.getexif())
+        images.discard(names)
+
+    def test_truncated_image_rejected(self):
+        content = self.make_file(size=(800, 600)).read()
+        truncated = SimpleUploadedFile('broken.jpg', content[:len(content) // 2], content_type='image/jpeg')
+        stored_before = self.stored_files()
+        response = self.upload(self.make_file('1.jpg'), truncated)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('broken.jpg', response.data['images'][0])
+        self.assertFalse(self.product.images.exists())
+        # уже сохранённый исправный файл удалён
+        self.assertEqual(self.stored_files(), stored_before)
+
+
+class ProductBulkCreateTests(QueryBudgetMixin, TestCase):
+    client_class = APIClient
+
+    def setUp(self):
+        self.city = City.objects.create(name='Екатеринбург')
+        self.category = Category.objects.create(name='Инструменты')
+        self.client.force_authenticate(User.objects.create(username='seller', phone='1'))
+
+    def item(self, i, **overrides):
+        return {
+            'name': f'Дрель {i}', 'description': 'Ударная', 'price': 100 + i, 'price_suffix': 'N',
+            'is_lower_bound': False, 'category': self.category.id, 'city': self.city.id,
+            'features': [{'name': 'Мощность', 'value': f'{i}00 Вт'}], **overrides,
+        }
+
+    def test_query_count_does_not_depend_on_batch_size(self):
+        for size in (1, 30):
+            with self.assertQueryBudget(10):
+                response = self.client.post('/product/bulk', [self.item(i) for i in range(size)], format='json')
+            self.assertEqual(response.status_code, 201)
+        self.assertEqual(Product.objects.count(), 31)
+        self.assertEqual(ProductFeature.objects.count(), 31)
+        self.assertEqual(search.backend.filter(Product.objects.all(), '900 вт').count(), 1)
+
+    def test_atomic_batch_rejects_everything_on_error(self):
+        response = self.client.post('/product/bulk', [self.item(1), self.item(2, city=999)], format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('city', response.json()['errors']['1'])
+        self.assertFalse(Product.objects.exists())
+
+    def test_non_atomic_batch_creates_valid_items(self):
+        items = [self.item(1), self.item(2, price='дорого'), self.item(3)]
+        response = self.client.post('/product/bulk?atomic=0', items, format='json')
+        self.assertEqual(response.status_code, 207)
+        results = response.json()['results']
+        self.assertIn('price', results[1]['errors'])
+        self.assertEqual(
+            sorted(Product.objects.values_list('id', flat=True)), sorted([results[0]['id'], results[2]['id']]),
+        )
+        self.assertEqual(search.backend.filter(Product.objects.all(), 'дрель').count(), 2)
+
+
+class ProductFeatureUpdateTests(TestCase):
+    client_class = APIClient
+
+    def setUp(self):
+        author = User.objects.create(username='seller', phone='1')
+        self.product = Product.objects.create(
+            name='Дрель', description='', price=100, status=Product.Status.ACTIVE,
+            author=author, category=Category.objects.create(name='Инструменты'),
+        )
+        for name, value in (('Мощность', '500 Вт'), ('Вес', '2 кг'), ('Цвет', 'синий')):
+            ProductFeature.objects.create(product=self.product, name=name, value=value)
+        self.client.force_authenticate(author)
+
+    def features(self):
+        return dict(ProductFeature.objects.filter(product=self.product).values_list('name', 'id'))
+
+    def test_features_are_updated_as_diff(self):
+        before = self.features()
+        response = self.client.patch(f'/product/{self.product.id}/', {'features': [
+            {'name': 'Мощность', 'value': '500 Вт'},
+            {'name': 'Вес', 'value': '3 кг'},
+            {'name': 'Гарантия', 'value': '1 год'},
+        ]}, format='json')
+        self.assertEqual(response.status_code, 200)
+        after = self.features()
+        self.assertEqual(set(after), {'Мощность', 'Вес', 'Гарантия'})
+        self.assertEqual(after['Мощность'], before['Мощность'])
+        self.assertEqual(after['Вес'], before['Вес'])
+        self.assertEqual(ProductFeature.objects.get(id=after['Вес']).value, '3 кг')
+        self.assertEqual(
+            sorted(feature['name'] for feature in response.json()['features']), ['Вес', 'Гарантия', 'Мощность'],
+        )
+        self.assertEqual(search.backend.filter(Product.objects.all(), 'синий').count(), 0)
+        self.assertEqual(search.backend.filter(Product.objects.all(), '1 год').count(), 1)
+
+    def test_patch_without_features_keeps_them(self):
+        before = self.features()
+        self.client.patch(f'/product/{self.product.id}/', {'price': 200}, format='json')
+        self.assertEqual(self.features(), before)
+
+    def test_concurrent_edit_of_other_fields_is_kept(self):
+        get_object = views.ProductDetail.get_object
+
+        def get_object_then_concurrent_edit(view):
+            instance = get_object(view)
+            Product.objects.filter(pk=self.product.pk).update(description='Ударная', status=Product.Status.ARCHIVED)
+            return instance
+
+        with mock.patch.object(views.ProductDetail, 'get_object', get_object_then_concurrent_edit):
+            for method in (self.client.patch, self.client.put):
+                response = method(f'/product/{self.product.id}/', {'price': 200}, format='json')
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response.json()['description'], 'Ударная')
+        product = Product.objects.get(pk=self.product.pk)
+        self.assertEqual((product.price, product.description, product.status), (200, 'Ударная', Product.Status.ARCHIVED))
+        self.assertEqual(len(self.features()), 3)
+
+    def test_empty_features_clear_them(self):
+        response = self.client.patch(f'/product/{self.product.id}/', {'features': []}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.features(), {})
+        self.assertEqual(search.backend.filter(Product.objects.all(), 'синий').count(), 0)
+
+
+class ProductFavoriteTests(QueryBudgetMixin, TestCase):
+    client_class = APIClient
+
+    def setUp(self):
+        author = User.objects.create(username='seller', phone='1')
+        category = Category.objects.create(name='Инструменты')
+        self.products = [
+            Product.objects.create(name='Дрель', description='', price=100, author=author, category=category)
+            for _ in range(3)
+        ]
+        self.user = User.objects.create(username='buyer', phone='2')
+        self.client.force_authenticate(self.user)
+
+    def favorite_ids(self):
+        return set(ProductFavorite.objects.filter(user=self.user).values_list('product_id', flat=True))
+
+    def test_toggle_without_read_before_write(self):
+        url = f'/product/{self.products[0].id}/favorite/'
+        # SAVEPOINT, DELETE (+ INSERT, если удалять было нечего), два UPDATE счётчиков, RELEASE
+        with self.assertQueryBudget(6):
+            self.assertIs(self.client.post(url).json(), True)
+        self.assertEqual(User.objects.get(pk=self.user.pk).favorites_count, 1)
+        self.assertEqual(Product.objects.get(pk=self.products[0].pk).subscribers_count, 1)
+        with self.assertQueryBudget(5):
+            self.assertIs(self.client.post(url).json(), False)
+        self.assertEqual(self.favorite_ids(), set())
+        self.assertEqual(User.objects.get(pk=self.user.pk).favorites_count, 0)
+        self.assertEqual(self.client.post('/product/999/favorite/').status_code, 404)
+
+    def test_add_is_idempotent(self):
+        ProductFavorite.objects.add(self.user.id, [self.products[0].id])
+        self.assertEqual(ProductFavorite.objects.add(self.user.id, [self.products[0].id]), [])
+        self.assertEqual(ProductFavorite.objects.count(), 1)
+
+    def test_sync(self):
+        first, second, third = (product.id for product in self.products)
+        ProductFavorite.objects.add(self.user.id, [first, second])
+        response = self.client.post(
+            '/api/user/favorites/sync', {'add': [second, third, 999], 'remove': [first]}, format='json',
+        )
+        self.assertEqual(response.json(), {'added': [third], 'removed': [first], 'favorites': [second, third]})
+        self.assertEqual(self.favorite_ids(), {second, third})
+        response = self.client.post('/api/user/favorites/sync', {'add': [first], 'remove': [first]}, format='json')
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post('/api/user/favorites/sync', [first], format='json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_counters_follow_cascade_delete(self):
+        ProductFavorite.objects.add(self.user.id, [product.id for product in self.products])
+        self.products[0].delete()
+        self.assertEqual(User.objects.get(pk=self.user.pk).favorites_count, 2)
+        self.user.delete()
+        self.assertEqual(set(Product.objects.values_list('subscribers_count', flat=True)), {0})
+
+    def test_cascade_delete_does_not_load_favorites(self):
+        users = User.objects.bulk_create(User(username=f'buyer{i}', phone=f'buyer{i}') for i in range(20))
+        for user in users:
+            ProductFavorite.objects.add(user.id, [self.products[0].id, self.products[1].id])
+        with CaptureQueriesContext(connection) as context:
+            self.products[0].delete()
+        # избранное удаляется одним DELETE, счётчики — одним UPDATE, независимо от числа подписчиков
+        favorite_queries = [query['sql'] for query in context.captured_queries if '"app_productfavorite"' in query['sql']]
+        self.assertEqual(len(favorite_queries), 2)
+        counters = User.objects.filter(pk__in=[user.pk for user in users]).values_list('favorites_count', flat=True)
+        self.assertEqual(set(counters), {1})
+
+    def test_orm_delete_updates_counters(self):
+        ProductFavorite.objects.add(self.user.id, [product.id for product in self.products])
+        ProductFavorite.objects.get(product=self.products[0]).delete()
+        ProductFavorite.objects.filter(product__in=self.products[1:]).delete()
+        self.assertEqual(User.objects.get(pk=self.user.pk).favorites_count, 0)
+        self.assertEqual(set(Product.objects.values_list('subscribers_count', flat=True)), {0})
+
+    def test_favorites_page(self):
+        ProductFavorite.objects.add(self.user.id, [self.products[1].id])
+        ProductFavorite.objects.add(self.user.id, [self.products[0].id, self.products[2].id])
+        first = self.client.get('/api/user/favorites/', {'page_size': 2}).json()
+        second = self.client.get(first['next']).json()
+        ids = [item['id'] for item in first['results'] + second['results']]
+        self.assertEqual(ids, [self.products[2].id, self.products[0].id, self.products[1].id])
+        self.assertTrue(all(item['is_favorite'] for item in first['results']))
+
+
+class CachedJWTAuthenticationTests(QueryBudgetMixin, TestCase):
+    client_class = APIClient
+
+    def setUp(self):
+        authentication.get_user_cache().clear()
+        self.user = User.objects.create(username='buyer', phone='2')
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(self.user).access_token}')
+
+    def test_cached_user_needs_no_queries(self):
+        with self.assertQueryBudget(2):
+            self.assertEqual(self.client.get('/api/user/').status_code, 200)
+        # остаётся только запрос профиля в самом представлении
+        with self.assertQueryBudget(1):
+            self.assertEqual(self.client.get('/api/user/').status_code, 200)
+
+    def test_password_change_and_deactivation_invalidate_cache(self):
+        self.client.get('/api/user/')
+        self.user.set_password('new password')
+        self.user.save()
+        with self.assertQueryBudget(2):
+            self.client.get('/api/user/')
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.client.get('/api/user/').status_code, 401)
+
+    def test_login_does_not_invalidate_cache(self):
+        self.client.get('/api/user/')
+        update_last_login(None, self.user)
+        with self.assertQueryBudget(1):
+            self.client.get('/api/user/')
+
+    def test_deactivation_seen_by_other_workers(self):
+        self.client.get('/api/user/')
+        # локальный кэш воркера не хранит версию: запись по-прежнему подходит
+        cache.clear()
+        with self.assertQueryBudget(1):
+            self.client.get('/api/user/')
+        self.user.is_active = False
+        self.user.save()
+        cache.clear()
+        self.assertEqual(self.client.get('/api/user/').status_code, 401)
+
+    def test_entries_expire(self):
+        user_cache = authentication.UserCache(size=10, timeout=-1)
+        user_cache.set(self.user.id, 1, self.user)
+        self.assertIsNone(user_cache.get(self.user.id, 1))
+
+
+class TokenCompactionTests(TestCase):
+
+    def test_compact_removes_only_expired_tokens_in_batches(self):
+        user = User.objects.create(username='buyer', phone='2')
+        now = timezone.now()
+        for i in range(5):
+            expires_at = now + timedelta(days=-1 if i < 3 else 1)
+            token = OutstandingToken.objects.create(user=user, jti=f'jti{i}', token='', expires_at=expires_at)
+            if i % 2 == 0:
+                BlacklistedToken.objects.create(token=token)
+
+        reclaimed = tokens.compact(batch_size=2)
+        self.assertEqual(reclaimed, {'outstanding': 3, 'blacklisted': 2, 'batches': 2})
+        self.assertEqual(sorted(OutstandingToken.objects.values_list('jti', flat=True)), ['jti3', 'jti4'])
+        self.assertEqual(BlacklistedToken.objects.get().token.jti, 'jti4')
+
+    def test_single_runner_elected_by_lock_file(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = os.path.join(directory.name, 'compaction.lock')
+        self.addCleanup(setattr, tokens, '_lock_file', None)
+        with override_settings(TOKEN_COMPACTION_LOCK_FILE=path), open(path, 'a') as other_worker:
+            fcntl.flock(other_worker, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            self.assertFalse(tokens.acquire_runner_lock())
+            fcntl.flock(other_worker, fcntl.LOCK_UN)
+            self.assertTrue(tokens.acquire_runner_lock())
+            self.assertTrue(tokens.acquire_runner_lock())
+        tokens._lock_file.close()
+
+
+class AsyncReadViewTests(TestCase):
+    """Асинхронные представления (ASYNC_READ_VIEWS) отдают то же, что синхронные."""
+    client_class = APIClient
+
+    def setUp(self):
+        self.addCleanup(self.use_read_views, settings.ASYNC_READ_VIEWS)
+        author = User.objects.create(username='seller', phone='1', email='seller@example.com')
+        self.user = User.objects.create(username='buyer', phone='2')
+        root = Category.objects.create(name='Инструменты')
+        child = Category.objects.create(name='Дрели', parent=root)
+        city = City.objects.create(name='Екатеринбург')
+        for i, category in enumerate((root, child, child)):
+            product = Product.objects.create(
+                name=f'Дрель {i}', description='Ударная', price=100 * (i + 1), status=Product.Status.ACTIVE,
+                author=author, category=category, city=city if i else None,
+            )
+            ProductImage.objects.create(product=product)
+            ProductFeature.objects.create(product=product, name='Мощность', value=f'{i}00 Вт')
+        self.product = product
+        ProductFavorite.objects.create(product=product, user=self.user)
+        self.urls = [
+            ('/city', {}),
+            ('/category', {}),
+            ('/category/tree', {}),
+            ('/category/tree', {'category': root.id}),
+            ('/category/tree', {'category': 'x'}),
+            ('/product', {'status': 'AC'}),
+            ('/product', {'city': city.id, 'status': 'AC', 'page_size': 1}),
+            ('/search/', {'name': 'дрели', 'category': root.id}),
+            ('/search/', {'ordering': 'price', 'page_size': 2}),
+            (f'/product/{product.id}/', {}),
+            ('/product/0/', {}),
+        ]
+
+    def use_read_views(self, async_views):
+        # представления выбираются в app/urls.py при импорте; корневой urlconf держит
+        # резолвер с уже разобранными маршрутами app.urls, поэтому перезагружается и он
+        with override_settings(ASYNC_READ_VIEWS=async_views):
+            importlib.reload(app_urls)
+        importlib.reload(importlib.import_module(settings.ROOT_URLCONF))
+        clear_url_caches()
+
+    def get_responses(self, async_views):
+        self.use_read_views(async_views)
+        self.assertEqual(
+            resolve('/city').func is async_views_module.city_list, async_views,
+        )
+        responses = []
+        for url, params in self.urls:
+            # общий кэш ленты и фасетов не должен подменять ответ другого варианта
+            cache.clear()
+            response = self.client.get(url, params)
+            # Vary: Accept ставит только DRF: асинхронные представления всегда отдают JSON
+            headers = {name: response.get(name) for name in ('ETag', 'Last-Modified', 'Cache-Control')}
+            responses.append((url, response.status_code, response.json(), headers))
+        return responses
+
+    def test_anonymous_responses_match(self):
+        self.assertEqual(self.get_responses(True), self.get_responses(False))
+
+    def test_authenticated_responses_match(self):
+        self.client.force_authenticate(self.user)
+        self.urls.append(('/product', {'own': 1, 'status': 'AC'}))
+        self.assertEqual(self.get_responses(True), self.get_responses(False))
+
+    def test_conditional_requests(self):
+        self.use_read_views(True)
+        for url in ('/city', f'/product/{self.product.id}/'):
+            etag = self.client.get(url)['ETag']
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+
+class CatalogSeederTests(TestCase):
+
+    def test_seeded_catalog_is_consistent_and_deterministic(self):
+        seeder = seeding.CatalogSeeder(60, seed=7, cities=3, category_fanout=(2, 2), users=10, batch_size=25)
+        product_ids = seeder.run()
+        self.assertEqual(Product.objects.count(), 60)
+        self.assertEqual(ProductImage.objects.count(), 180)
+        self.assertEqual(ProductFeature.objects.count(), 240)
+
+        leaf = Category.objects.filter(parent__isnull=False).first()
+        self.assertEqual(len(Category.get_descendant_ids(leaf.parent_id)), 3)
+        self.assertFalse(Product.objects.filter(id__in=product_ids, category__children__isnull=False).exists())
+
+        favorites = dict(ProductFavorite.objects.values_list('user_id').annotate(count=Count('id')))
+        self.assertTrue(favorites)
+        self.assertEqual(dict(User.objects.filter(favorites_count__gt=0).values_list('id', 'favorites_count')), favorites)
+        product = Product.objects.order_by('-subscribers_count').first()
+        self.assertEqual(product.subscribers_count, ProductFavorite.objects.filter(product=product).count())
+        self.assertEqual(search.backend.filter(Product.objects.filter(pk=product.pk), product.name).count(), 1)
+        self.assertEqual(Product.objects.order_by('-created_at', '-id').first().images.count(), 3)
+
+    def test_seeding_touches_only_new_rows(self):
+        existing = Category.objects.create(name='Инструменты')
+        existing_links = set(CategoryClosure.objects.values_list('ancestor_id', 'descendant_id', 'depth'))
+        seeder = seeding.CatalogSeeder(30, cities=2, category_fanout=(2, 3), users=10, batch_size=10)
+        # ни полной перестройки индекса и замыкания, ни UPDATE по всей таблице
+        with mock.patch.object(search.backend, 'rebuild', side_effect=AssertionError), \
+                mock.patch.object(CategoryClosure, 'rebuild', side_effect=AssertionError):
+            product_ids = seeder.run()
+        links = set(CategoryClosure.objects.values_list('ancestor_id', 'descendant_id', 'depth'))
+        self.assertTrue(existing_links <= links)
+        # два корня и шесть листьев: у корня — ссылка на себя, у листа — ещё и на родителя
+        self.assertEqual(len(links - existing_links), 2 + 6 * 2)
+        name = Product.objects.get(pk=product_ids[-1]).name
+        self.assertIn(product_ids[-1], search.backend.filter(Product.objects.all(), name).values_list('id', flat=True))
+
+    def test_seed_catalog_is_deterministic(self):
+        options = {'products': 30, 'users': 10, 'cities': 3, 'category_fanout': [2, 2], 'stdout': StringIO()}
+        call_command('seed_catalog', prefix='first', **options)
+        call_command('seed_catalog', prefix='second', **options)
+        products = list(
+            Product.objects.order_by('id', 'features__id').values_list('name', 'price', 'status', 'features__value')
+        )
+        self.assertEqual(products[:len(products) // 2], products[len(products) // 2:])
+        with self.assertRaises(CommandError):
+            call_command('seed_catalog', prefix='first', **options)
+
+
+class QueryStatsMiddlewareTests(TestCase):
+    client_class = APIClient
+
+    def setUp(self):
+        self.user = User.objects.create(username='seller', phone='1')
+        category = Category.objects.create(name='Инструменты')
+        for i in range(3):
+            Product.objects.create(
+                name=f'Дрель {i}', description='', price=100, status=Product.Status.ACTIVE,
+                author=self.user, category=category,
+            )
+        self.client.force_authenticate(self.user)
+
+    def test_server_timing_counts_request_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/user/favorites/')
+        self.assertEqual(response.status_code, 200)
+        self.assertRegex(
+            response['Server-Timing'],
+            rf'^db;dur=[\d.]+;desc="{len(queries.captured_queries)} queries, 0 duplicates", total;dur=[\d.]+$',
+        )
+
+    async def test_async_requests_count_queries_run_in_sync_to_async_threads(self):
+        response = await self.async_client.get('/product', {'status': 'AC'})
+        self.assertEqual(response.status_code, 200)
+        self.assertRegex(response.headers['Server-Timing'], r'desc="[1-9]\d* queries')
+
+    @override_settings(SQL_SLOW_QUERY_MS=0, SQL_SLOW_REQUEST_QUERIES=1)
+    def test_slow_log_has_normalized_sql_and_view(self):
+        with self.assertLogs('app.sql.slow', 'WARNING') as logs:
+            for product_id in Product.objects.values_list('id', flat=True):
+                self.client.post(f'/product/{product_id}/favorite/')
+            response = self.client.post('/api/user/favorites/sync', {'add': [1, 2]}, format='json')
+        self.assertEqual(response.status_code, 200)
+        messages = '\n'.join(logs.output)
+        self.assertIn('view=app.views.sync_favorites', messages)
+        self.assertIn('WHERE id IN (...)', messages)
+        self.assertIn('slow request method=POST path=/api/user/favorites/sync', messages)
+
+    def test_repeated_statements_are_counted_as_duplicates(self):
+        stats = query_stats.QueryStats(slow_query_seconds=60)
+        with stats.collect():
+            # N+1: автор каждого товара отдельным запросом
+            authors = [product.author.username for product in Product.objects.order_by('id')]
+        self.assertEqual(authors, ['seller'] * 3)
+        self.assertEqual((stats.count, stats.duplicates), (4, 2))
+        sql, repeats = stats.most_repeated()
+        self.assertEqual(repeats, 3)
+        self.assertIn('FROM "app_user"', sql)
+        self.assertFalse(stats.slow)
+
+    def test_normalize_sql(self):
+        self.assertEqual(
+            query_stats.normalize_sql(
+                "SELECT  *\n FROM app_product_fts WHERE name = 'дрель' AND id IN (%s, %s, %s) LIMIT 21"
+            ),
+            'SELECT * FROM app_product_fts WHERE name = ? AND id IN (...) LIMIT ?',
+        )
+
+    def test_counters_updated_from_several_threads(self):
+        stats = query_stats.QueryStats(slow_query_seconds=0)
+        context = {'connection': connection}
+
+        def run():
+            for i in range(1000):
+                stats(lambda *args: None, f'SELECT {i % 10}', None, False, context)
+
+        threads = [threading.Thread(target=run) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(stats.count, 8000)
+        self.assertEqual(sum(stats.statements.values()), 8000)
+        self.assertEqual(len(stats.slow), 8000)
+        self.assertEqual(stats.duplicates, 7990)
+
+
+class ReplicaRouterTests(TestCase):
+
+    def setUp(self):
+        self.writer = User.objects.create(username='seller', phone='1')
+        self.reader = User.objects.create(username='buyer', phone='2')
+        # метки от запросов предыдущих тестов с теми же id пользователей
+        versions.get_cache().delete_many([routers.STICKY_KEY.format(user.pk) for user in (self.writer, self.reader)])
+
+    def route(self, user, method='get', write=False):
+        def view(request):
+            routers.use_replica(request)
+            before = router.db_for_read(Product)
+            if write:
+                router.db_for_write(Product)
+            return before, router.db_for_read(Product)
+
+        request = getattr(RequestFactory(), method)('/')
+        request.user = user
+        return routers.replica_routing_middleware(view)(request)
+
+    @override_settings(DATABASE_REPLICAS=['replica0'])
+    def test_reads_stick_to_primary_after_write(self):
+        self.assertEqual(self.route(self.reader), ('replica0', 'replica0'))
+        self.assertEqual(self.route(self.writer, write=True), ('replica0', 'default'))
+        # следующий запрос пришёл в другой воркер: его локальный кэш пуст
+        cache.clear()
+        self.assertEqual(self.route(self.writer), ('default', 'default'))
+        self.assertEqual(self.route(self.reader), ('replica0', 'replica0'))
+        self.assertEqual(self.route(self.reader, method='post'), ('default', 'default'))
+
+    def test_without_replicas_everything_uses_primary(self):
+        self.assertEqual(self.route(self.reader), ('default', 'default'))
+
+
+class SqliteBackendTests(TestCase):
+    """Новое соединение с файловой базой (тестовая база — в памяти, WAL к ней неприменим)."""
+    alias = 'sqlite_backend_test'
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'db.sqlite3')
+        connections.settings[self.alias] = {**connection.settings_dict, 'NAME': self.path}
+        self.addCleanup(connections.settings.pop, self.alias)
+        self.addCleanup(connections.__delitem__, self.alias)
+        self.addCleanup(lambda: connections[self.alias].close())
+        self.connection = connections[self.alias]
+
+    def pragma(self, name):
+        with self.connection.cursor() as cursor:
+            cursor.execute(f'PRAGMA {name}')
+            return cursor.fetchone()[0]
+
+    def test_pragmas_applied_to_new_connection(self):
+        self.assertEqual(self.pragma('journal_mode'), 'wal')
+        self.assertEqual(self.pragma('synchronous'), 1)  # NORMAL
+        self.assertEqual(self.pragma('busy_timeout'), 5000)
+        self.assertEqual(self.pragma('cache_size'), -64000)
+        self.assertEqual(self.pragma('temp_store'), 2)  # MEMORY
+        self.assertEqual(self.pragma('mmap_size'), 256 * 1024 * 1024)
+
+    def test_transactions_begin_immediate(self):
+        with CaptureQueriesContext(self.connection) as context, transaction.atomic(using=self.alias):
+            # блокировка записи взята уже в BEGIN, до первой записи
+            with closing(sqlite3.connect(self.path, timeout=0)) as other:
+                with self.assertRaisesMessage(sqlite3.OperationalError, 'database is locked'):
+                    other.execute('BEGIN IMMEDIATE')
+        self.assertEqual(context.captured_queries[0]['sql'], 'BEGIN IMMEDIATE')
+
+
+class FileReplicaTests(TransactionTestCase):
+    """Реплика — файловая копия тестовой базы, подключённая под отдельным псевдонимом."""
+    client_class = APIClient
+    alias = 'replica_test'
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(username='buyer', phone='2')
+        self.product = Product.objects.create(
+            name='Дрель', description='', price=100, status=Product.Status.ACTIVE,
+            author=User.objects.create(username='seller', phone='1'),
+            category=Category.objects.create(name='Инструменты'),
+        )
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = os.path.join(directory.name, 'replica.sqlite3')
+        connection.ensure_connection()
+        with closing(sqlite3.connect(path)) as replica:
+            connection.connection.backup(replica)
+
+        connections.settings[self.alias] = {**connection.settings_dict, 'NAME': path}
+        self.addCleanup(connections.settings.pop, self.alias)
+        self.addCleanup(connections.__delitem__, self.alias)
+        self.addCleanup(lambda: connections[self.alias].close())
+        replicas = override_settings(DATABASE_REPLICAS=[self.alias])
+        replicas.enable()
+        self.addCleanup(replicas.disable)
+
+    def get_names(self, url='/search/'):
+        return [item['name'] for item in self.client.get(url, {'status': 'AC', 'ordering': 'new'}).json()['results']]
+
+    def add_product(self):
+        # реплика отстаёт: новый товар виден только в основной базе
+        Product.objects.create(
+            name='Перфоратор', description='', price=200, status=Product.Status.ACTIVE,
+            author=self.product.author, category=self.product.category,
+        )
+
+    def test_search_reads_replica_and_writer_reads_primary(self):
+        # дерево категорий для фасетов строится по основной базе
+        category_tree.get_tree()
+        with CaptureQueriesContext(connections[self.alias]) as replica_queries, \
+                CaptureQueriesContext(connection) as primary_queries:
+            self.assertEqual(self.get_names(), ['Дрель'])
+        self.assertTrue(replica_queries.captured_queries)
+        self.assertFalse(primary_queries.captured_queries)
+
+        self.add_product()
+        self.assertEqual(self.get_names(), ['Дрель'])
+
+        # после записи пользователь читает из основной базы
+        self.client.force_authenticate(self.user)
+        self.assertIs(self.client.post(f'/product/{self.product.id}/favorite/').json(), True)
+        self.assertEqual(self.get_names(), ['Перфоратор', 'Дрель'])
+
+    def test_versioned_caches_built_from_primary(self):
+        self.assertEqual(self.get_names('/product'), ['Дрель'])
+        self.add_product()
+        # новое поколение ленты не должно закрепить данные отстающей реплики
+        self.assertEqual(self.get_names('/product'), ['Перфоратор', 'Дрель'])
+
+        tree_response = self.client.get('/category/tree')
+        Category.objects.create(name='Материалы')
+        with CaptureQueriesContext(connections[self.alias]) as replica_queries:
+            response = self.client.get('/category/tree', HTTP_IF_NONE_MATCH=tree_response['ETag'])
+        self.assertFalse(replica_queries.captured_queries)
+        self.assertEqual([node['title'] for node in response.json()], ['Инструменты', 'Материалы'])
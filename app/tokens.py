@@ -0,0 +1,110 @@
+"""
+Сжатие таблиц чёрного списка JWT.
+
+При ROTATE_REFRESH_TOKENS и BLACKLIST_AFTER_ROTATION каждое обновление токена
+добавляет строки в token_blacklist_outstandingtoken и blacklistedtoken. Строки с
+истёкшим expires_at больше ни на что не влияют: такой токен отклоняется по exp
+ещё до проверки чёрного списка. compact() удаляет их пачками по batch_size, каждая
+пачка — в своей короткой транзакции, чтобы не держать блокировку записи SQLite.
+
+Запускается командой compact_tokens (по cron) или фоновым потоком раз в
+TOKEN_COMPACTION_INTERVAL секунд (см. start_periodic(); по умолчанию выключен).
+Поток заводится в каждом воркере, но сжатие выполняет только тот, кто захватил
+блокировку файла TOKEN_COMPACTION_LOCK_FILE; он держит её до завершения процесса,
+после чего её захватит другой воркер.
+"""
+import fcntl
+import logging
+import os
+import threading
+import time
+
+from django.conf import settings
+from django.db import close_old_connections, connections, router, transaction
+from django.utils import timezone
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+
+logger = logging.getLogger(__name__)
+
+_thread = None
+_thread_lock = threading.Lock()
+_lock_file = None
+
+
+def _delete(cursor, model, column, ids):
+    placeholders = ', '.join(['%s'] * len(ids))
+    cursor.execute(f'DELETE FROM {model._meta.db_table} WHERE {column} IN ({placeholders})', ids)
+    return cursor.rowcount
+
+
+def compact(batch_size=None, max_batches=None, now=None):
+    """Удаляет просроченные токены; возвращает число удалённых строк по таблицам."""
+    batch_size = batch_size or getattr(settings, 'TOKEN_COMPACTION_BATCH_SIZE', 1000)
+    now = now or timezone.now()
+    reclaimed = {'outstanding': 0, 'blacklisted': 0, 'batches': 0}
+    using = router.db_for_write(OutstandingToken)
+    while max_batches is None or reclaimed['batches'] < max_batches:
+        with transaction.atomic(using=using):
+            # выбирается по индексу token_outstanding_expires_at (миграция 0016)
+            ids = list(
+                OutstandingToken.objects.using(using).filter(expires_at__lte=now)
+                .order_by('expires_at').values_list('id', flat=True)[:batch_size]
+            )
+            if not ids:
+                break
+            # без Collector: он загрузил бы каждую строку ради каскада
+            with connections[using].cursor() as cursor:
+                reclaimed['blacklisted'] += _delete(cursor, BlacklistedToken, 'token_id', ids)
+                reclaimed['outstanding'] += _delete(cursor, OutstandingToken, 'id', ids)
+        reclaimed['batches'] += 1
+        if len(ids) < batch_size:
+            break
+    return reclaimed
+
+
+def acquire_runner_lock():
+    """Неблокирующий захват TOKEN_COMPACTION_LOCK_FILE; захватившего процесса он больше не отпускает."""
+    global _lock_file
+    if _lock_file is not None:
+        return True
+    path = getattr(settings, 'TOKEN_COMPACTION_LOCK_FILE', None) or \
+        os.path.join(settings.BASE_DIR, '.cache', 'token_compaction.lock')
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    lock_file = open(path, 'a')
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock_file.close()
+        return False
+    _lock_file = lock_file
+    return True
+
+
+def _run_periodic(interval):
+    while True:
+        time.sleep(interval)
+        try:
+            if acquire_runner_lock():
+                reclaimed = compact()
+                logger.info(
+                    'Сжатие токенов: outstanding=%(outstanding)s blacklisted=%(blacklisted)s '
+                    'batches=%(batches)s', reclaimed,
+                )
+        except Exception:
+            logger.exception('Не удалось сжать таблицы токенов')
+        finally:
+            close_old_connections()
+
+
+def start_periodic(interval=None):
+    """Запускает фоновый поток сжатия (один на процесс)."""
+    global _thread
+    interval = interval or getattr(settings, 'TOKEN_COMPACTION_INTERVAL', 0)
+    if not interval:
+        return
+    with _thread_lock:
+        if _thread is None:
+            _thread = threading.Thread(
+                target=_run_periodic, args=(interval,), name='token-compaction', daemon=True,
+            )
+            _thread.start()
@@ -0,0 +1,77 @@
+"""
+Счётчики изменений моделей.
+
+Для каждой модели в кэше (MODEL_VERSION_CACHE, по умолчанию ``default``) хранится
+токен — время последнего изменения в наносекундах. Этот кэш должен быть общим
+для всех процессов (в backend/settings.py — ``shared``): иначе изменение,
+сделанное одним воркером, остальные не заметят, а лениво созданные токены у
+разных процессов будут разными. Сигналы post_save/post_delete
+обновляют его, так что по токену можно дёшево проверить, менялись ли данные,
+не обращаясь к базе. Если ключ вытеснен из кэша, создаётся новый токен — это
+лишь приводит к лишнему пересчёту, но не к устаревшим данным.
+"""
+import time
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.core.cache import caches
+
+KEY = 'model_version:{}'
+
+
+def get_cache():
+    return caches[getattr(settings, 'MODEL_VERSION_CACHE', 'default')]
+
+
+def _key(model):
+    return KEY.format(model._meta.label_lower)
+
+
+def model_keys(*models):
+    return [_key(model) for model in models]
+
+
+def get_tokens(*models):
+    return get_named_tokens(*model_keys(*models))
+
+
+def get_named_tokens(*keys):
+    """Токены произвольных счётчиков (например, поколение ленты города)."""
+    cache = get_cache()
+    tokens = cache.get_many(keys)
+    for key in keys:
+        if key not in tokens:
+            cache.add(key, time.time_ns(), timeout=None)
+            tokens[key] = cache.get(key)
+    return [tokens[key] for key in keys]
+
+
+def get_version(*models):
+    return get_named_version(*model_keys(*models))
+
+
+def get_named_version(*keys):
+    return '-'.join(str(token) for token in get_named_tokens(*keys))
+
+
+def get_last_modified(*models):
+    return get_named_last_modified(*model_keys(*models))
+
+
+def get_named_last_modified(*keys):
+    return to_datetime(max(get_named_tokens(*keys)))
+
+
+def to_datetime(token):
+    return datetime.fromtimestamp(token / 1e9, tz=timezone.utc)
+
+
+def bump(sender, **kwargs):
+    bump_named(_key(sender))
+
+
+def bump_named(*keys):
+    # токен не должен уменьшаться даже при расхождении часов между воркерами
+    cache = get_cache()
+    current = cache.get_many(keys)
+    cache.set_many({key: max(time.time_ns(), current.get(key, 0) + 1) for key in keys}, timeout=None)
@@ -2,107 +2,134 @@
 from rest_framework import generics, status
 from rest_framework.decorators import api_view, parser_classes, permission_classes
 from rest_framework.permissions import AllowAny
-from django.db.models import Max, Min
 from rest_framework.permissions import IsAuthenticated, IsAuthenticatedOrReadOnly
 from rest_framework.response import Response
 from rest_framework.views import APIView
-from rest_framework_simplejwt.authentication import JWTAuthentication
 from rest_framework import generics
 from rest_framework.parsers import FileUploadParser, MultiPartParser
+from django.conf import settings
+from django.db import transaction
+from django.db.models import BooleanField, F, Value
 from django.core.exceptions import PermissionDenied
 from rest_framework.permissions import BasePermission
 
 
-from .models import Category, Product, User, City, ProductImage, ProductFavorite
-from .serializers import CategoryHierarchySerializer, CategorySerializer, ProductSerializer, UserCreateSerializer, \
-    UserSerializer, CitySerializer, ProductCreateSerializer, ProductImageSerializer, UserUpdateSerializer
+from . import cards, category_tree, facets, feed, images, routers, search
+from .authentication import CachedJWTAuthentication
+from .conditional import ConditionalRetrieveMixin, reference_data
+from .pagination import KeysetPagination
+from .models import Category, CategoryImage, Product, User, City, ProductImage, ProductFavorite
+from .serializers import CategorySerializer, ProductSerializer, UserCreateSerializer, \
+    UserSerializer, CitySerializer, ProductCreateSerializer, ProductImageSerializer, UserUpdateSerializer, \
+    ProductBulkCreateSerializer
 
 
+@reference_data(Category, CategoryImage)
 @api_view(['GET'])
 def get_category_tree(request):
     category_id = request.query_params.get('category')
     if category_id:
-        try:
-            category = Category.objects.get(id=category_id)
-            child_categories = category.get_descendants()
-            child_categories.append(category)
-            return Response(CategoryHierarchySerializer(child_categories, many=True).data)
-        except Category.DoesNotExist:
+        subtree = category_tree.get_subtree(int(category_id)) if category_id.isdigit() else None
+        if subtree is None:
             return Response({'error': 'Category not found'}, status=status.HTTP_404_NOT_FOUND)
+        return Response(subtree)
     else:
-        parent_categories = Category.objects.filter(parent_id=None)
-        return Response(CategoryHierarchySerializer(parent_categories, many=True).data)
+        return Response(category_tree.get_roots())
 
 
+@reference_data(Category, CategoryImage, keys=(images.DERIVATIVES_VERSION_KEY,))
 @api_view(['GET'])
 def get_category_list(request):
     parent_categories = Category.objects.filter(parent_id=None)
     return Response(CategorySerializer(parent_categories, many=True).data)
 
 
+@reference_data(City)
 @api_view(['GET'])
 def get_city_list(request):
     cities = City.objects.all()
     return Response(CitySerializer(cities, many=True).data)
 
 
-class ProductList(generics.ListCreateAPIView):
+class ProductList(routers.ReplicaReadMixin, generics.ListCreateAPIView):
     queryset = Product.objects.all()
     serializer_class = ProductCreateSerializer
     permission_classes = [IsAuthenticatedOrReadOnly]
-    authentication_classes = [JWTAuthentication]
+    authentication_classes = [CachedJWTAuthentication]
+    pagination_class = KeysetPagination
 
     def list(self, request, **kwargs):
         queryset = self.get_queryset()
         own = self.request.query_params.get('own', False)
 
+        # получаем значение параметра status из URL
+        status = request.query_params.get('status', 'ACTIVE')
+
         # проверяем наличие jwt токена
         if request.user.is_authenticated and own:
             # получаем пользователя из токена
             user = request.user
-            queryset = queryset.filter(author=user)
+            queryset = queryset.filter(author=user, status=status).with_favorite(user)
+            return Response(self.get_page_data(queryset))
+
+        # если пользователь не аутентифицирован, то фильтруем по x-city-id
+        city_id = None
+        if 'city' in self.request.query_params:
+            city_id = int(self.request.query_params['city'])
+            queryset = queryset.filter(city_id=city_id)
         else:
-            # если пользователь не аутентифицирован, то фильтруем по x-city-id
-            if 'city' in self.request.query_params:
-                queryset = queryset.filter(city_id=int(self.request.query_params['city']))
-            else:
-                # если x-city-id не передан, то выводим все продукты со статусом active
-                queryset = queryset.filter(status='AC')
+            # если x-city-id не передан, то выводим все продукты со статусом active
+            queryset = queryset.filter(status='AC')
 
-        # получаем значение параметра status из URL
-        status = request.query_params.get('status', 'ACTIVE')
+        # публичная лента одинакова для всех: кэшируем без избранного и накладываем его отдельно
+        queryset = queryset.filter(status=status).with_favorite(None)
+        data = feed.get_page(request, city_id, status, lambda: self.get_page_data(queryset))
+        return Response(feed.overlay_favorites(data, request.user))
 
-        # фильтруем по статусу
-        queryset = queryset.filter(status=status).order_by('-created_at')[:20]
-        serializer = ProductSerializer(queryset, many=True, context={'request': request})
-        return Response(serializer.data)
+    def get_page_data(self, queryset):
+        page = self.paginate_queryset(cards.card_queryset(queryset))
+        return self.get_paginated_response(cards.serialize_cards(page, {'request': self.request})).data
 
     def perform_create(self, serializer):
         author = self.request.user
         serializer.save(author=author)
 
 
-class ProductSearchView(generics.ListAPIView):
+class ProductSearchView(routers.ReplicaReadMixin, generics.ListAPIView):
     serializer_class = ProductSerializer
-
-    def get_queryset(self):
-        search_name = self.request.query_params.get('name')
-        search_city = self.request.query_params.get('city')
-        search_category = self.request.query_params.get('category')
-        min_price = self.request.query_params.get('minRange')
-        max_price = self.request.query_params.get('maxRange')
+    pagination_class = KeysetPagination
+
+    def get_keyset_ordering(self, queryset):
+        ordering = self.request.query_params.get('ordering')
+        if ordering == 'price':
+            return 'price', 'id'
+        if ordering == '-price':
+            return '-price', '-id'
+        if ordering != 'new' and 'search_rank' in queryset.query.annotations:
+            # по умолчанию поиск по названию сортируется по релевантности
+            return 'search_rank', 'id'
+        return '-created_at', '-id'
+
+    def get_filters(self):
+        params = self.request.query_params
+        return {key: params.get(key) for key in ('name', 'city', 'category', 'minRange', 'maxRange')}
+
+    def get_filtered_queryset(self):
+        filters = self.get_filters()
+        search_name = filters['name']
+        search_city = filters['city']
+        search_category = filters['category']
+        min_price = filters['minRange']
+        max_price = filters['maxRange']
 
         queryset = Product.objects.filter(status='AC')
 
         if search_category:
-            # Получаем все дочерние категории
-            category_ids = [int(search_category)]
-            category_ids += self.get_child_categories(int(search_category))
-
-            queryset = queryset.filter(category_id__in=category_ids)
+            # Категория и все её потомки — одним join'ом по таблице замыкания
+            queryset = queryset.filter(category__ancestor_links__ancestor_id=int(search_category))
 
         if search_name:
-            queryset = queryset.filter(name__icontains=search_name)
+            queryset = search.backend.filter(queryset, search_name)
 
         if search_city:
             queryset = queryset.filter(city_id=search_city)
@@ -110,24 +137,28 @@ class ProductSearchView(generics.ListAPIView):
         if min_price and max_price:
             queryset = queryset.filter(price__range=(min_price, max_price))
 
-        # Вычисляем минимальную и максимальную стоимость только для отфильтрованных продуктов
-        min_price_filtered = queryset.aggregate(Min('price'))['price__min']
-        max_price_filtered = queryset.aggregate(Max('price'))['price__max']
+        return queryset
 
+    def set_facets(self, facets_data):
+        self.facets = facets_data
         # Добавляем значения минимальной и максимальной стоимости в контекст для использования в сериализаторе
-        self.kwargs['min_price'] = min_price_filtered
-        self.kwargs['max_price'] = max_price_filtered
+        self.kwargs['min_price'] = facets_data['price']['min']
+        self.kwargs['max_price'] = facets_data['price']['max']
 
-        return queryset
+    def get_queryset(self):
+        queryset = self.get_filtered_queryset()
+
+        # Фасеты (в том числе минимальная и максимальная стоимость) только для отфильтрованных продуктов
+        self.set_facets(facets.get_facets(queryset, self.get_filters()))
+
+        return queryset.with_favorite(self.request.user)
 
-    def get_child_categories(self, category_id):
-        # Рекурсивная функция для получения всех дочерних категорий
-        category_ids = []
-        children = Category.objects.filter(parent_id=category_id)
-        for child in children:
-            category_ids.append(child.id)
-            category_ids += self.get_child_categories(child.id)
-        return category_ids
+    def list(self, request, *args, **kwargs):
+        # карточки собираются из values(), без моделей и полей ProductSerializer
+        page = self.paginate_queryset(cards.card_queryset(self.get_queryset()))
+        response = self.get_paginated_response(cards.serialize_cards(page, self.get_serializer_context()))
+        response.data['facets'] = self.facets
+        return response
 
     def get_serializer_context(self):
         context = super().get_serializer_context()
@@ -135,15 +166,6 @@ class ProductSearchView(generics.ListAPIView):
         context['max_price'] = self.kwargs.get('max_price')
         return context
 
-    def get_child_categories(self, category_id):
-        # Рекурсивная функция для получения всех дочерних категорий
-        category_ids = []
-        children = Category.objects.filter(parent_id=category_id)
-        for child in children:
-            category_ids.append(child.id)
-            category_ids += self.get_child_categories(child.id)
-        return category_ids
-
 
 class IsOwnerOrReadOnly(BasePermission):
     def has_object_permission(self, request, view, obj):
@@ -152,11 +174,14 @@ class IsOwnerOrReadOnly(BasePermission):
         return obj.author == request.user
 
 
-class ProductDetail(generics.RetrieveUpdateDestroyAPIView):
-    queryset = Product.objects.all()
+class ProductDetail(ConditionalRetrieveMixin, generics.RetrieveUpdateDestroyAPIView):
+    queryset = Product.objects.with_related()
     serializer_class = ProductSerializer
     permission_classes = [IsAuthenticatedOrReadOnly, IsOwnerOrReadOnly]
-    authentication_classes = [JWTAuthentication]
+    authentication_classes = [CachedJWTAuthentication]
+
+    def get_queryset(self):
+        return super().get_queryset().with_favorite(self.request.user)
 
     def retrieve(self, request, *args, **kwargs):
         instance = self.get_object()
@@ -195,15 +220,14 @@ class ProductDetail(generics.RetrieveUpdateDestroyAPIView):
         if instance.author != request.user:
             return Response("Вы не являетесь автором этого продукта")
 
-        status = request.data.get('status',
-                                  instance.status)
-        city_id = request.data.get('city_id', instance.city_id)
-
-        price_suffix = request.data.get('price_suffix', instance.price_suffix)
+        # непереданные поля не подставляются из instance: он мог устареть до блокировки в update()
+        fields = {key: request.data[key] for key in ('status', 'city_id', 'price_suffix') if key in request.data}
 
         serializer = self.get_serializer(instance, data=request.data, partial=True)
         serializer.is_valid(raise_exception=True)
-        serializer.save(status=status, city_id=city_id, price_suffix=price_suffix)
+        serializer.save(**fields)
+        # сбрасываем prefetch-кэш, иначе в ответ попадут характеристики до обновления
+        instance._prefetched_objects_cache = {}
         return Response(serializer.data)
 
     def patch(self, request, *args, **kwargs):
@@ -218,19 +242,59 @@ class ProductDetail(generics.RetrieveUpdateDestroyAPIView):
         serializer = self.get_serializer(instance, data=request.data, partial=True)
         serializer.is_valid(raise_exception=True)
         serializer.save()
+        instance._prefetched_objects_cache = {}
         return Response(serializer.data)
 
 
 
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def bulk_create_products(request):
+    """
+    Пакетное создание товаров: тело — список товаров в формате ProductCreateSerializer.
+    По умолчанию пачка атомарна: при любой ошибке ничего не создаётся. С ?atomic=0
+    создаются корректные товары, а ошибки возвращаются по индексам элементов (207).
+    """
+    items = request.data
+    if not isinstance(items, list) or not items:
+        return Response({'error': 'Expected a non-empty list of products'}, status=status.HTTP_400_BAD_REQUEST)
+    max_count = getattr(settings, 'PRODUCT_BULK_CREATE_MAX_COUNT', 500)
+    if len(items) > max_count:
+        return Response(
+            {'error': f'Too many products, maximum is {max_count}'}, status=status.HTTP_400_BAD_REQUEST,
+        )
+    atomic = request.query_params.get('atomic', '1') != '0'
+
+    context = ProductBulkCreateSerializer.get_context(items, {'request': request})
+    item_serializers = [ProductBulkCreateSerializer(data=item, context=context) for item in items]
+    errors = {index: item.errors for index, item in enumerate(item_serializers) if not item.is_valid()}
+    if errors and atomic:
+        return Response({'errors': errors}, status=status.HTTP_400_BAD_REQUEST)
+
+    valid = [item.validated_data for index, item in enumerate(item_serializers) if index not in errors]
+    products = iter(ProductBulkCreateSerializer.bulk_create(valid, request.user))
+    results = [
+        {'errors': errors[index]} if index in errors else {'id': next(products).id}
+        for index in range(len(items))
+    ]
+    return Response(
+        {'results': results}, status=status.HTTP_207_MULTI_STATUS if errors else status.HTTP_201_CREATED,
+    )
+
+
+@images.temporary_file_uploads
 @api_view(['POST'])
 @parser_classes([MultiPartParser, FileUploadParser])
 @permission_classes([IsAuthenticated])
 def upload_product_images(request, product_id):
+    # владельца проверяем до разбора и обработки файлов
+    product = Product.objects.filter(id=product_id).only('id', 'author_id', 'city_id').first()
+    if product is None:
+        return Response(status=404)
+    if product.author_id != request.user.id:
+        raise PermissionDenied("You are not the owner of this product")
     serializer = ProductImageSerializer(data=request.data, context={'request': request})
     if serializer.is_valid():
-        product = Product.objects.get(id=product_id)
-        if product.author != request.user:
-            raise PermissionDenied("You are not the owner of this product")
         serializer.save(product=product)
         return Response(status=201)
     else:
@@ -252,24 +316,74 @@ def delete_product_image(request, product_id, image_id):
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
 def create_or_delete_favorite(request, product_id):
-    if ProductFavorite.objects.filter(user_id=request.user.id, product_id=product_id).exists():
-        ProductFavorite.objects.filter(user_id=request.user.id, product_id=product_id).delete()
-        return Response(False, status=200)
-    else:
-        fav = ProductFavorite(user_id=request.user.id, product_id=product_id)
-        fav.save()
-        return Response(True, status=200)
+    is_favorite = ProductFavorite.objects.toggle(request.user.id, product_id)
+    if is_favorite is None:
+        return Response(status=404)
+    return Response(is_favorite, status=200)
+
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def sync_favorites(request):
+    """
+    Синхронизация избранного офлайн-клиентом за один запрос:
+    {"add": [id, ...], "remove": [id, ...]} -> затронутые id и итоговый список избранного.
+    """
+    if not isinstance(request.data, dict):
+        return Response({'error': 'Expected an object with add and remove'}, status=status.HTTP_400_BAD_REQUEST)
+    changes = {}
+    for key in ('add', 'remove'):
+        product_ids = request.data.get(key, [])
+        valid = isinstance(product_ids, list) and all(type(product_id) is int for product_id in product_ids)
+        if not valid:
+            return Response({key: 'Expected a list of product ids'}, status=status.HTTP_400_BAD_REQUEST)
+        changes[key] = set(product_ids)
+    if changes['add'] & changes['remove']:
+        return Response({'error': 'Product ids in both add and remove'}, status=status.HTTP_400_BAD_REQUEST)
+
+    with transaction.atomic():
+        removed = ProductFavorite.objects.remove(request.user.id, sorted(changes['remove']))
+        added = ProductFavorite.objects.add(request.user.id, sorted(changes['add']))
+    favorites = ProductFavorite.objects.filter(user_id=request.user.id).order_by('id')
+    return Response({
+        'added': sorted(added),
+        'removed': sorted(removed),
+        'favorites': list(favorites.values_list('product_id', flat=True)),
+    })
 
 
 class UserView(APIView):
     permission_classes = [IsAuthenticated]
-    authentication_classes = [JWTAuthentication]
+    authentication_classes = [CachedJWTAuthentication]
 
     def get(self, request):
-        serializer = UserSerializer(request.user, context={'request': request})
+        # request.user может быть из кэша аутентификации, а счётчики в профиле должны быть свежими
+        user = User.objects.get(pk=request.user.pk)
+        serializer = UserSerializer(user, context={'request': request})
         return Response(serializer.data)
 
 
+class UserFavoritesView(generics.ListAPIView):
+    """Избранные товары пользователя, последние добавленные первыми, постранично."""
+    permission_classes = [IsAuthenticated]
+    authentication_classes = [CachedJWTAuthentication]
+    pagination_class = KeysetPagination
+
+    def get_keyset_ordering(self, queryset):
+        return '-favorited_id',
+
+    def get_queryset(self):
+        # annotate() после filter() использует тот же JOIN с избранным
+        return Product.objects.filter(subscribers__user=self.request.user).annotate(
+            favorited_id=F('subscribers__id'),
+            is_favorite=Value(True, output_field=BooleanField()),
+        )
+
+    def list(self, request, *args, **kwargs):
+        page = self.paginate_queryset(cards.card_queryset(self.get_queryset()))
+        return self.get_paginated_response(cards.serialize_cards(page, {'request': request}))
+
+
 class UserCreateAPIView(generics.CreateAPIView):
     queryset = User.objects.all()
     serializer_class = UserCreateSerializer
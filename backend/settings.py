@@ -54,11 +54,13 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'app.query_stats.query_stats_middleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'app.routers.replica_routing_middleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'corsheaders.middleware.CorsMiddleware',
@@ -115,9 +117,12 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'backend.wsgi.application'
 
+# Асинхронные представления для чтения (app.async_views); backend/asgi.py включает их по умолчанию
+ASYNC_READ_VIEWS = os.environ.get('ASYNC_READ_VIEWS', '0') == '1'
+
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'app.authentication.CachedJWTAuthentication',
         'rest_framework.authentication.TokenAuthentication',
     ),
 }
@@ -130,16 +135,118 @@ SIMPLE_JWT = {
     'UPDATE_LAST_LOGIN': True,
 }
 
+# Сжатие таблиц чёрного списка JWT (app/tokens.py): интервал фонового потока в секундах
+# (0 — выключен, сжатие запускается командой compact_tokens по cron), размер пачки и
+# файл блокировки, по которому среди воркеров выбирается один исполнитель
+TOKEN_COMPACTION_INTERVAL = int(os.environ.get('TOKEN_COMPACTION_INTERVAL', '0'))
+TOKEN_COMPACTION_BATCH_SIZE = 1000
+TOKEN_COMPACTION_LOCK_FILE = os.environ.get(
+    'TOKEN_COMPACTION_LOCK_FILE', os.path.join(BASE_DIR, '.cache', 'token_compaction.lock'),
+)
+
+# Кэш пользователей для CachedJWTAuthentication (в памяти процесса)
+AUTH_USER_CACHE_SIZE = 10000
+AUTH_USER_CACHE_TIMEOUT = 30
+
 
 # Database
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases
 
+# app.backends.sqlite3 — SQLite с WAL и остальными PRAGMA для конкурентной нагрузки
+# (значения по умолчанию в app/backends/sqlite3/base.py). Соединения живут
+# DB_CONN_MAX_AGE секунд и переиспользуются между запросами.
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
+        'ENGINE': 'app.backends.sqlite3',
         'NAME': BASE_DIR / 'db1.sqlite3',
+        'CONN_MAX_AGE': int(os.environ.get('DB_CONN_MAX_AGE', '60')),
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            'transaction_mode': 'IMMEDIATE',
+            'pragmas': {
+                'journal_mode': 'WAL',
+                'synchronous': 'NORMAL',
+                'mmap_size': 256 * 1024 * 1024,
+                'cache_size': -64000,
+                'busy_timeout': 5000,
+                'temp_store': 'MEMORY',
+            },
+        },
+    }
+}
+
+# Реплики для чтения ленты и поиска (app/routers.py; справочники и всё, что
+# кэшируется под версией, читаются из основной базы): пути к файлам SQLite через
+# запятую, например DATABASE_REPLICAS=/var/db/replica1.sqlite3.
+# Для SQLite это копии основной базы, обновляемые командой sync_replicas; журнал —
+# DELETE, чтобы файл можно было атомарно подменить.
+DATABASE_REPLICAS = []
+for index, replica_name in enumerate(filter(None, os.environ.get('DATABASE_REPLICAS', '').split(','))):
+    DATABASE_REPLICAS.append(f'replica{index}')
+    DATABASES[f'replica{index}'] = {
+        **DATABASES['default'],
+        'NAME': replica_name,
+        'OPTIONS': {
+            **DATABASES['default']['OPTIONS'],
+            'pragmas': {**DATABASES['default']['OPTIONS']['pragmas'], 'journal_mode': 'DELETE'},
+        },
+        'TEST': {'MIRROR': 'default'},
+    }
+
+DATABASE_ROUTERS = ['app.routers.ReplicaRouter']
+# сколько секунд после записи пользователь читает только из основной базы
+REPLICA_STICKY_SECONDS = 5
+
+
+# Cache
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+
+# shared — общий для всех воркеров кэш счётчиков изменений (app.versions) и меток
+# чтения из основной базы после записи (app.routers): по счётчикам сбрасываются
+# дерево категорий, лента, ETag справочников и кэш пользователей JWT. LocMem у
+# каждого воркера свой, и изменение, сделанное в одном воркере, другие бы не
+# увидели. В продакшене это Redis (SHARED_CACHE_URL=redis://..., нужен пакет
+# redis). Без него используется файловый кэш — только для разработки: он общий
+# лишь для воркеров одной машины, а каждая запись в него просматривает весь
+# каталог, поэтому число файлов ограничено небольшим MAX_ENTRIES
+# (manage.py check --deploy предупреждает о таком кэше).
+if os.environ.get('SHARED_CACHE_URL'):
+    SHARED_CACHE = {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.environ['SHARED_CACHE_URL'],
+        'TIMEOUT': None,
+    }
+else:
+    SHARED_CACHE = {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.environ.get('SHARED_CACHE_DIR', os.path.join(BASE_DIR, '.cache', 'shared')),
+        'TIMEOUT': None,
+        'OPTIONS': {'MAX_ENTRIES': 2000},
     }
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'shared': SHARED_CACHE,
 }
+MODEL_VERSION_CACHE = 'shared'
+
+# Алиас кэша для копии дерева категорий; ключ копии содержит версию из
+# MODEL_VERSION_CACHE, поэтому устаревшее дерево не используется ни одним воркером
+CATEGORY_TREE_CACHE = 'default'
+
+# Бэкенд полнотекстового поиска товаров (app.search)
+PRODUCT_SEARCH_BACKEND = 'app.search.SqliteFTS5Backend'
+
+# Cache-Control: max-age для справочников (города, категории) и карточки товара (app.conditional)
+REFERENCE_DATA_MAX_AGE = 300
+PRODUCT_DETAIL_MAX_AGE = 60
+
+# Время жизни закэшированной страницы публичной ленты товаров, секунд (app.feed)
+FEED_CACHE_TIMEOUT = 300
+
+# Время жизни закэшированных фасетов поиска, секунд (app.facets)
+SEARCH_FACETS_CACHE_TIMEOUT = 60
 
 
 # Password validation
@@ -181,6 +288,55 @@ STATIC_URL = '/static/'
 MEDIA_ROOT = os.path.join(BASE_DIR, "media")
 MEDIA_URL = '/media/'
 
+# Превью изображений (app.images): максимальная сторона для каждого размера,
+# число потоков генерации, генерация в фоне и сколько имён готовых превью помнит процесс
+IMAGE_DERIVATIVE_SIZES = {'thumb': 160, 'card': 480, 'full': 1280}
+IMAGE_DERIVATIVE_WORKERS = 2
+IMAGE_DERIVATIVES_ASYNC = True
+IMAGE_READY_CACHE_SIZE = 100000
+
+# Загрузка изображений товаров: файлы пишутся во временные файлы, а не в память
+# (images.temporary_file_uploads на представлении загрузки), затем перекодируются в
+# IMAGE_UPLOAD_WORKERS потоков. Лимиты проверяются после приёма файлов, поэтому
+# размер тела запроса стоит ограничить и на веб-сервере
+IMAGE_UPLOAD_WORKERS = 4
+IMAGE_UPLOAD_MAX_SIDE = 2560
+PRODUCT_IMAGE_MAX_COUNT = 10
+PRODUCT_IMAGE_MAX_SIZE = 15 * 1024 * 1024
+PRODUCT_IMAGE_MAX_TOTAL_SIZE = 50 * 1024 * 1024
+
+# Максимальный размер пачки POST /product/bulk
+PRODUCT_BULK_CREATE_MAX_COUNT = 500
+
+# SQL-статистика запросов (app.query_stats): заголовок Server-Timing, строка лога
+# app.sql на каждый запрос (уровень INFO, включается SQL_LOG_LEVEL=INFO) и
+# медленный лог app.sql.slow (файл SQL_SLOW_LOG) с порогами ниже
+SQL_SLOW_QUERY_MS = int(os.environ.get('SQL_SLOW_QUERY_MS', '100'))
+SQL_SLOW_REQUEST_MS = int(os.environ.get('SQL_SLOW_REQUEST_MS', '1000'))
+SQL_SLOW_REQUEST_QUERIES = 50
+SQL_DUPLICATE_QUERIES = 10
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'plain': {'format': '%(asctime)s %(name)s %(levelname)s %(message)s'},
+    },
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler', 'formatter': 'plain'},
+        'slow_sql': {
+            'class': 'logging.handlers.WatchedFileHandler',
+            'filename': os.environ.get('SQL_SLOW_LOG', os.path.join(BASE_DIR, 'slow_sql.log')),
+            'delay': True,
+            'formatter': 'plain',
+        },
+    },
+    'loggers': {
+        'app.sql': {'handlers': ['console'], 'level': os.environ.get('SQL_LOG_LEVEL', 'WARNING'), 'propagate': False},
+        'app.sql.slow': {'handlers': ['slow_sql'], 'level': 'WARNING', 'propagate': False},
+    },
+}
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
 